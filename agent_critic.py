@@ -1,126 +1,274 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import json
+from profit_model import compile_profit_model, plan_drivers
+from sampling import (check_sampler, draw_driver, draw_samples, draw_uniforms, midpoints,
+                      replicate_chunk_size, uniforms_to_samples)
+from streaming_stats import Moments
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes, resolve_workers, run_tasks, seed_sequence
+from sample_store import check_store, read_columns
+from rendering import default_renderer
+from instrumentation import count, log, span
 
-def sensitivity_analysis(plan, n_simulations=10000):
+def sensitivity_analysis(plan, n_simulations=10000, seed=None, n_workers=None, samples=None,
+                         method='oat', sampler='random'):
     """
     Agent #3: The Risk/Critic
     Identifies which variables have the biggest impact on outcomes.
+    
+    method='oat' varies one driver at a time with the rest at their midpoints.
+    method='sobol' computes global first- and total-order Sobol indices
+    (Saltelli/Jansen estimators over n_simulations base samples), which also
+    capture interactions between drivers. Both feed the same ranked list.
+    
+    sampler='lhs', 'antithetic' or 'sobol' draws the varied drivers with a
+    variance-reduced sampler (see sampling.draw_uniforms). Both methods
+    then draw at least MIN_REPLICATES independent replicates: one-at-a-time
+    variances carry a 'variance_se' standard error, Sobol indices
+    'first_order_se' / 'total_order_se'.
+    
+    Every pass draws from its own generator spawned from one SeedSequence and
+    can run on n_workers processes (-1 = all cores); partial sums are merged
+    in a fixed order, so a given seed always gives the same ranking.
+    
+    Pass the SampleStore already used by run_monte_carlo_simulation as
+    `samples` to reuse its columns instead of re-drawing every driver
+    (one-at-a-time method only).
     """
     
-    print("🔍 Running sensitivity analysis...")
-    print("Testing which variables create the most uncertainty...\n")
+    log("🔍 Running sensitivity analysis...")
+    log("Testing which variables create the most uncertainty...\n")
+    
+    # Validate/compile the shared profit model before farming out work
+    compile_profit_model(plan)
+    drivers = plan_drivers(plan)
+    check_sampler(sampler)
+    
+    if method not in ('oat', 'sobol'):
+        raise ValueError(f"Unknown sensitivity method '{method}', expected 'oat' or 'sobol'")
+    if method == 'sobol' and samples is not None:
+        raise ValueError("method='sobol' draws its own A/B matrices and can't reuse a sample store")
+    
+    with span('critic.sensitivity', method=method, drivers=len(drivers), n_simulations=n_simulations):
+        if method == 'sobol':
+            effects = _sobol_effects(plan, n_simulations, seed, n_workers, sampler)
+            # f(A), f(B) and one f(A_B^i) block per driver
+            evaluations = (len(drivers) + 2) * n_simulations
+        else:
+            effects = _one_at_a_time_effects(plan, n_simulations, seed, n_workers, samples, sampler)
+            evaluations = len(drivers) * (samples.n_samples if samples is not None else n_simulations)
+    count('critic.evaluations', evaluations)
+    return rank_sensitivities(plan, effects)
+
+
+def rank_sensitivities(plan, effects):
+    """
+    Attach type and range to each driver's effect entry (one per driver,
+    in plan_drivers order), report them and rank drivers by variance.
+    Returns (sensitivities, ranked) as sensitivity_analysis does.
+    """
     
     sensitivities = {}
+    drivers = plan_drivers(plan)
+    n_revenue = len(plan['revenue_drivers'])
     
-    # Test each revenue driver
-    print("📈 REVENUE DRIVERS:")
-    for driver in plan['revenue_drivers']:
-        # Vary ONLY this driver, keep others at midpoint
-        varied = np.random.uniform(driver['min'], driver['max'], size=n_simulations)
-        
-        # Build revenue with this varied and others fixed
-        revenue_components = []
-        for d in plan['revenue_drivers']:
-            if d['name'] == driver['name']:
-                revenue_components.append(varied)
-            else:
-                midpoint = (d['min'] + d['max']) / 2
-                revenue_components.append(np.full(n_simulations, midpoint))
+    for i, driver in enumerate(drivers):
+        if i == 0 and n_revenue:
+            log("📈 REVENUE DRIVERS:")
+        if i == n_revenue:
+            log("💰 COST DRIVERS:")
         
-        # Calculate revenue
-        # Check if we have subscriber and price pattern
-        subscriber_vars = [i for i, d in enumerate(plan['revenue_drivers']) 
-                          if 'subscriber' in d['name'].lower() or 'customer' in d['name'].lower()]
-        price_vars = [i for i, d in enumerate(plan['revenue_drivers']) 
-                     if 'price' in d['name'].lower() or 'value' in d['name'].lower() or 'order' in d['name'].lower()]
+        entry = effects[i]
+        entry['type'] = 'revenue' if i < n_revenue else 'cost'
+        entry['range'] = (driver['min'], driver['max'])
+        sensitivities[driver['name']] = entry
         
-        if subscriber_vars and price_vars:
-            revenue = revenue_components[subscriber_vars[0]] * revenue_components[price_vars[0]]
+        log(f"  {driver['name']}")
+        if 'variance_se' in entry:
+            log(f"    Variance: {entry['variance']:,.0f} ± {entry['variance_se']:,.0f}")
         else:
-            revenue = sum(revenue_components)
-        
-        variance = np.var(revenue)
-        sensitivities[driver['name']] = {
-            'variance': variance,
-            'type': 'revenue',
-            'range': (driver['min'], driver['max'])
-        }
-        
-        print(f"  {driver['name']}")
-        print(f"    Variance: {variance:,.0f}")
-        print(f"    Range: ${driver['min']:,.0f} - ${driver['max']:,.0f}")
-        print()
-    
-    # Test each cost driver
-    print("💰 COST DRIVERS:")
-    for driver in plan['cost_drivers']:
-        # Vary ONLY this driver
-        varied = np.random.uniform(driver['min'], driver['max'], size=n_simulations)
-        variance = np.var(varied)
-        
-        sensitivities[driver['name']] = {
-            'variance': variance,
-            'type': 'cost',
-            'range': (driver['min'], driver['max'])
-        }
-        
-        print(f"  {driver['name']}")
-        print(f"    Variance: {variance:,.0f}")
-        print(f"    Range: ${driver['min']:,.0f} - ${driver['max']:,.0f}")
-        print()
+            log(f"    Variance: {entry['variance']:,.0f}")
+        if 'total_order_se' in entry:
+            log(f"    Sobol index: first-order {entry['first_order']:.3f} ± {entry['first_order_se']:.3f}, "
+                f"total-order {entry['total_order']:.3f} ± {entry['total_order_se']:.3f}")
+        elif 'total_order' in entry:
+            log(f"    Sobol index: first-order {entry['first_order']:.3f}, "
+                f"total-order {entry['total_order']:.3f}")
+        log(f"    Range: ${driver['min']:,.0f} - ${driver['max']:,.0f}")
+        log()
     
     # Rank by impact
     ranked = sorted(sensitivities.items(), key=lambda x: x[1]['variance'], reverse=True)
     
-    print("="*60)
-    print("🎯 RANKED BY IMPACT (Highest to Lowest):")
-    print("="*60)
+    log("="*60)
+    log("🎯 RANKED BY IMPACT (Highest to Lowest):")
+    log("="*60)
     for i, (name, data) in enumerate(ranked, 1):
-        print(f"{i}. {name}")
-        print(f"   Type: {data['type']}")
-        print(f"   Variance: {data['variance']:,.0f}")
-        print()
+        log(f"{i}. {name}")
+        log(f"   Type: {data['type']}")
+        log(f"   Variance: {data['variance']:,.0f}")
+        log()
     
     # Identify the critical variable
     top_var = ranked[0]
-    print("="*60)
-    print("💡 KEY INSIGHT:")
-    print("="*60)
-    print(f"'{top_var[0]}' has the BIGGEST impact on outcomes!")
-    print(f"Focus here to reduce risk or improve results.")
-    print()
+    log("="*60)
+    log("💡 KEY INSIGHT:")
+    log("="*60)
+    log(f"'{top_var[0]}' has the BIGGEST impact on outcomes!")
+    log(f"Focus here to reduce risk or improve results.")
+    log()
     
     return sensitivities, ranked
 
 
-def visualize_sensitivity(ranked):
-    """Visualize sensitivity analysis results"""
-    
-    names = [item[0] for item in ranked]
-    variances = [item[1]['variance'] for item in ranked]
-    colors = ['#2ecc71' if item[1]['type'] == 'revenue' else '#e74c3c' for item in ranked]
-    
-    plt.figure(figsize=(10, 6))
-    bars = plt.barh(names, variances, color=colors, alpha=0.7, edgecolor='black')
-    
-    plt.xlabel('Variance (Impact on Outcome)', fontsize=12)
-    plt.ylabel('Variable', fontsize=12)
-    plt.title('Sensitivity Analysis: Which Variables Matter Most?', fontsize=14, fontweight='bold')
-    plt.grid(axis='x', alpha=0.3)
-    
-    # Add legend
-    from matplotlib.patches import Patch
-    legend_elements = [
-        Patch(facecolor='#2ecc71', alpha=0.7, label='Revenue Driver'),
-        Patch(facecolor='#e74c3c', alpha=0.7, label='Cost Driver')
-    ]
-    plt.legend(handles=legend_elements)
-    
-    plt.tight_layout()
-    plt.savefig('sensitivity_analysis.png', dpi=150)
-    print("📊 Sensitivity graph saved as 'sensitivity_analysis.png'")
-    plt.show()
+def _one_at_a_time_effects(plan, n_simulations, seed, n_workers, samples, sampler):
+    """
+    Profit variance with each driver varied alone, one entry per driver.
+    With a variance-reduced sampler every chunk is an independent
+    replicate, and the spread of their variances gives 'variance_se'.
+    """
+    
+    drivers = plan_drivers(plan)
+    tasks = []
+    if samples is not None:
+        check_store(samples, plan)
+        sources = samples.chunk_sources(DEFAULT_CHUNK_SIZE, parallel=resolve_workers(n_workers) > 1)
+        for i in range(len(drivers)):
+            tasks.extend((plan, i, source, None) for source in sources)
+    else:
+        sizes = chunk_sizes(n_simulations, replicate_chunk_size(sampler, n_simulations, DEFAULT_CHUNK_SIZE))
+        for i, driver_seed in enumerate(seed_sequence(seed).spawn(len(drivers))):
+            tasks.extend((plan, i, (chunk_seed, size), sampler)
+                         for chunk_seed, size in zip(driver_seed.spawn(len(sizes)), sizes))
+    parts = run_tasks(_vary_one_driver, tasks, n_workers)
+    n_chunks = len(tasks) // max(len(drivers), 1)
+    
+    effects = []
+    for i in range(len(drivers)):
+        replicates = parts[i * n_chunks:(i + 1) * n_chunks]
+        moments = Moments()
+        for part in replicates:
+            moments.merge(part)
+        entry = {'variance': moments.variance}
+        if samples is None and sampler != 'random':
+            variances = np.array([part.variance for part in replicates])
+            entry['variance_se'] = float(variances.std(ddof=1) / np.sqrt(len(replicates)))
+        effects.append(entry)
+    return effects
+
+
+def _vary_one_driver(task):
+    """
+    Profit moments for one chunk with a single driver varied and every other
+    driver held at its midpoint (broadcast as a scalar, never materialized).
+    """
+    plan, index, source, sampler = task
+    
+    model = compile_profit_model(plan)
+    drivers = plan_drivers(plan)
+    with span('critic.vary_driver', driver=drivers[index]['name']):
+        columns = list(midpoints(drivers))
+        if isinstance(source[0], np.random.SeedSequence):
+            seed, size = source
+            columns[index] = draw_driver(drivers[index], size, np.random.default_rng(seed), sampler)
+        else:
+            size = source[2]
+            columns[index] = read_columns(source)[index]
+        
+        moments = Moments()
+        moments.update(model.evaluate(columns, out=np.empty(size)))
+    return moments
+
+
+def _sobol_effects(plan, n_simulations, seed, n_workers, sampler):
+    """
+    First-order (Saltelli 2010) and total-order (Jansen) Sobol indices.
+    Each chunk evaluates an (N x (2+k)) block: f(A), f(B) and f(A_B^i) for
+    every driver i, where A_B^i is A with row i taken from B.
+    The estimators assume independent drivers, so plan correlations are ignored here.
+    """
+    
+    n_drivers = len(plan_drivers(plan))
+    # Keep the (2+k) x chunk evaluation block about as large as a normal chunk
+    chunk = max(1024, DEFAULT_CHUNK_SIZE // (n_drivers + 2))
+    sizes = chunk_sizes(n_simulations, replicate_chunk_size(sampler, n_simulations, chunk))
+    tasks = [(plan, (child, size), sampler)
+             for child, size in zip(seed_sequence(seed).spawn(len(sizes)), sizes)]
+    parts = run_tasks(_sobol_chunk, tasks, n_workers)
+    
+    moments = Moments()
+    first_sums = np.zeros(n_drivers)
+    total_sums = np.zeros(n_drivers)
+    for part_moments, part_first, part_total in parts:
+        moments.merge(part_moments)
+        first_sums += part_first
+        total_sums += part_total
+    
+    variance = moments.variance
+    first_order = first_sums / n_simulations / variance
+    total_order = total_sums / (2 * n_simulations) / variance
+    effects = [{'variance': float(total_order[i] * variance),
+                'first_order': float(first_order[i]),
+                'total_order': float(total_order[i])}
+               for i in range(n_drivers)]
+    
+    if sampler != 'random':
+        # Every chunk is an independent replicate of both indices
+        first = np.array([f / m.count * 2 / m.variance for m, f, _ in parts])
+        total = np.array([t / m.count / m.variance for m, _, t in parts])
+        first_se = first.std(axis=0, ddof=1) / np.sqrt(len(parts))
+        total_se = total.std(axis=0, ddof=1) / np.sqrt(len(parts))
+        for i, entry in enumerate(effects):
+            entry['first_order_se'] = float(first_se[i])
+            entry['total_order_se'] = float(total_se[i])
+    return effects
+
+
+def _sobol_chunk(task):
+    """Saltelli evaluation block for one chunk; returns mergeable partial sums."""
+    plan, (seed, size), sampler = task
+    
+    model = compile_profit_model(plan)
+    drivers = plan_drivers(plan)
+    rng = np.random.default_rng(seed)
+    if sampler == 'random':
+        a = draw_samples(drivers, size, rng)
+        b = draw_samples(drivers, size, rng)
+    else:
+        # A and B are the two halves of one 2k-dimensional stratified/quasi-random design
+        u = draw_uniforms(2 * len(drivers), size, rng, sampler)
+        a = uniforms_to_samples(drivers, u[:len(drivers)])
+        b = uniforms_to_samples(drivers, u[len(drivers):])
+    
+    y = np.empty((len(drivers) + 2, size))
+    model.evaluate(a, out=y[0])
+    model.evaluate(b, out=y[1])
+    columns = list(a)
+    for i in range(len(drivers)):
+        columns[i] = b[i]
+        model.evaluate(columns, out=y[2 + i])
+        columns[i] = a[i]
+    
+    moments = Moments()
+    moments.update(y[0])
+    moments.update(y[1])
+    
+    # In place: rows 2.. become f(A_B^i) - f(A)
+    deltas = y[2:]
+    deltas -= y[0]
+    first_sums = deltas @ y[1]
+    total_sums = np.einsum('ij,ij->i', deltas, deltas)
+    return moments, first_sums, total_sums
+
+
+def visualize_sensitivity(ranked, renderer=None):
+    """
+    Render the sensitivity bar chart headlessly in the background, under
+    the renderer's run directory. Returns a Future for the PNG path.
+    """
+    renderer = renderer or default_renderer()
+    future = renderer.render_sensitivity(ranked)
+    log(f"📊 Sensitivity graph rendering to '{future.path}'")
+    return future
 
 
 # Test it
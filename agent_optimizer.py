@@ -0,0 +1,320 @@
+import itertools
+import numpy as np
+from distributions import get_distribution
+from profit_model import compile_profit_model, plan_drivers
+from sampling import uniforms_to_samples
+from copula import plan_copula
+from plan_schema import LEVER_MODES
+from risk_metrics import partial_select
+from parallel_backend import resolve_workers, run_tasks, seed_sequence
+from instrumentation import count, log, span
+
+# Points per lever range on the first pass and on every refinement round
+DEFAULT_STEPS = 9
+DEFAULT_CVAR_ALPHA = 0.05
+
+
+def lever_values(spec):
+    """
+    The settings a lever is searched over. A list is taken as given (a
+    number pins the driver, a dict overrides driver fields, as in
+    scenario_comparison.parameter_grid); a range {"low", "high", "steps"}
+    gives `steps` evenly spaced values.
+    """
+    if isinstance(spec, dict):
+        return np.linspace(spec['low'], spec['high'], int(spec.get('steps', DEFAULT_STEPS))).tolist()
+    return list(spec)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_levers(plan, levers):
+    """Raise ValueError for malformed levers; with plan=None the driver names aren't checked."""
+    if not isinstance(levers, dict) or not levers:
+        raise ValueError("levers must be a non-empty object mapping driver names to settings")
+    if plan is not None:
+        unknown = set(levers) - {d['name'] for d in plan_drivers(plan)}
+        if unknown:
+            raise ValueError(f"Unknown drivers in levers: {sorted(unknown)}")
+    for name, spec in levers.items():
+        if isinstance(spec, dict):
+            if spec.get('mode', 'set') not in LEVER_MODES:
+                raise ValueError(f"Lever '{name}' has unknown mode '{spec['mode']}', expected one of {LEVER_MODES}")
+            if not _is_number(spec.get('low')) or not _is_number(spec.get('high')):
+                raise ValueError(f"Lever '{name}' needs numeric 'low' and 'high'")
+            if not spec['low'] <= spec['high']:
+                raise ValueError(f"Lever '{name}' needs low <= high")
+            if 'steps' in spec and (not isinstance(spec['steps'], int) or spec['steps'] < 1):
+                raise ValueError(f"Lever '{name}' needs a positive integer 'steps'")
+        elif not isinstance(spec, (list, tuple)) or not spec:
+            raise ValueError(f"Lever '{name}' has no settings")
+
+
+def _label(names, modes, settings):
+    symbols = {'set': '=', 'cap': ' ≤ ', 'floor': ' ≥ '}
+    parts = []
+    for name, mode, setting in zip(names, modes, settings):
+        value = setting if isinstance(setting, dict) else f"{setting:,.4g}"
+        parts.append(f"{name}{symbols[mode]}{value}")
+    return ', '.join(parts)
+
+
+def optimize_decision(plan, levers, n_simulations=10000, seed=None, n_workers=None,
+                      min_probability_profitable=None, min_cvar=None, cvar_alpha=DEFAULT_CVAR_ALPHA,
+                      refine=2):
+    """
+    Agent #5: The Optimizer
+    Searches the controllable drivers ("levers") for the configuration with
+    the highest expected profit that still meets the risk constraints.
+
+    `levers` maps driver names to the settings to search (see lever_values):
+        {'subscription_price': {'low': 20, 'high': 40},
+         'monthly_operations': {'low': 5000, 'high': 9000, 'mode': 'cap'}}
+    mode 'set' (the default) pins the driver to the value, 'cap' clips its
+    draws at the value (a cost cap) and 'floor' raises them to it.
+
+    Constraints: min_probability_profitable (percent, e.g. 80) and
+    min_cvar, a floor on the mean profit of the worst cvar_alpha share of
+    scenarios (CVaR, e.g. -5000 for "lose at most $5,000 on average in the
+    worst 5%").
+
+    Every candidate is scored on the same fixed evaluation matrix, drawn
+    once from `seed` (common random numbers), so differences between
+    candidates are their real differences and each one costs a single
+    vectorized pass of the profit expression. The grid over all levers is
+    split across n_workers processes (-1 = all cores); each worker redraws
+    the identical matrix, so results don't depend on the worker count.
+    Range levers are then refined `refine` times on a finer grid around
+    the best point.
+
+    Returns the best 'levers' and their 'label', its 'metrics', whether it
+    is 'feasible', the plan as given ('baseline') on the same scenarios,
+    the paired 'improvement' over it with its standard error, and every
+    evaluated candidate in 'candidates', best first. When no candidate
+    meets the constraints the one violating the fewest is returned with
+    feasible=False.
+
+    'one_directional' lists the range levers along which mean profit only
+    ever rises or only ever falls and whose best value is an end of the
+    range: for those the search found the bound, not a trade-off. When it
+    covers every lever the result is no recommendation (see
+    recommends_levers).
+    """
+    compile_profit_model(plan)
+    _check_levers(plan, levers)
+    names = list(levers)
+    modes = [levers[name].get('mode', 'set') if isinstance(levers[name], dict) else 'set' for name in names]
+    constraints = {'min_probability_profitable': min_probability_profitable, 'min_cvar': min_cvar,
+                   'cvar_alpha': cvar_alpha}
+    root = seed_sequence(seed)
+    workers = resolve_workers(n_workers)
+
+    log(f"🧭 Optimizing {', '.join(names)} on {n_simulations:,} common random scenarios...")
+    log()
+
+    evaluated = {}
+    baseline = None
+    ranges = {name: (levers[name]['low'], levers[name]['high']) for name in names if isinstance(levers[name], dict)}
+    with span('optimizer.run', levers=len(names), n_simulations=n_simulations, workers=workers) as run_span:
+        for round_ in range(refine + 1 if ranges else 1):
+            grid = [lever_values(dict(levers[name], low=ranges[name][0], high=ranges[name][1]))
+                    if name in ranges else lever_values(levers[name]) for name in names]
+            candidates = [c for c in itertools.product(*grid) if _key(c) not in evaluated]
+            if not candidates:
+                break
+            batches = [candidates[i::workers] for i in range(min(workers, len(candidates)))]
+            tasks = [(plan, names, modes, batch, n_simulations, root, cvar_alpha) for batch in batches]
+            with span('optimizer.round', round=round_, candidates=len(candidates)):
+                parts = run_tasks(_evaluate_candidates, tasks, workers)
+            count('optimizer.candidates', len(candidates))
+            for batch, (baseline, scored) in zip(batches, parts):
+                for settings, score in zip(batch, scored):
+                    evaluated[_key(settings)] = (settings, score)
+
+            best = _rank(evaluated.values(), constraints)[0][0]
+            for name, setting in zip(names, best):
+                if name in ranges:
+                    # Zoom in to one grid step either side of the best value
+                    low, high = levers[name]['low'], levers[name]['high']
+                    steps = int(levers[name].get('steps', DEFAULT_STEPS))
+                    step = (ranges[name][1] - ranges[name][0]) / max(steps - 1, 1)
+                    ranges[name] = (max(low, setting - step), min(high, setting + step))
+        run_span.set('candidates', len(evaluated))
+
+    ranked = _rank(evaluated.values(), constraints)
+    settings, score = ranked[0]
+    results = {
+        'levers': {name: {'mode': mode, 'value': setting} for name, mode, setting in zip(names, modes, settings)},
+        'label': _label(names, modes, settings),
+        'metrics': score['metrics'],
+        'feasible': score['feasible'],
+        'baseline': baseline,
+        'improvement': score['improvement'],
+        'improvement_std_error': score['improvement_std_error'],
+        'constraints': constraints,
+        'one_directional': _one_directional(names, levers, evaluated.values(), settings),
+        'n_candidates': len(evaluated),
+        'n_simulations': n_simulations,
+        'seed': root.entropy,
+        'candidates': [{'label': _label(names, modes, s), 'feasible': c['feasible'], **c['metrics'],
+                        'improvement': c['improvement']} for s, c in ranked],
+    }
+    if not results['feasible']:
+        log("⚠️  No lever setting meets every constraint; reporting the closest one")
+        log()
+    if not recommends_levers(results):
+        log("⚠️  Profit only moves one way along every lever; the best setting is just the range ends")
+        log()
+    return results
+
+
+def recommends_levers(results):
+    """Whether optimize_decision found a trade-off, not just the ends of every lever's range."""
+    return len(results['one_directional']) < len(results['levers'])
+
+
+def _one_directional(names, levers, evaluated, best):
+    """Range levers with mean profit monotone along them (other levers fixed) and the best value at a bound."""
+    evaluated = list(evaluated)
+    flat = []
+    for j, name in enumerate(names):
+        spec = levers[name]
+        if not isinstance(spec, dict) or best[j] not in (spec['low'], spec['high']):
+            continue
+        lines = {}
+        for settings, score in evaluated:
+            others = _key(settings[:j] + settings[j + 1:])
+            lines.setdefault(others, []).append((settings[j], score['metrics']['mean_profit']))
+        steps = np.concatenate([np.diff([profit for _, profit in sorted(line)]) for line in lines.values()])
+        # Common random numbers make the candidates' profits exactly comparable; allow only rounding
+        tolerance = 1e-9 * max(abs(score['metrics']['mean_profit']) for _, score in evaluated)
+        if np.all(steps >= -tolerance) or np.all(steps <= tolerance):
+            flat.append(name)
+    return flat
+
+
+def _key(settings):
+    # Dict settings aren't hashable; their sorted items are
+    return tuple(tuple(sorted(s.items())) if isinstance(s, dict) else s for s in settings)
+
+
+def _violations(metrics, constraints):
+    violated = 0
+    if constraints['min_probability_profitable'] is not None:
+        violated += metrics['probability_profitable'] < constraints['min_probability_profitable']
+    if constraints['min_cvar'] is not None:
+        violated += -metrics['expected_shortfall'] < constraints['min_cvar']
+    return violated
+
+
+def _rank(evaluated, constraints):
+    """(settings, score) pairs, feasible ones by mean profit first, then by fewest violated constraints."""
+    ranked = []
+    for settings, score in evaluated:
+        violated = _violations(score['metrics'], constraints)
+        score['feasible'] = violated == 0
+        ranked.append((violated, -score['metrics']['mean_profit'], settings, score))
+    ranked.sort(key=lambda entry: entry[:2])
+    return [(settings, score) for _, _, settings, score in ranked]
+
+
+def _metrics(profit, cvar_alpha):
+    """
+    Expected profit and the risk figures the constraints look at; VaR and
+    expected shortfall (CVaR) are losses at cvar_alpha, as in risk_metrics.
+    """
+    (quantile,), (tail_mean,), _, _ = partial_select(profit, [cvar_alpha], [cvar_alpha])
+    return {
+        'mean_profit': float(profit.mean()),
+        'std_dev': float(profit.std()),
+        'probability_profitable': float(np.count_nonzero(profit > 0) / profit.size * 100),
+        'value_at_risk': float(-quantile),
+        'expected_shortfall': float(-tail_mean),
+    }
+
+
+def _evaluate_candidates(task):
+    """Score a batch of lever settings (and the plan as given) on the shared evaluation matrix."""
+    plan, names, modes, batch, n_simulations, seed, cvar_alpha = task
+
+    drivers = plan_drivers(plan)
+    model = compile_profit_model(plan)
+    rows = {name: [i for i, d in enumerate(drivers) if d['name'] == name] for name in names}
+
+    # The fixed evaluation matrix: correlated uniforms and the driver values they map to
+    uniforms = np.random.default_rng(seed).random((len(drivers), n_simulations))
+    copula = plan_copula(plan)
+    if copula is not None:
+        copula.correlate(uniforms)
+    samples = uniforms_to_samples(drivers, uniforms.copy())
+
+    baseline = model.evaluate(samples)
+    profit = np.empty(n_simulations)
+    scored = []
+    for settings in batch:
+        columns = list(samples)
+        for name, mode, setting in zip(names, modes, settings):
+            for i in rows[name]:
+                columns[i] = _lever_column(drivers[i], mode, setting, uniforms[i], samples[i])
+        model.evaluate(columns, out=profit)
+        difference = profit - baseline
+        scored.append({
+            'metrics': _metrics(profit, cvar_alpha),
+            'improvement': float(difference.mean()),
+            'improvement_std_error': float(difference.std() / np.sqrt(n_simulations)),
+        })
+    return _metrics(baseline, cvar_alpha), scored
+
+
+def _lever_column(driver, mode, setting, uniforms, samples):
+    """A driver's column under one lever setting, from the shared uniforms/samples."""
+    if isinstance(setting, dict):
+        adjusted = {**driver, **setting}
+        return get_distribution(adjusted).ppf(uniforms.copy(), adjusted)
+    if mode == 'cap':
+        return np.minimum(samples, setting)
+    if mode == 'floor':
+        return np.maximum(samples, setting)
+    # Pinned drivers broadcast as scalars
+    return float(setting)
+
+
+def print_optimization(results):
+    """Best lever settings against the plan as given."""
+    metrics, baseline = results['metrics'], results['baseline']
+    print("="*60)
+    print(f"🧭 OPTIMIZED LEVERS ({results['n_candidates']} settings, {results['n_simulations']:,} scenarios)")
+    print("="*60)
+    print(f"Best: {results['label']}{'' if results['feasible'] else ' (constraints not met)'}")
+    if results['one_directional']:
+        print(f"   Profit only moves one way along {', '.join(results['one_directional'])}: "
+              f"the value shown is the end of its range, not a trade-off")
+    print(f"   Mean profit: ${metrics['mean_profit']:,.0f} vs ${baseline['mean_profit']:,.0f} as planned "
+          f"({results['improvement']:+,.0f} ± {results['improvement_std_error']:,.0f})")
+    print(f"   Probability profitable: {metrics['probability_profitable']:.1f}% "
+          f"vs {baseline['probability_profitable']:.1f}%")
+    print(f"   Expected shortfall (worst {results['constraints']['cvar_alpha']:.0%}): "
+          f"${metrics['expected_shortfall']:,.0f} vs ${baseline['expected_shortfall']:,.0f}")
+    print()
+    for i, row in enumerate(results['candidates'][1:5], 2):
+        print(f"{i}. {row['label']}: ${row['mean_profit']:,.0f}, "
+              f"{row['probability_profitable']:.1f}% profitable{'' if row['feasible'] else ' (infeasible)'}")
+    print()
+
+
+if __name__ == "__main__":
+    from agent_planner import plan_decision
+
+    question = "Should we launch a premium coffee subscription service?"
+    plan = plan_decision(question)
+
+    price = next((d for d in plan_drivers(plan) if 'price' in d['name']), plan['revenue_drivers'][-1])
+    cost = plan['cost_drivers'][0]
+    levers = plan.get('levers') or {
+        price['name']: {'low': price['min'], 'high': price['max']},
+        cost['name']: {'low': cost['min'], 'high': cost['max'], 'mode': 'cap'},
+    }
+    results = optimize_decision(plan, levers, n_simulations=100000, min_probability_profitable=80)
+    print_optimization(results)
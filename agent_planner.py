@@ -1,85 +1,203 @@
+import asyncio
 import ollama
 import json
-import re
+import time
+from plan_cache import default_plan_cache, plan_cache_key
+from plan_schema import PLAN_SCHEMA, PlanningError, format_errors, validate_plan
+from ollama_pool import OllamaClientPool, gather_in_order
+from instrumentation import count, log, record_llm_response, span
 
-def plan_decision(business_question):
-    """
-    Agent #1: The Planner
-    Takes a vague business question and structures it into simulation variables.
-    """
-    
-    prompt = f"""You are a business analyst. Structure this decision for Monte Carlo simulation.
+DEFAULT_MODEL = 'llama3.2'
+MAX_REPAIRS = 2
+
+PLAN_PROMPT_TEMPLATE = """You are a business analyst. Structure this decision for Monte Carlo simulation.
 
 Business Question: {business_question}
 
-Create a valid JSON with revenue drivers, cost drivers, and assumptions.
-Each driver needs: name, min value, max value, and description.
+Create a valid JSON with revenue drivers, cost drivers, a profit expression, and assumptions.
+Each driver needs: name (snake_case), min value, max value (min <= max), unit,
+distribution, and description.
+distribution is one of: uniform, normal or lognormal (min/max span the middle 95%),
+triangular or pert (also give "mode", the most likely value), or empirical
+(also give "data", a list of historical values).
+The profit_expression combines driver names with + - * / and parentheses.
+Optionally add "correlations" for drivers that move together, e.g.
+[{{"drivers": ["monthly_subscribers", "monthly_operations"], "rho": 0.6}}] (rho between -1 and 1).
+Drivers that change month to month may add "dynamics", e.g.
+{{"growth": 0.03, "churn": 0.02, "volatility": 0.1, "persistence": 0.8}} (monthly rates;
+growth - churn must be greater than -1).
+Optionally add "levers" for drivers the business sets itself, and only when the
+profit_expression makes them a trade-off (e.g. a higher price also lowers demand), e.g.
+{{"subscription_price": {{"low": 20, "high": 40}}}} ("mode": "cap" or "floor" to limit a driver instead of setting it).
 
 Example format:
 {{
   "decision": "description here",
   "revenue_drivers": [
-    {{"name": "monthly_subscribers", "min": 100, "max": 500, "description": "number of paying subscribers"}}
+    {{"name": "monthly_subscribers", "min": 100, "max": 500, "unit": "subscribers", "distribution": "uniform", \
+"description": "number of paying subscribers"}},
+    {{"name": "subscription_price", "min": 20, "max": 40, "unit": "USD per month", "distribution": "uniform", \
+"description": "monthly price per subscriber"}}
   ],
   "cost_drivers": [
-    {{"name": "monthly_operations", "min": 3000, "max": 8000, "description": "operational costs per month"}}
+    {{"name": "monthly_operations", "min": 3000, "max": 8000, "mode": 4500, "unit": "USD per month", \
+"distribution": "triangular", "description": "operational costs per month"}}
   ],
+  "profit_expression": "monthly_subscribers * subscription_price - monthly_operations",
   "assumptions": ["assumption 1", "assumption 2"]
 }}
 
 Return ONLY valid JSON."""
+
+REPAIR_PROMPT = """That plan is not valid:
+{errors}
+
+Return the corrected plan as JSON only."""
+
+# Cached plans are only reusable while the prompt and the schema they were validated against are unchanged
+_CACHE_TEMPLATE = PLAN_PROMPT_TEMPLATE + json.dumps(PLAN_SCHEMA, sort_keys=True)
+
+
+def plan_decision(business_question, model=DEFAULT_MODEL, cache=None, use_cache=True, refresh=False,
+                  max_repairs=MAX_REPAIRS):
+    """
+    Agent #1: The Planner
+    Takes a vague business question and structures it into simulation variables.
     
-    response = ollama.chat(
-        model='llama3.2',
-        messages=[
-            {'role': 'user', 'content': prompt}
-        ]
-    )
+    Decoding is constrained to PLAN_SCHEMA through Ollama's `format`, and the
+    reply is validated with plan_schema.validate_plan. Invalid replies are
+    sent back with the list of problems up to max_repairs times; if the plan
+    is still invalid a PlanningError carrying the structured errors is raised.
     
-    # Extract JSON from response
-    text = response['message']['content']
+    Valid plans are cached on disk, keyed by the normalized question, model,
+    prompt template and schema (see plan_cache). use_cache=False bypasses the
+    cache entirely; refresh=True skips the lookup but stores the fresh plan.
+    """
     
-    # Clean up common issues
-    if '```json' in text:
-        text = text.split('```json')[1].split('```')[0]
-    elif '```' in text:
-        text = text.split('```')[1].split('```')[0]
+    with span('planner.plan', model=model) as plan_span:
+        cache, key, cached = _lookup_plan(business_question, model, cache, use_cache, refresh)
+        plan_span.set('cache_hit', cached is not None)
+        if cached is not None:
+            return cached
+        
+        messages = [{'role': 'user', 'content': build_plan_prompt(business_question)}]
+        started = time.perf_counter()
+        for attempt in range(max_repairs + 1):
+            with span('planner.llm', attempt=attempt):
+                response = ollama.chat(model=model, messages=messages, format=PLAN_SCHEMA)
+                record_llm_response(response)
+            text = response['message']['content']
+            with span('planner.validate'):
+                plan, errors = parse_plan_response(text)
+            if not errors:
+                plan_span.set('attempts', attempt + 1)
+                return _store_plan(business_question, plan, cache, key, model, started)
+            count('planner.repairs')
+            _add_repair_turn(messages, text, errors)
+        
+        raise _planning_error(errors, text, max_repairs + 1)
+
+
+async def plan_decision_async(business_question, pool, model=DEFAULT_MODEL, cache=None,
+                              use_cache=True, refresh=False, max_repairs=MAX_REPAIRS):
+    """
+    Async plan_decision on a shared OllamaClientPool (see ollama_pool),
+    with the same validation, repair and caching behaviour.
+    """
     
-    text = text.strip()
+    with span('planner.plan', model=model) as plan_span:
+        cache, key, cached = _lookup_plan(business_question, model, cache, use_cache, refresh)
+        plan_span.set('cache_hit', cached is not None)
+        if cached is not None:
+            return cached
+        
+        messages = [{'role': 'user', 'content': build_plan_prompt(business_question)}]
+        started = time.perf_counter()
+        for attempt in range(max_repairs + 1):
+            with span('planner.llm', attempt=attempt):
+                response = await pool.chat(model=model, messages=messages, format=PLAN_SCHEMA)
+                record_llm_response(response)
+            text = response['message']['content']
+            with span('planner.validate'):
+                plan, errors = parse_plan_response(text)
+            if not errors:
+                plan_span.set('attempts', attempt + 1)
+                return _store_plan(business_question, plan, cache, key, model, started)
+            count('planner.repairs')
+            _add_repair_turn(messages, text, errors)
+        
+        raise _planning_error(errors, text, max_repairs + 1)
+
+
+async def plan_decisions_async(questions, pool, **kwargs):
+    """
+    Plan many questions concurrently over one pool. Results come back in
+    input order; a question that fails yields its exception (a
+    PlanningError for invalid plans) in place of a plan.
+    """
+    return await gather_in_order(lambda q: plan_decision_async(q, pool, **kwargs), questions)
+
+
+def plan_decisions(questions, concurrency=4, host=None, timeout=120.0, retries=3, **kwargs):
+    """Blocking batch wrapper around plan_decisions_async with its own client pool."""
     
-    # Try to fix common JSON errors
-    # Fix missing closing brackets
-    if text.count('[') > text.count(']'):
-        text = text + ']' * (text.count('[') - text.count(']'))
-    if text.count('{') > text.count('}'):
-        text = text + '}' * (text.count('{') - text.count('}'))
+    async def run():
+        async with OllamaClientPool(host, concurrency, timeout, retries) as pool:
+            return await plan_decisions_async(questions, pool, **kwargs)
     
+    return asyncio.run(run())
+
+
+def build_plan_prompt(business_question):
+    """Planner prompt for one question."""
+    return PLAN_PROMPT_TEMPLATE.format(business_question=business_question)
+
+
+def parse_plan_response(text):
+    """
+    Parse and validate an LLM reply.
+    Returns (plan, errors); errors is empty when the plan is valid.
+    """
     try:
-        result = json.loads(text)
-        return result
+        plan = json.loads(text)
     except json.JSONDecodeError as e:
-        print("❌ JSON parsing failed!")
-        print(f"Error: {e}")
-        print(f"Raw response:\n{text}\n")
-        
-        # Return a simple default structure
-        print("⚠️  Using default structure instead...")
-        return {
-            "decision": business_question,
-            "revenue_drivers": [
-                {"name": "customers_per_day", "min": 50, "max": 150, "description": "daily customers"},
-                {"name": "avg_order_value", "min": 20, "max": 50, "description": "average order in dollars"}
-            ],
-            "cost_drivers": [
-                {"name": "fixed_monthly_costs", "min": 5000, "max": 15000, "description": "monthly fixed costs"},
-                {"name": "variable_cost_per_unit", "min": 5, "max": 15, "description": "cost per order"}
-            ],
-            "assumptions": [
-                "Market demand remains stable",
-                "No major competitors enter market",
-                "Operating costs don't spike"
-            ]
-        }
+        return None, [{'path': '', 'message': f"reply is not valid JSON: {e}"}]
+    return plan, validate_plan(plan)
+
+
+def _add_repair_turn(messages, text, errors):
+    messages.append({'role': 'assistant', 'content': text})
+    messages.append({'role': 'user', 'content': REPAIR_PROMPT.format(errors=format_errors(errors))})
+
+
+def _planning_error(errors, text, attempts):
+    return PlanningError(
+        f"Planner returned an invalid plan after {attempts} attempt(s)",
+        errors=errors, raw_response=text, attempts=attempts
+    )
+
+
+def _lookup_plan(business_question, model, cache, use_cache, refresh):
+    key = plan_cache_key(business_question, model, _CACHE_TEMPLATE)
+    if not use_cache:
+        return None, key, None
+    
+    cache = cache or default_plan_cache()
+    if refresh:
+        return cache, key, None
+    
+    cached = cache.get(key)
+    if cached is not None:
+        count('planner.cache_hits')
+        log("♻️  Using cached plan")
+    return cache, key, cached
+
+
+def _store_plan(business_question, plan, cache, key, model, started):
+    if cache is not None:
+        cache.put(key, plan, llm_seconds=time.perf_counter() - started,
+                  question=business_question, model=model)
+    return plan
 
 
 # Test it
@@ -90,7 +208,14 @@ if __name__ == "__main__":
     print(f"Question: {question}")
     print("\n" + "="*60 + "\n")
     
-    plan = plan_decision(question)
+    try:
+        plan = plan_decision(question)
+    except PlanningError as e:
+        print("❌ Planning failed!")
+        print(json.dumps(e.to_dict(), indent=2))
+        raise SystemExit(1)
     
     print("✅ STRUCTURED PLAN:")
-    print(json.dumps(plan, indent=2))
\ No newline at end of file
+    print(json.dumps(plan, indent=2))
+    print()
+    print(f"🗄️  Plan cache: {default_plan_cache().lifetime_stats()}")
\ No newline at end of file
@@ -1,105 +1,328 @@
+import math
+import time
 import numpy as np
-import matplotlib.pyplot as plt
 import json
+from profit_model import compile_profit_model, plan_drivers
+from sampling import MIN_REPLICATES, check_sampler, draw_samples, driver_means, replicate_chunk_size
+from copula import plan_copula
+from streaming_stats import (ESTIMATE_KEYS, ControlVariateSums, StreamingStats, histogram_counts,
+                             iid_standard_errors, replicate_standard_errors)
+from risk_metrics import DEFAULT_LEVELS, streaming_risk_metrics, summarize_profits
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes, resolve_workers, run_tasks, seed_sequence
+from sample_store import check_store, read_columns
+from rendering import default_renderer
+from instrumentation import count, log, span
 
-def run_monte_carlo_simulation(plan, n_simulations=10000):
+# Adaptive runs start with MIN_REPLICATES batches of this many scenarios
+ADAPTIVE_BATCH_SIZE = 1000
+# ...and pair batches up (doubling their size) whenever there are more than this
+MAX_BATCHES = 128
+ADAPTIVE_MAX_SIMULATIONS = 100_000_000
+
+
+def run_monte_carlo_simulation(plan, n_simulations=10000, chunk_size=None, histogram_bins=50,
+                               seed=None, n_workers=None, samples=None, sampler='random',
+                               control_variates=False, tolerance=None, max_simulations=None,
+                               time_budget=None, risk_levels=DEFAULT_LEVELS):
     """
     Agent #2: The Simulator
     Runs Monte Carlo simulation based on the structured plan.
+    
+    With chunk_size set, scenarios are drawn chunk by chunk and only running
+    statistics are kept, so memory stays flat however large n_simulations is.
+    Streaming results carry no 'all_simulations' vector. Every result has a
+    fixed-bin 'histogram' (histogram_bins bins), which is all
+    visualize_results needs.
+    
+    Each chunk draws from its own generator spawned from one SeedSequence, and
+    chunks can be spread over n_workers processes (-1 = all cores). For a given
+    seed (and chunk_size) the output is bit-identical whatever n_workers is.
+    
+    Pass a SampleStore from build_sample_store as `samples` to evaluate
+    pre-drawn columns (zero-copy) instead of sampling again.
+    
+    Drivers listed in the plan's "correlations" are drawn jointly through
+    a Gaussian copula (see copula.plan_copula); all others stay independent.
+    
+    sampler='lhs', 'antithetic' or 'sobol' (scrambled, needs scipy) reduces
+    the variance of every estimate; the run is then split into at least
+    MIN_REPLICATES independently randomized chunks. control_variates=True
+    corrects mean_profit with the drivers' exact means as control variates.
+    Results carry 'standard_errors' for the mean, percentiles and
+    probability_profitable, from replicate spread for variance-reduced
+    samplers and from the usual iid formulas otherwise.
+    
+    Adaptive mode: pass `tolerance`, a dict of target standard errors such
+    as {'mean_profit': 50, 'percentile_5': 200, 'probability_profitable': 0.5},
+    and scenarios are drawn in batches until every listed standard error is
+    at or below its target, max_simulations (default 10**8) are used or
+    time_budget seconds have passed. n_simulations is then ignored; the
+    results report the 'n_simulations' actually used, whether the run
+    'converged' and its 'stop_reason'. Adaptive runs always stream.
+    
+    Results also carry 'risk' (see risk_metrics.risk_metrics): value at
+    risk and expected shortfall at each of risk_levels (0.05 = the worst
+    5% of scenarios), downside deviation and a loss-probability curve.
+    In-memory runs get every percentile and tail from one partial
+    selection; streaming runs take them from the t-digest.
     """
     
-    print(f"🎲 Running {n_simulations:,} Monte Carlo simulations...")
-    print()
+    if tolerance is not None:
+        if samples is not None:
+            raise ValueError("Adaptive runs draw their own batches and can't reuse a sample store")
+        with span('simulator.run', adaptive=True, sampler=sampler):
+            return _run_adaptive(plan, tolerance, max_simulations or ADAPTIVE_MAX_SIMULATIONS, time_budget,
+                                 histogram_bins, seed, n_workers, sampler, control_variates, risk_levels)
     
-    # Extract variables
-    revenue_vars = {}
-    for driver in plan['revenue_drivers']:
-        revenue_vars[driver['name']] = np.random.uniform(
-            driver['min'], 
-            driver['max'], 
-            size=n_simulations
-        )
-    
-    cost_vars = {}
-    for driver in plan['cost_drivers']:
-        cost_vars[driver['name']] = np.random.uniform(
-            driver['min'], 
-            driver['max'], 
-            size=n_simulations
-        )
-    
-    # Calculate total revenue (sum all revenue drivers)
-    total_revenue = np.zeros(n_simulations)
-    for name, values in revenue_vars.items():
-        total_revenue += values
-    
-    # If we have subscriber-type and price-type variables, multiply them
-    # Look for common patterns
-    subscriber_keys = [k for k in revenue_vars.keys() if 'subscriber' in k.lower() or 'customer' in k.lower()]
-    price_keys = [k for k in revenue_vars.keys() if 'price' in k.lower() or 'value' in k.lower() or 'order' in k.lower()]
-    
-    if subscriber_keys and price_keys:
-        # Revenue = subscribers * price
-        total_revenue = revenue_vars[subscriber_keys[0]] * revenue_vars[price_keys[0]]
-    
-    # Calculate total costs (sum all cost drivers)
-    total_costs = np.zeros(n_simulations)
-    for name, values in cost_vars.items():
-        total_costs += values
-    
-    # Profit = Revenue - Costs
-    monthly_profit = total_revenue - total_costs
-    
-    # Calculate statistics
-    results = {
-        'mean_profit': float(np.mean(monthly_profit)),
-        'median_profit': float(np.median(monthly_profit)),
-        'std_dev': float(np.std(monthly_profit)),
-        'min_profit': float(np.min(monthly_profit)),
-        'max_profit': float(np.max(monthly_profit)),
-        'percentile_5': float(np.percentile(monthly_profit, 5)),
-        'percentile_25': float(np.percentile(monthly_profit, 25)),
-        'percentile_75': float(np.percentile(monthly_profit, 75)),
-        'percentile_95': float(np.percentile(monthly_profit, 95)),
-        'probability_profitable': float(np.sum(monthly_profit > 0) / n_simulations * 100),
-        'all_simulations': monthly_profit
-    }
+    if samples is not None:
+        check_store(samples, plan)
+        n_simulations = samples.n_samples
+        sampler = samples.sampler
+    check_sampler(sampler)
     
-    return results
+    log(f"🎲 Running {n_simulations:,} Monte Carlo simulations...")
+    log()
+    
+    with span('simulator.run', n_simulations=n_simulations, sampler=sampler) as run_span:
+        # Validate/compile up front so bad expressions fail before any work is farmed out
+        compile_profit_model(plan)
+        copula = plan_copula(plan)
+        if copula is not None and copula.repaired:
+            log("⚠️  Driver correlations are inconsistent; using the nearest valid correlation matrix")
+            log()
+    
+        streaming = bool(chunk_size)
+        chunk = replicate_chunk_size(sampler, n_simulations, chunk_size or DEFAULT_CHUNK_SIZE)
+        if samples is not None:
+            seed_used = samples.seed
+            sources = samples.chunk_sources(chunk, parallel=resolve_workers(n_workers) > 1)
+        else:
+            root = seed_sequence(seed)
+            seed_used = root.entropy
+            sizes = chunk_sizes(n_simulations, chunk)
+            sources = list(zip(root.spawn(len(sizes)), sizes))
+        tasks = [(plan, source, streaming, sampler, control_variates) for source in sources]
+        run_span.set('chunks', len(tasks))
+        run_span.set('streaming', streaming)
+        with span('simulator.chunks', chunks=len(tasks), workers=resolve_workers(n_workers)):
+            parts = run_tasks(_simulate_chunk, tasks, n_workers)
+        chunk_results = [part[0] for part in parts]
+        _count_samples(plan, n_simulations, drawn=samples is None)
+    
+        if streaming:
+            # Merge partial statistics in chunk order
+            stats = StreamingStats()
+            for part in chunk_results:
+                stats.merge(part)
+            results = stats.summary()
+            results['risk'] = streaming_risk_metrics(stats, risk_levels)
+            results['histogram'] = stats.histogram(histogram_bins)
+            replicates = [part.summary() for part in chunk_results]
+        else:
+            monthly_profit = chunk_results[0] if len(chunk_results) == 1 else np.concatenate(chunk_results)
+            # Random draws get their iid standard errors from the same partial selection
+            results = summarize_profits(monthly_profit, risk_levels, standard_errors=sampler == 'random')
+            results['histogram'] = histogram_counts(monthly_profit, histogram_bins)
+            results['all_simulations'] = monthly_profit
+            replicates = [summarize_profits(part) for part in chunk_results] if sampler != 'random' else None
+    
+        results['n_simulations'] = n_simulations
+        results['seed'] = seed_used
+        results['sampler'] = sampler
+        if sampler != 'random':
+            results['standard_errors'] = replicate_standard_errors(replicates)
+            results['n_replicates'] = len(replicates)
+        elif streaming:
+            results['standard_errors'] = iid_standard_errors(results, stats.digest.quantile)
+    
+        if control_variates:
+            _apply_control_variates(results, [part[1] for part in parts], replicated=sampler != 'random')
+    
+        return results
 
 
-def visualize_results(results, plan):
-    """Create visualization of simulation results"""
+def _run_adaptive(plan, tolerance, max_simulations, time_budget, histogram_bins, seed, n_workers,
+                  sampler, control_variates, risk_levels):
+    """
+    Batch-means adaptive run. Each round draws a set of equal-size batches;
+    the spread of per-batch estimates gives the standard errors, and the
+    next round is sized from how far the worst estimate is from its target
+    (standard errors shrink as 1/sqrt(n)), at most quadrupling the run.
+    """
+    unknown = set(tolerance) - set(ESTIMATE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown tolerance keys {sorted(unknown)}, expected some of {list(ESTIMATE_KEYS)}")
+    if any(not value > 0 for value in tolerance.values()):
+        raise ValueError("Tolerances must be positive standard errors")
+    check_sampler(sampler)
     
-    profits = results['all_simulations']
+    log(f"🎲 Running adaptive Monte Carlo simulation (up to {max_simulations:,} scenarios)...")
+    log()
     
-    plt.figure(figsize=(12, 6))
+    compile_profit_model(plan)
+    copula = plan_copula(plan)
+    if copula is not None and copula.repaired:
+        log("⚠️  Driver correlations are inconsistent; using the nearest valid correlation matrix")
+        log()
     
-    # Histogram
-    plt.hist(profits, bins=50, edgecolor='black', alpha=0.7, color='steelblue')
+    root = seed_sequence(seed)
+    started = time.perf_counter()
+    batch_size = max(1, min(ADAPTIVE_BATCH_SIZE, max_simulations // MIN_REPLICATES))
+    batches = []
+    n_new = MIN_REPLICATES
+    while True:
+        tasks = [(plan, (child, batch_size), True, sampler, control_variates) for child in root.spawn(n_new)]
+        with span('simulator.adaptive_round', batches=n_new, batch_size=batch_size):
+            batches.extend(run_tasks(_simulate_chunk, tasks, n_workers))
+        _count_samples(plan, n_new * batch_size)
+        while len(batches) > MAX_BATCHES:
+            batches = _pair_batches(batches)
+            batch_size *= 2
+        
+        results = _adaptive_results(batches, histogram_bins, control_variates, risk_levels)
+        ratio = max((results['standard_errors'][key] / target) ** 2 for key, target in tolerance.items())
+        elapsed = time.perf_counter() - started
+        if ratio <= 1:
+            stop_reason = 'converged'
+        elif results['n_simulations'] + 2 * batch_size > max_simulations:
+            stop_reason = 'sample_budget'
+        elif time_budget is not None and elapsed >= time_budget:
+            stop_reason = 'time_budget'
+        else:
+            # Scenarios still needed if standard errors keep falling as 1/sqrt(n)
+            needed = results['n_simulations'] * (ratio - 1)
+            n_new = min(math.ceil(needed / batch_size), 4 * len(batches),
+                        (max_simulations - results['n_simulations']) // batch_size)
+            if time_budget is not None:
+                per_batch = elapsed * batch_size / results['n_simulations']
+                n_new = min(n_new, int((time_budget - elapsed) / per_batch))
+            n_new = max(2, n_new)
+            continue
+        break
     
-    # Add vertical lines for key statistics
-    plt.axvline(results['mean_profit'], color='red', linestyle='--', linewidth=2, 
-                label=f"Mean: ${results['mean_profit']:,.0f}")
-    plt.axvline(results['percentile_5'], color='orange', linestyle='--', linewidth=2,
-                label=f"5th percentile: ${results['percentile_5']:,.0f}")
-    plt.axvline(results['percentile_95'], color='green', linestyle='--', linewidth=2,
-                label=f"95th percentile: ${results['percentile_95']:,.0f}")
-    plt.axvline(0, color='black', linestyle='-', linewidth=1, alpha=0.5)
+    results['seed'] = root.entropy
+    results['sampler'] = sampler
+    results['n_replicates'] = len(batches)
+    results['converged'] = stop_reason == 'converged'
+    results['stop_reason'] = stop_reason
+    results['elapsed_seconds'] = time.perf_counter() - started
     
-    plt.xlabel('Monthly Profit ($)', fontsize=12)
-    plt.ylabel('Frequency', fontsize=12)
-    plt.title(f'Monte Carlo Simulation: {plan["decision"][:50]}...', fontsize=14, fontweight='bold')
-    plt.legend()
-    plt.grid(axis='y', alpha=0.3)
-    plt.tight_layout()
+    log(f"   {stop_reason.replace('_', ' ')} after {results['n_simulations']:,} scenarios "
+        f"({results['elapsed_seconds']:.2f}s)")
+    log()
+    return results
+
+
+def _pair_batches(batches):
+    """
+    Merge neighbouring batches, halving their number. An odd batch out is
+    folded into the last pair, leaving one batch 1.5x the size of the rest.
+    """
+    paired = [batches[i:i + 2] for i in range(0, len(batches) - 1, 2)]
+    if len(batches) % 2:
+        paired[-1].append(batches[-1])
+    merged = []
+    for group in paired:
+        stats, sums = group[0]
+        for other_stats, other_sums in group[1:]:
+            stats.merge(other_stats)
+            if sums is not None:
+                sums.merge(other_sums)
+        merged.append((stats, sums))
+    return merged
+
+
+def _adaptive_results(batches, histogram_bins, control_variates, risk_levels):
+    stats = StreamingStats()
+    for part, _ in batches:
+        stats.merge(part)
+    results = stats.summary()
+    results['risk'] = streaming_risk_metrics(stats, risk_levels)
+    results['histogram'] = stats.histogram(histogram_bins)
+    results['n_simulations'] = stats.count
+    results['standard_errors'] = replicate_standard_errors([part.summary() for part, _ in batches])
+    if control_variates:
+        _apply_control_variates(results, [sums for _, sums in batches], replicated=True)
+    return results
+
+
+def _count_samples(plan, n_simulations, drawn=True):
+    # Counted here rather than per chunk, so work done in worker processes is included
+    count('simulator.scenarios', n_simulations)
+    if drawn:
+        count('samples.bytes', len(plan_drivers(plan)) * n_simulations * np.dtype(float).itemsize)
+
+
+def _apply_control_variates(results, sums, replicated):
+    """Swap mean_profit for its control-variate estimate, keeping the raw one alongside."""
+    pooled = ControlVariateSums(len(sums[0].sum_x))
+    for part in sums:
+        pooled.merge(part)
+    beta = pooled.coefficients()
+    
+    if not replicated:
+        error = pooled.standard_error()
+    else:
+        estimates = np.array([part.estimate(beta) for part in sums])
+        error = float(np.std(estimates, ddof=1) / np.sqrt(len(estimates)))
+    
+    raw_error = results['standard_errors']['mean_profit']
+    results['control_variate'] = {
+        'raw_mean_profit': results['mean_profit'],
+        'raw_standard_error': raw_error,
+        'variance_reduction': float(raw_error ** 2 / error ** 2) if error > 0 else float('inf'),
+    }
+    results['mean_profit'] = pooled.estimate(beta)
+    results['standard_errors']['mean_profit'] = error
+
+
+def _simulate_chunk(task):
+    """
+    Draw and evaluate one chunk on its own random stream.
+    Module-level so process-pool workers can pickle it.
+    Returns (profits or StreamingStats, ControlVariateSums or None).
+    """
+    plan, source, streaming, sampler, control_variates = task
+    
+    # One contiguous (drivers x scenarios) sample matrix, evaluated in place
+    # by the plan's compiled profit expression
+    model = compile_profit_model(plan)
+    drivers = plan_drivers(plan)
+    with span('simulator.sample'):
+        if isinstance(source[0], np.random.SeedSequence):
+            seed, size = source
+            samples = draw_samples(drivers, size, np.random.default_rng(seed),
+                                   copula=plan_copula(plan), sampler=sampler)
+        else:
+            samples = read_columns(source)
+    with span('simulator.evaluate'):
+        profit = model.evaluate(samples)
     
-    plt.savefig('simulation_results.png', dpi=150)
-    print("📊 Graph saved as 'simulation_results.png'")
-    plt.show()
+    sums = None
+    if control_variates:
+        rows = list(model.used_rows)
+        sums = ControlVariateSums(len(rows))
+        sums.update(samples[rows] - driver_means([drivers[i] for i in rows])[:, None], profit)
+    
+    if not streaming:
+        return profit, sums
+    stats = StreamingStats()
+    stats.update(profit)
+    return stats, sums
+
+
+def visualize_results(results, plan, renderer=None):
+    """
+    Render the profit histogram headlessly in the background, under the
+    renderer's run directory. Returns a Future for the PNG path; nothing
+    here blocks the analysis.
+    """
+    renderer = renderer or default_renderer()
+    future = renderer.render_results(results, plan)
+    log(f"📊 Graph rendering to '{future.path}'")
+    return future
 
 
-# Test it
 if __name__ == "__main__":
     # Load the plan from Agent #1
     from agent_planner import plan_decision
@@ -125,6 +348,7 @@ if __name__ == "__main__":
     print(f"  Worst case (5th percentile): ${results['percentile_5']:,.0f}")
     print()
     print(f"  Probability of being profitable: {results['probability_profitable']:.1f}%")
+    print(f"  Standard error of the mean: ${results['standard_errors']['mean_profit']:,.0f}")
     print()
     
     # Visualize
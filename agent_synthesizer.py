@@ -1,58 +1,267 @@
+import asyncio
+import os
+import time
 import ollama
 import json
+from agent_planner import DEFAULT_MODEL
+from ollama_pool import OllamaClientPool, gather_in_order
+from instrumentation import is_enabled, log, print_summary, record_llm_response, record_span, span
 
-def synthesize_recommendation(plan, simulation_results, sensitivity_ranked):
+def synthesize_recommendation(plan, simulation_results, sensitivity_ranked, model=DEFAULT_MODEL, optimization=None):
     """
     Agent #4: The Synthesizer
     Interprets all results and creates a final recommendation.
+    Pass agent_optimizer.optimize_decision results as `optimization` to
+    ground the "what would need to change" advice in the optimal levers.
     """
     
-    print("🎤 Agent #4: The Synthesizer")
-    print("Generating final recommendation based on all analysis...\n")
+    log("🎤 Agent #4: The Synthesizer")
+    log("Generating final recommendation based on all analysis...\n")
+    
+    with span('synthesizer.recommendation', model=model):
+        response = ollama.chat(
+            model=model,
+            messages=[
+                {'role': 'user', 'content': build_recommendation_prompt(plan, simulation_results, sensitivity_ranked,
+                                                                        optimization)}
+            ]
+        )
+        record_llm_response(response)
+    
+    recommendation = response['message']['content']
+    return recommendation
+
+
+def stream_recommendation(plan, simulation_results, sensitivity_ranked, model=DEFAULT_MODEL, metrics=None,
+                          optimization=None):
+    """
+    Streaming synthesize_recommendation: yields the recommendation text as
+    the LLM produces it. Pass a dict as `metrics` to have it filled with
+    time_to_first_token, total_latency, tokens and tokens_per_second
+    once the stream finishes.
+    """
+    
+    timer = _StreamTimer(metrics)
+    stream = ollama.chat(
+        model=model,
+        messages=[
+            {'role': 'user', 'content': build_recommendation_prompt(plan, simulation_results, sensitivity_ranked,
+                                                                    optimization)}
+        ],
+        stream=True
+    )
+    for chunk in stream:
+        text = timer.observe(chunk)
+        if text:
+            yield text
+    timer.finish()
+
+
+async def stream_recommendation_async(plan, simulation_results, sensitivity_ranked, pool,
+                                      model=DEFAULT_MODEL, metrics=None, optimization=None):
+    """Async-iterator version of stream_recommendation on a shared OllamaClientPool."""
+    
+    timer = _StreamTimer(metrics)
+    stream = pool.stream_chat(
+        model=model,
+        messages=[
+            {'role': 'user', 'content': build_recommendation_prompt(plan, simulation_results, sensitivity_ranked,
+                                                                    optimization)}
+        ]
+    )
+    async for chunk in stream:
+        text = timer.observe(chunk)
+        if text:
+            yield text
+    timer.finish()
+
+
+class _StreamTimer:
+    """Perceived-latency and throughput bookkeeping for one streamed reply."""
+    
+    def __init__(self, metrics):
+        self.metrics = metrics if metrics is not None else {}
+        self.started = time.perf_counter()
+        self.first_token = None
+        self.chunks = 0
+        self.eval_count = None
+        self.eval_seconds = None
+        self.final_chunk = None
+    
+    def observe(self, chunk):
+        text = chunk['message']['content']
+        if text and self.first_token is None:
+            self.first_token = time.perf_counter()
+        if text:
+            self.chunks += 1
+        if chunk.get('done'):
+            # Ollama reports exact generated-token counts and timings on the final chunk
+            self.final_chunk = chunk
+            self.eval_count = chunk.get('eval_count')
+            if chunk.get('eval_duration'):
+                self.eval_seconds = chunk['eval_duration'] / 1e9
+        return text
+    
+    def finish(self):
+        ended = time.perf_counter()
+        tokens = self.eval_count or self.chunks
+        if self.eval_count and self.eval_seconds:
+            generation_seconds = self.eval_seconds
+        elif self.first_token is not None:
+            generation_seconds = ended - self.first_token
+        else:
+            generation_seconds = 0.0
+        self.metrics.update({
+            'time_to_first_token': (self.first_token - self.started) if self.first_token else None,
+            'total_latency': ended - self.started,
+            'tokens': tokens,
+            'tokens_per_second': tokens / generation_seconds if generation_seconds > 0 else None,
+        })
+        if self.final_chunk is not None:
+            record_llm_response(self.final_chunk)
+        record_span('synthesizer.stream', self.metrics['total_latency'], tokens=tokens,
+                    time_to_first_token=self.metrics['time_to_first_token'] or 0.0)
+        return self.metrics
+
+
+async def synthesize_recommendation_async(plan, simulation_results, sensitivity_ranked, pool,
+                                          model=DEFAULT_MODEL, optimization=None):
+    """Async synthesize_recommendation on a shared OllamaClientPool."""
+    
+    with span('synthesizer.recommendation', model=model):
+        response = await pool.chat(
+            model=model,
+            messages=[
+                {'role': 'user', 'content': build_recommendation_prompt(plan, simulation_results, sensitivity_ranked,
+                                                                        optimization)}
+            ]
+        )
+        record_llm_response(response)
+    return response['message']['content']
+
+
+async def synthesize_recommendations_async(analyses, pool, **kwargs):
+    """
+    Recommendations for many (plan, simulation_results, sensitivity_ranked)
+    tuples over one pool, in input order; failures come back as exceptions.
+    """
+    return await gather_in_order(
+        lambda analysis: synthesize_recommendation_async(*analysis, pool, **kwargs), analyses
+    )
+
+
+def synthesize_recommendations(analyses, concurrency=4, host=None, timeout=120.0, retries=3, **kwargs):
+    """Blocking batch wrapper around synthesize_recommendations_async with its own client pool."""
+    
+    async def run():
+        async with OllamaClientPool(host, concurrency, timeout, retries) as pool:
+            return await synthesize_recommendations_async(analyses, pool, **kwargs)
+    
+    return asyncio.run(run())
+
+
+def _risk_lines(risk):
+    """Tail-risk lines for the simulation section (see risk_metrics), one per VaR/CVaR level."""
+    if not risk:
+        return ''
+    lines = []
+    for level, value_at_risk, shortfall in zip(risk['levels'], risk['value_at_risk'], risk['expected_shortfall']):
+        if value_at_risk > 0:
+            lines.append(f"- Worst {level:.0%} of months: losing ${value_at_risk:,.0f} or more, "
+                         f"${shortfall:,.0f} on average (value at risk / expected shortfall)")
+        else:
+            lines.append(f"- Even the worst {level:.0%} of months make at least ${-value_at_risk:,.0f}")
+    lines.append(f"- Downside deviation below break-even: ${risk['downside_deviation']:,.0f}")
+    return '\n'.join(lines) + '\n'
+
+
+def _optimization_lines(optimization):
+    """Prompt section with the optimizer's best lever settings (empty without one)."""
+    if not optimization:
+        return ''
+    actions = {'set': 'set to', 'cap': 'capped at', 'floor': 'at least'}
+    levers = []
+    for name, lever in optimization['levers'].items():
+        if isinstance(lever['value'], dict):
+            levers.append(f"- {name}: {lever['value']}")
+        else:
+            levers.append(f"- {name} {actions[lever['mode']]} {lever['value']:,.2f}")
+        if name in optimization['one_directional']:
+            levers[-1] += " (only the end of the allowed range: profit moves one way along it, so not a target)"
+    levers = '\n'.join(levers)
+    metrics, baseline = optimization['metrics'], optimization['baseline']
+    profitable = f"{metrics['probability_profitable']:.1f}% (vs {baseline['probability_profitable']:.1f}%)"
+    constraints = optimization['constraints']
+    met = 'meets' if optimization['feasible'] else 'does NOT meet'
+    alpha, shortfall = constraints['cvar_alpha'], metrics['expected_shortfall']
+    # Expected shortfall is a loss; below zero the worst tail still makes money on average
+    if shortfall > 0:
+        tail = f"Average loss in the worst {alpha:.0%} of scenarios: ${shortfall:,.0f}"
+    else:
+        tail = f"Even the worst {alpha:.0%} of scenarios make ${-shortfall:,.0f} on average"
+    targets = []
+    if constraints['min_probability_profitable'] is not None:
+        targets.append(f"probability profitable >= {constraints['min_probability_profitable']:.0f}%")
+    if constraints['min_cvar'] is not None:
+        targets.append(f"worst-{alpha:.0%} average profit >= ${constraints['min_cvar']:,.0f}")
+    return f"""OPTIMIZED LEVERS (best of {optimization['n_candidates']} settings on the same scenarios):
+{levers}
+- Mean monthly profit: ${metrics['mean_profit']:,.0f} (vs ${baseline['mean_profit']:,.0f} as planned)
+- Probability of being profitable: {profitable}
+- {tail}
+{f"- This setting {met} the targets: {', '.join(targets)}" + chr(10) if targets else ''}
+"""
+
+
+def _ranked_lines(ranked):
+    return '\n'.join(f"{i}. {name} - {data['type']} (variance: {data['variance']:,.0f})"
+                     for i, (name, data) in enumerate(ranked, 1))
+
+
+def build_recommendation_prompt(plan, simulation_results, sensitivity_ranked, optimization=None):
+    """Executive-summary prompt from the outputs of the other agents."""
+    
+    if optimization and len(optimization['one_directional']) == len(optimization['levers']):
+        # Range ends of levers profit only moves one way along are not advice (see agent_optimizer.recommends_levers)
+        optimization = None
     
     # Prepare context for LLM
     context = f"""You are a senior business analyst presenting findings to executives.
 
 BUSINESS DECISION: {plan['decision']}
 
-MONTE CARLO SIMULATION RESULTS (10,000 scenarios):
+MONTE CARLO SIMULATION RESULTS ({simulation_results.get('n_simulations', 10000):,} scenarios):
 - Mean monthly profit: ${simulation_results['mean_profit']:,.0f}
 - Probability of being profitable: {simulation_results['probability_profitable']:.1f}%
 - Best case (95th percentile): ${simulation_results['percentile_95']:,.0f}
 - Worst case (5th percentile): ${simulation_results['percentile_5']:,.0f}
-
+{_risk_lines(simulation_results.get('risk'))}
 SENSITIVITY ANALYSIS (Variables ranked by impact):
-1. {sensitivity_ranked[0][0]} - {sensitivity_ranked[0][1]['type']} (variance: {sensitivity_ranked[0][1]['variance']:,.0f})
-2. {sensitivity_ranked[1][0]} - {sensitivity_ranked[1][1]['type']} (variance: {sensitivity_ranked[1][1]['variance']:,.0f})
-3. {sensitivity_ranked[2][0]} - {sensitivity_ranked[2][1]['type']} (variance: {sensitivity_ranked[2][1]['variance']:,.0f})
+{_ranked_lines(sensitivity_ranked[:3])}
 
-KEY ASSUMPTIONS:
+{_optimization_lines(optimization)}KEY ASSUMPTIONS:
 {chr(10).join('- ' + a for a in plan['assumptions'])}
 
 Provide a clear, concise executive recommendation with:
 1. Clear GO/NO-GO recommendation
 2. Key reasoning (2-3 sentences)
-3. If NO-GO: what would need to change to make it viable
+3. If NO-GO: what would need to change to make it viable{' (use the optimized levers above)' if optimization else ''}
 4. Top priority action item
 
 Keep it professional but concise. No jargon."""
 
-    response = ollama.chat(
-        model='llama3.2',
-        messages=[
-            {'role': 'user', 'content': context}
-        ]
-    )
-    
-    recommendation = response['message']['content']
-    return recommendation
+    return context
 
 
 # Test it
 if __name__ == "__main__":
     from agent_planner import plan_decision
-    from agent_simulator import run_monte_carlo_simulation
-    from agent_critic import sensitivity_analysis
+    from agent_simulator import run_monte_carlo_simulation, visualize_results
+    from agent_critic import sensitivity_analysis, visualize_sensitivity
+    from agent_optimizer import optimize_decision, print_optimization
+    from sample_store import build_sample_store
+    from run_artifact import save_run
+    from rendering import default_renderer
     
     print("="*70)
     print("🤖 MULTI-AGENT DECISION INTELLIGENCE SYSTEM")
@@ -65,26 +274,58 @@ if __name__ == "__main__":
     print("📋 Question:", question)
     print()
     
-    # Agent 1: Plan
-    print("Agent #1: Planning...")
-    plan = plan_decision(question)
-    print("✅ Plan created\n")
+    # One root span for the whole run when tracing is on (DECISION_TRACE=spans.jsonl)
+    with span('pipeline', question=question):
+        # Agent 1: Plan
+        print("Agent #1: Planning...")
+        plan = plan_decision(question)
+        print("✅ Plan created\n")
     
-    # Agent 2: Simulate
-    print("Agent #2: Simulating...")
-    results = run_monte_carlo_simulation(plan)
-    print("✅ Simulation complete\n")
+        # Draw every driver once; the simulator and the critic both read these columns
+        samples = build_sample_store(plan)
     
-    # Agent 3: Analyze risk
-    print("Agent #3: Analyzing risk...")
-    sensitivities, ranked = sensitivity_analysis(plan)
-    print("✅ Sensitivity analysis complete\n")
+        # Agent 2: Simulate
+        print("Agent #2: Simulating...")
+        results = run_monte_carlo_simulation(plan, samples=samples)
+        print("✅ Simulation complete\n")
     
-    # Agent 4: Synthesize
-    print("="*70)
-    recommendation = synthesize_recommendation(plan, results, ranked)
-    print("="*70)
-    print()
-    print(recommendation)
-    print()
-    print("="*70)
\ No newline at end of file
+        # Agent 3: Analyze risk
+        print("Agent #3: Analyzing risk...")
+        sensitivities, ranked = sensitivity_analysis(plan, samples=samples)
+        print("✅ Sensitivity analysis complete\n")
+    
+        # Agent 5: Optimize the levers the planner marked as controllable, if any
+        optimization = None
+        if plan.get('levers'):
+            print("Agent #5: Optimizing levers...")
+            optimization = optimize_decision(plan, plan['levers'], n_workers=-1)
+            print_optimization(optimization)
+    
+        # Keep the run (plan, stats, ranking, float32 columns) next to its charts for later audits
+        run_path = save_run(os.path.join(default_renderer().directory, 'run'), plan, results, ranked,
+                            samples=samples)
+        print(f"💾 Run saved to '{run_path}'\n")
+        samples.close()
+    
+        # Charts render on background threads while the recommendation streams
+        visualize_results(results, plan)
+        visualize_sensitivity(ranked)
+        print()
+    
+        # Agent 4: Synthesize (streamed, so text shows up as it is generated)
+        print("="*70)
+        print("🎤 Agent #4: The Synthesizer")
+        print("="*70)
+        print()
+        metrics = {}
+        for text in stream_recommendation(plan, results, ranked, metrics=metrics, optimization=optimization):
+            print(text, end='', flush=True)
+        print()
+        print()
+        print("="*70)
+        print(f"⏱️  First token after {metrics['time_to_first_token'] or 0:.2f}s, "
+              f"{metrics['tokens_per_second'] or 0:.1f} tokens/s, total {metrics['total_latency']:.2f}s")
+    
+    if is_enabled():
+        print()
+        print_summary()
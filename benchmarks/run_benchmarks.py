@@ -0,0 +1,347 @@
+"""
+Benchmark suite and performance regression check for the simulation,
+sensitivity and planning paths.
+
+Every case runs in a fresh process and records wall time (best of a few
+repeats), throughput, peak RSS and the tracemalloc peak. Results are
+compared against benchmarks/baselines.json; the script exits with status 1
+when a case is slower or heavier than its baseline by more than the
+tolerance. Planning runs against the stub Ollama server, so the whole
+suite works offline.
+
+    python benchmarks/run_benchmarks.py                  # quick grid vs baselines
+    python benchmarks/run_benchmarks.py --full           # up to 10^8 scenarios
+    python benchmarks/run_benchmarks.py -k simulate/50d  # only matching cases
+    python benchmarks/run_benchmarks.py --save-baseline  # record new baselines
+"""
+import argparse
+import contextlib
+import fnmatch
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+DRIVER_COUNTS = (2, 10, 50, 500)
+QUICK_SCENARIOS = (10**3, 10**4, 10**5, 10**6)
+FULL_SCENARIOS = (10**3, 10**4, 10**5, 10**6, 10**7, 10**8)
+QUICK_SENSITIVITY_SCENARIOS = (10**4,)
+FULL_SENSITIVITY_SCENARIOS = (10**4, 10**5, 10**6)
+
+# Cases above this many driver x scenario cells are skipped (raise with --max-cells)
+QUICK_MAX_CELLS = 5 * 10**7
+FULL_MAX_CELLS = 10**10
+
+# Runs larger than this many cells stream in chunks of about this many cells,
+# as a caller simulating 10^8 scenarios would
+STREAMING_CELLS = 2 * 10**7
+
+PLAN_PARSES = 200
+STUB_PLANS = 20
+
+# Repeat a case until it has run this long (at most MAX_REPEATS times) and keep the best time
+MIN_MEASURE_SECONDS = 1.0
+MAX_REPEATS = 20
+
+# Memory regressions must also exceed this many MB, so tiny cases don't flap
+MEMORY_SLACK_MB = 5.0
+
+DISTRIBUTION_CYCLE = ('uniform', 'normal', 'triangular', 'pert', 'lognormal')
+
+
+def synthetic_plan(n_drivers):
+    """
+    A valid plan with n_drivers drivers (half revenue, half cost) cycling
+    through the built-in distributions. Profit is the sum of pairwise
+    products of the revenue drivers minus every cost, so the expression
+    grows with the driver count like a real plan's would.
+    """
+    n_revenue = max(1, n_drivers // 2)
+
+    def driver(name, low, high, index):
+        entry = {'name': name, 'min': low, 'max': high, 'unit': 'USD per month',
+                 'distribution': DISTRIBUTION_CYCLE[index % len(DISTRIBUTION_CYCLE)],
+                 'description': f"synthetic driver {name}"}
+        if entry['distribution'] in ('triangular', 'pert'):
+            entry['mode'] = low + (high - low) / 3
+        return entry
+
+    revenue = [driver(f"revenue_{i}", 10 + i % 7, 40 + i % 11, i) for i in range(n_revenue)]
+    costs = [driver(f"cost_{i}", 100 + i % 13, 400 + i % 17, i) for i in range(n_drivers - n_revenue)]
+
+    names = [d['name'] for d in revenue]
+    terms = [' * '.join(names[i:i + 2]) for i in range(0, len(names), 2)]
+    expression = ' + '.join(terms) + ''.join(f" - {d['name']}" for d in costs)
+    return {
+        'decision': f"Synthetic benchmark decision with {n_drivers} drivers",
+        'revenue_drivers': revenue,
+        'cost_drivers': costs,
+        'profit_expression': expression,
+        'assumptions': ['Synthetic benchmark plan'],
+    }
+
+
+def _count_label(n):
+    # 1000000 -> '1e6'
+    exponent = round(np.log10(n))
+    return f"1e{exponent}" if 10**exponent == n else str(n)
+
+
+def build_cases(full=False, drivers=None, scenarios=None, max_cells=None):
+    """(case_id, kind, n_drivers, n) tuples for the requested grid."""
+    drivers = drivers or DRIVER_COUNTS
+    simulate = scenarios or (FULL_SCENARIOS if full else QUICK_SCENARIOS)
+    sensitivity = scenarios or (FULL_SENSITIVITY_SCENARIOS if full else QUICK_SENSITIVITY_SCENARIOS)
+    max_cells = max_cells or (FULL_MAX_CELLS if full else QUICK_MAX_CELLS)
+
+    cases = []
+    for d in drivers:
+        cases.append((f"plan-parse/{d}d", 'plan-parse', d, PLAN_PARSES))
+        cases.append((f"plan-stub/{d}d", 'plan-stub', d, STUB_PLANS))
+    for d in drivers:
+        for n in simulate:
+            if d * n <= max_cells:
+                cases.append((f"simulate/{d}d/{_count_label(n)}", 'simulate', d, n))
+    for d in drivers:
+        for n in sensitivity:
+            # OAT evaluates d passes and Sobol d + 2 blocks of n scenarios
+            if d * n <= max_cells:
+                cases.append((f"sensitivity-oat/{d}d/{_count_label(n)}", 'sensitivity-oat', d, n))
+                cases.append((f"sensitivity-sobol/{d}d/{_count_label(n)}", 'sensitivity-sobol', d, n))
+    return cases
+
+
+def _workload(kind, n_drivers, n, n_workers):
+    """Zero-argument callable running one repeat of a case."""
+    plan = synthetic_plan(n_drivers)
+
+    if kind == 'simulate':
+        from agent_simulator import run_monte_carlo_simulation
+        cells = n_drivers * n
+        chunk_size = None if cells <= STREAMING_CELLS else max(1000, STREAMING_CELLS // n_drivers)
+        return lambda: run_monte_carlo_simulation(plan, n, chunk_size=chunk_size, seed=0, n_workers=n_workers)
+
+    if kind in ('sensitivity-oat', 'sensitivity-sobol'):
+        from agent_critic import sensitivity_analysis
+        method = kind.split('-')[1]
+        return lambda: sensitivity_analysis(plan, n, seed=0, n_workers=n_workers, method=method)
+
+    if kind == 'plan-parse':
+        import profit_model
+        from agent_planner import parse_plan_response
+        text = json.dumps(plan)
+
+        def parse():
+            for _ in range(n):
+                # Every LLM reply is a new plan: compile cold each time
+                profit_model._compile.cache_clear()
+                _, errors = parse_plan_response(text)
+                if errors:
+                    raise RuntimeError(f"synthetic plan failed validation: {errors}")
+        return parse
+
+    if kind == 'plan-stub':
+        from agent_planner import plan_decisions
+        from stub_ollama import StubOllamaServer
+        questions = [f"Benchmark question {i}" for i in range(n)]
+
+        def plan_round_trip():
+            with StubOllamaServer(plan=plan) as stub:
+                for result in plan_decisions(questions, host=stub.host, use_cache=False):
+                    if isinstance(result, Exception):
+                        raise result
+        return plan_round_trip
+
+    raise ValueError(f"Unknown benchmark kind '{kind}'")
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KB on Linux and bytes on macOS; workers count through RUSAGE_CHILDREN
+    scale = 1 if sys.platform == 'darwin' else 1024
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / 2**20
+
+
+def run_case(case, n_workers=None):
+    """
+    Measure one case; meant to run in a fresh process so peak RSS belongs
+    to this case alone. The timed repeats run untraced, then one more
+    repeat runs under tracemalloc for the allocation peak.
+    """
+    case_id, kind, n_drivers, n = case
+    run = _workload(kind, n_drivers, n, n_workers)
+    baseline_rss = _peak_rss_mb()
+
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        while len(times) < MAX_REPEATS and (not times or sum(times) < MIN_MEASURE_SECONDS):
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+        peak_rss = _peak_rss_mb()
+
+        tracemalloc.start()
+        run()
+        _, alloc_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    best = min(times)
+    return {
+        'case': case_id,
+        'kind': kind,
+        'drivers': n_drivers,
+        'n': n,
+        'unit': 'plans' if kind.startswith('plan') else 'scenarios',
+        'repeats': len(times),
+        'seconds': best,
+        'per_second': n / best,
+        'peak_rss_mb': peak_rss,
+        'baseline_rss_mb': baseline_rss,
+        'alloc_peak_mb': alloc_peak / 2**20,
+    }
+
+
+def run_cases(cases, n_workers=None):
+    """Run each case in its own spawned process, yielding results as they finish."""
+    context = multiprocessing.get_context('spawn')
+    for case in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            yield pool.submit(run_case, case, n_workers).result()
+
+
+def machine_info():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+    }
+
+
+def load_baselines(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {'machine': None, 'cases': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, path=BASELINE_FILE):
+    """Merge results into the baseline file (cases not re-run keep their old baseline)."""
+    baselines = load_baselines(path)
+    baselines['machine'] = machine_info()
+    for result in results:
+        baselines['cases'][result['case']] = {key: round(result[key], 4) for key in
+                                              ('per_second', 'peak_rss_mb', 'alloc_peak_mb')}
+    baselines['cases'] = dict(sorted(baselines['cases'].items()))
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2)
+        f.write('\n')
+
+
+def compare(result, baseline, tolerance):
+    """Regression messages for one result against its baseline entry (empty when within tolerance)."""
+    problems = []
+    if result['per_second'] < baseline['per_second'] * (1 - tolerance):
+        problems.append(f"throughput {result['per_second']:,.0f}/s vs baseline {baseline['per_second']:,.0f}/s")
+    for key, label in (('peak_rss_mb', 'peak RSS'), ('alloc_peak_mb', 'allocation peak')):
+        limit = max(baseline[key] * (1 + tolerance), baseline[key] + MEMORY_SLACK_MB)
+        if result[key] > limit:
+            problems.append(f"{label} {result[key]:,.1f} MB vs baseline {baseline[key]:,.1f} MB")
+    return problems
+
+
+def _change(value, reference):
+    return f"{(value / reference - 1) * 100:+.0f}%" if reference else ''
+
+
+def format_row(result, baseline):
+    throughput = f"{result['per_second']:>14,.0f} {result['unit']}/s"
+    change = _change(result['per_second'], baseline['per_second']) if baseline else 'new'
+    return (f"{result['case']:<30} {result['seconds']:>9.3f}s {throughput:>26} {change:>6}"
+            f" {result['peak_rss_mb']:>9.1f} MB {result['alloc_peak_mb']:>9.1f} MB")
+
+
+def _parse_counts(text):
+    return tuple(int(float(value)) for value in text.split(','))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulation, sensitivity and planning paths.")
+    parser.add_argument('--full', action='store_true', help="sweep up to 10^8 scenarios (slow)")
+    parser.add_argument('-k', '--filter', default='*', help="only run cases matching this glob, e.g. 'simulate/*'")
+    parser.add_argument('--drivers', type=_parse_counts, help="driver counts, e.g. 2,10,50")
+    parser.add_argument('--scenarios', type=_parse_counts, help="scenario counts, e.g. 1e3,1e6")
+    parser.add_argument('--max-cells', type=float, help="skip cases above this many driver x scenario cells")
+    parser.add_argument('--workers', type=int, default=None, help="n_workers for the simulator and critic")
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help="allowed relative slowdown / memory growth before flagging (default 0.3)")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baselines")
+    parser.add_argument('--json', help="also write the raw results to this file")
+    parser.add_argument('--list', action='store_true', help="list the selected cases and exit")
+    args = parser.parse_args(argv)
+
+    max_cells = int(args.max_cells) if args.max_cells else None
+    cases = [case for case in build_cases(args.full, args.drivers, args.scenarios, max_cells)
+             if fnmatch.fnmatch(case[0], args.filter) or args.filter in case[0]]
+    if args.list:
+        for case in cases:
+            print(case[0])
+        return 0
+    if not cases:
+        print(f"No benchmark cases match '{args.filter}'")
+        return 1
+
+    baselines = load_baselines(args.baseline)
+    if baselines['machine'] and baselines['machine'] != machine_info():
+        print("⚠️  Baselines were recorded on a different machine; comparisons are indicative only")
+        print(f"   baseline: {baselines['machine']}")
+        print()
+
+    print(f"⏱️  Running {len(cases)} benchmark cases...")
+    print()
+    print(f"{'case':<30} {'best':>10} {'throughput':>26} {'vs base':>6} {'peak RSS':>12} {'alloc peak':>12}")
+
+    results = []
+    regressions = []
+    for result in run_cases(cases, args.workers):
+        results.append(result)
+        baseline = baselines['cases'].get(result['case'])
+        print(format_row(result, baseline), flush=True)
+        if baseline and not args.save_baseline:
+            regressions.extend(f"{result['case']}: {problem}" for problem in compare(result, baseline, args.tolerance))
+
+    print()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'machine': machine_info(), 'results': results}, f, indent=2)
+        print(f"📄 Results written to '{args.json}'")
+    if args.save_baseline:
+        save_baselines(results, args.baseline)
+        print(f"💾 Baselines for {len(results)} cases saved to '{args.baseline}'")
+        return 0
+    if regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  - {line}")
+        return 1
+    print(f"✅ No regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import functools
+import numpy as np
+from distributions import standard_normal_cdf, standard_normal_ppf
+from profit_model import plan_drivers
+
+# Smallest eigenvalue kept when repairing a correlation matrix, so it stays Cholesky-factorable
+MIN_EIGENVALUE = 1e-8
+
+
+class Copula:
+    """
+    Gaussian copula over the correlated subset of a plan's drivers.
+
+    `indices` are the sample-matrix rows involved, `matrix` the (repaired)
+    correlation matrix between them and `factor` its lower Cholesky factor.
+    `repaired` is True when the requested matrix was not positive definite
+    and was replaced by the nearest valid correlation matrix.
+    """
+
+    def __init__(self, indices, matrix, factor, repaired):
+        self.indices = indices
+        self.matrix = matrix
+        self.factor = factor
+        self.repaired = repaired
+
+    def latent_normals(self, rng, n_samples):
+        """
+        Correlated standard normals, one row per correlated driver:
+        a single batched matmul L @ z over the whole chunk.
+        """
+        return self.factor @ rng.standard_normal((len(self.indices), n_samples))
+
+    def correlate(self, u):
+        """
+        Turn independent uniforms u (drivers x scenarios) into correlated
+        ones in place, for uniform sources other than a plain generator:
+        latent normals z = ppf(u) of the correlated rows are mixed by L @ z
+        and mapped back through the normal CDF, so every row keeps a
+        uniform marginal.
+        """
+        rows = list(self.indices)
+        z = standard_normal_ppf(u[rows])
+        mixed = standard_normal_cdf(self.factor @ z)
+        # Keep the CDF's rounding from reaching exactly 0 or 1 (infinite tails)
+        np.clip(mixed, np.finfo(float).tiny, 1 - np.finfo(float).epsneg, out=mixed)
+        u[rows] = mixed
+        return u
+
+
+def correlation_pairs(plan):
+    """Plan correlations as sorted ((driver_a, driver_b), rho) tuples, a hashable cache key."""
+    pairs = []
+    for entry in plan.get('correlations') or []:
+        a, b = entry['drivers']
+        pairs.append(((a, b) if a <= b else (b, a), float(entry['rho'])))
+    return tuple(sorted(pairs))
+
+
+def nearest_correlation(matrix, max_iterations=100, tolerance=1e-10):
+    """
+    Nearest correlation matrix (unit diagonal, positive semi-definite) by
+    Higham's alternating projections with Dykstra's correction, then
+    nudged to strictly positive definite so it can be Cholesky-factored.
+    """
+    y = np.array(matrix, dtype=float)
+    correction = np.zeros_like(y)
+    for _ in range(max_iterations):
+        r = y - correction
+        values, vectors = np.linalg.eigh(r)
+        x = (vectors * np.maximum(values, 0)) @ vectors.T
+        correction = x - r
+        previous = y
+        y = x.copy()
+        np.fill_diagonal(y, 1.0)
+        if np.linalg.norm(y - previous) <= tolerance * np.linalg.norm(y):
+            break
+
+    values, vectors = np.linalg.eigh((y + y.T) / 2)
+    y = (vectors * np.maximum(values, MIN_EIGENVALUE)) @ vectors.T
+    scale = 1 / np.sqrt(np.diag(y))
+    return y * np.outer(scale, scale)
+
+
+@functools.lru_cache(maxsize=128)
+def _copula(driver_names, pairs):
+    involved = sorted({driver_names.index(name) for (a, b), _ in pairs for name in (a, b)})
+    position = {driver_names[index]: i for i, index in enumerate(involved)}
+
+    matrix = np.eye(len(involved))
+    for (a, b), rho in pairs:
+        matrix[position[a], position[b]] = matrix[position[b], position[a]] = rho
+
+    repaired = False
+    try:
+        factor = np.linalg.cholesky(matrix)
+    except np.linalg.LinAlgError:
+        matrix = nearest_correlation(matrix)
+        factor = np.linalg.cholesky(matrix)
+        repaired = True
+
+    for array in (matrix, factor):
+        array.flags.writeable = False
+    return Copula(tuple(involved), matrix, factor, repaired)
+
+
+def plan_copula(plan):
+    """
+    Copula for the plan's "correlations" (None when drivers are independent).
+    The correlation matrix is built, repaired if needed and Cholesky-factored
+    once per distinct plan; later calls, per chunk or per worker, hit the cache.
+    """
+    pairs = correlation_pairs(plan)
+    if not pairs:
+        return None
+    names = tuple(d['name'] for d in plan_drivers(plan))
+    return _copula(names, pairs)
@@ -0,0 +1,498 @@
+import asyncio
+import json
+import multiprocessing
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from agent_planner import DEFAULT_MODEL, plan_decision_async
+from agent_simulator import run_monte_carlo_simulation
+from agent_critic import sensitivity_analysis
+from agent_optimizer import _check_levers, optimize_decision
+from agent_synthesizer import synthesize_recommendation_async
+from plan_cache import default_plan_cache
+from plan_schema import PlanningError, format_errors, validate_plan
+from profit_model import plan_drivers
+from sample_store import build_sample_store
+from run_artifact import to_jsonable
+from sampling import SAMPLERS
+from parallel_backend import DEFAULT_CHUNK_SIZE, resolve_workers, seed_sequence
+from ollama_pool import OllamaClientPool
+from instrumentation import count, set_verbose, span
+
+DEFAULT_PORT = 8765
+DEFAULT_KEEP_ALIVE = '30m'
+
+# Largest run a single request may ask for
+MAX_REQUEST_SIMULATIONS = 10_000_000
+# Finished jobs kept for status/result lookups before the oldest are dropped
+MAX_FINISHED_JOBS = 1000
+
+# Each CPU worker keeps its most recent sample stores for seeded requests,
+# up to this many entries and this many bytes
+SAMPLE_CACHE_ENTRIES = 8
+SAMPLE_CACHE_BYTES = 512 * 2**20
+
+PENDING_STATES = ('queued', 'planning', 'simulating', 'optimizing', 'synthesizing')
+
+
+class Job:
+    """One submitted decision and its progress through the four agents."""
+
+    def __init__(self, request):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        self.status = 'queued'
+        self.created = time.time()
+        self.updated = self.created
+        self.timings = {}
+        self.result = None
+        self.error = None
+
+    def advance(self, status):
+        now = time.time()
+        self.timings[self.status] = now - self.updated
+        self.status = status
+        self.updated = now
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'question': self.request.get('question'),
+            'created': self.created,
+            'updated': self.updated,
+            'timings': dict(self.timings),
+            'error': self.error,
+        }
+
+
+def parse_job_request(body):
+    """
+    Check a POST /jobs body and fill in defaults. Needs a "question" or a
+    ready-made "plan"; optional n_simulations, seed, sampler, method
+    ('oat' or 'sobol'), synthesize (default true) and model. "levers"
+    (see agent_optimizer.optimize_decision, default: the plan's own
+    levers), with optional min_probability_profitable and min_cvar, also
+    optimizes the decision.
+    Raises ValueError with a message for the client.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("request body must be a JSON object")
+    question = body.get('question')
+    plan = body.get('plan')
+    if plan is None and (not isinstance(question, str) or not question.strip()):
+        raise ValueError("either 'question' or 'plan' is required")
+    if plan is not None:
+        errors = validate_plan(plan)
+        if errors:
+            raise ValueError(f"invalid plan:\n{format_errors(errors)}")
+
+    n_simulations = body.get('n_simulations', 10000)
+    if not isinstance(n_simulations, int) or isinstance(n_simulations, bool) \
+            or not 1 <= n_simulations <= MAX_REQUEST_SIMULATIONS:
+        raise ValueError(f"n_simulations must be an integer between 1 and {MAX_REQUEST_SIMULATIONS:,}")
+    seed = body.get('seed')
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise ValueError("seed must be a non-negative integer")
+    sampler = body.get('sampler', 'random')
+    if sampler not in SAMPLERS:
+        raise ValueError(f"sampler must be one of {SAMPLERS}")
+    method = body.get('method', 'oat')
+    if method not in ('oat', 'sobol'):
+        raise ValueError("method must be 'oat' or 'sobol'")
+    synthesize = body.get('synthesize', True)
+    if not isinstance(synthesize, bool):
+        raise ValueError("synthesize must be true or false")
+    levers = body.get('levers')
+    if levers is not None:
+        # Driver names are checked here when the plan is given, otherwise once it is planned
+        _check_levers(plan, levers)
+    for key in ('min_probability_profitable', 'min_cvar'):
+        value = body.get(key)
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)):
+            raise ValueError(f"{key} must be a number")
+        if value is not None and levers is None and plan is not None and not plan.get('levers'):
+            raise ValueError(f"{key} needs 'levers' in the request or the plan")
+
+    return {
+        'question': question if isinstance(question, str) else None,
+        'plan': plan,
+        'n_simulations': n_simulations,
+        # Seedless requests get a fresh seed here, so every result can be reproduced
+        'seed': seed if seed is not None else seed_sequence().entropy,
+        'seeded': seed is not None,
+        'sampler': sampler,
+        'method': method,
+        'synthesize': synthesize,
+        'model': body.get('model'),
+        'levers': levers,
+        'min_probability_profitable': body.get('min_probability_profitable'),
+        'min_cvar': body.get('min_cvar'),
+    }
+
+
+# Per-worker LRU of SampleStores: (plan drivers, n, seed, sampler) -> store
+_sample_cache = OrderedDict()
+
+
+def _sample_key(plan, n_simulations, seed, sampler):
+    drivers = json.dumps([plan_drivers(plan), plan.get('correlations') or []], sort_keys=True)
+    return drivers, n_simulations, seed, sampler
+
+
+def _cached_store(plan, n_simulations, seed, sampler, cache=True):
+    """
+    A sample store for the request, reused when an identical seeded one was
+    drawn before. With cache=False (seedless requests, whose fresh seed can
+    never repeat) the store is built but not kept; the caller closes it.
+    """
+    if not cache:
+        return build_sample_store(plan, n_simulations, seed=seed, sampler=sampler), False
+    key = _sample_key(plan, n_simulations, seed, sampler)
+    store = _sample_cache.get(key)
+    if store is not None:
+        _sample_cache.move_to_end(key)
+        return store, True
+
+    store = build_sample_store(plan, n_simulations, seed=seed, sampler=sampler)
+    if store.matrix.nbytes <= SAMPLE_CACHE_BYTES:
+        _sample_cache[key] = store
+        while (len(_sample_cache) > SAMPLE_CACHE_ENTRIES
+               or sum(s.matrix.nbytes for s in _sample_cache.values()) > SAMPLE_CACHE_BYTES):
+            _, evicted = _sample_cache.popitem(last=False)
+            evicted.close()
+    return store, False
+
+
+def _init_worker():
+    # Workers run the agents quietly; progress is reported through job status
+    set_verbose(False)
+
+
+def _ping():
+    return True
+
+
+def _analyze(task):
+    """
+    Simulation and sensitivity for one job, run on a CPU worker.
+    Both read the same (possibly cached) sample store; the simulation
+    streams, so no per-scenario vector is sent back.
+    """
+    plan, n_simulations, seed, sampler, method, seeded = task
+    store, cache_hit = _cached_store(plan, n_simulations, seed, sampler, cache=seeded)
+    try:
+        results = run_monte_carlo_simulation(plan, samples=store, chunk_size=DEFAULT_CHUNK_SIZE)
+        if method == 'sobol':
+            _, ranked = sensitivity_analysis(plan, n_simulations, seed=seed, method='sobol', sampler=sampler)
+        else:
+            _, ranked = sensitivity_analysis(plan, samples=store)
+    finally:
+        if not seeded:
+            store.close()
+    results['sample_cache_hit'] = cache_hit
+    return to_jsonable(results), to_jsonable(ranked)
+
+
+def _optimize(task):
+    """Best lever settings for one job, on a CPU worker with the job's scenario count and seed."""
+    plan, levers, n_simulations, seed, min_probability_profitable, min_cvar = task
+    return to_jsonable(optimize_decision(plan, levers, n_simulations, seed=seed,
+                                         min_probability_profitable=min_probability_profitable,
+                                         min_cvar=min_cvar))
+
+
+class DecisionService:
+    """
+    Long-running decision service: the four agents behind a small HTTP API.
+
+        POST /jobs              {"question": ...} or {"plan": ...}, plus options -> 202 {"id", ...}
+        GET  /jobs              every known job's status
+        GET  /jobs/<id>         status and per-stage timings
+        GET  /jobs/<id>/result  200 with the result, 202 while running, 422/500 if it failed
+        GET  /health            model, worker and cache status
+
+    LLM calls (planning, synthesis) run as coroutines on one event loop
+    over a shared OllamaClientPool, which sends `keep_alive` so the model
+    stays loaded; the model is warmed when the service starts. Simulation
+    and sensitivity run on a separate process pool of cpu_workers, whose
+    processes stay up with NumPy imported and keep recent seeded sample
+    stores. Plans go through the on-disk plan cache. At most max_jobs
+    jobs run at once; the rest wait in the queue.
+
+    Point `ollama_host` at a StubOllamaServer to run it offline:
+
+        with StubOllamaServer() as stub, DecisionService(ollama_host=stub.host, port=0) as service:
+            ...  # talk to service.url
+    """
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, ollama_host=None, model=DEFAULT_MODEL,
+                 keep_alive=DEFAULT_KEEP_ALIVE, cpu_workers=None, llm_concurrency=4, max_jobs=4,
+                 plan_cache=None, warm_model=True):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.cpu_workers = resolve_workers(cpu_workers if cpu_workers is not None else -1)
+        self.max_jobs = max_jobs
+        self.plan_cache = plan_cache or default_plan_cache()
+        self.warm_model = warm_model
+        self.model_status = 'cold'
+        self.jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._ollama_host = ollama_host
+        self._llm_concurrency = llm_concurrency
+        self._loop = None
+        self._pool = None
+        self._slots = None
+        self._cpu = None
+        self._server = ThreadingHTTPServer((host, port), _handler_class(self))
+        self._server.daemon_threads = True
+        self._threads = []
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        set_verbose(False)
+        self._cpu = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=_init_worker)
+        # Start every worker now so the first request doesn't pay for process start-up and imports
+        for future in [self._cpu.submit(_ping) for _ in range(self.cpu_workers)]:
+            future.result()
+
+        self._loop = asyncio.new_event_loop()
+        self._threads.append(threading.Thread(target=self._loop.run_forever, name='llm-loop', daemon=True))
+        self._threads.append(threading.Thread(target=self._server.serve_forever, name='http', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        self._call(self._open_pool())
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._loop is not None:
+            self._call(self._close_pool())
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        if self._cpu is not None:
+            self._cpu.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def serve_forever(self):
+        """Block until interrupted (for the command line)."""
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+    def _call(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(timeout)
+
+    async def _open_pool(self):
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self._pool = OllamaClientPool(self._ollama_host, self._llm_concurrency, keep_alive=self.keep_alive)
+        await self._pool.__aenter__()
+        if self.warm_model:
+            self._loop.create_task(self._warm())
+
+    async def _warm(self):
+        self.model_status = 'loading'
+        try:
+            with span('service.warm_model', model=self.model):
+                await self._pool.warm(self.model)
+            self.model_status = 'warm'
+        except Exception as error:
+            # The service still works; the first LLM call pays the load instead
+            self.model_status = f"warm-up failed: {error}"
+
+    async def _close_pool(self):
+        for task in asyncio.all_tasks(self._loop):
+            if task is not asyncio.current_task():
+                task.cancel()
+        await self._pool.close()
+
+    def submit(self, body):
+        """Queue a job from a request body (see parse_job_request); returns the Job."""
+        job = Job(parse_job_request(body))
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            self._trim_jobs()
+        count('service.jobs_submitted')
+        asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+        return job
+
+    def get(self, job_id):
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def _trim_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in PENDING_STATES]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    async def _run(self, job):
+        request = job.request
+        model = request['model'] or self.model
+        async with self._slots:
+            try:
+                with span('service.job', job=job.id):
+                    job.advance('planning')
+                    plan = request['plan']
+                    if plan is None:
+                        plan = await plan_decision_async(request['question'], self._pool, model=model,
+                                                         cache=self.plan_cache)
+                        if request['levers'] is not None:
+                            try:
+                                _check_levers(plan, request['levers'])
+                            except ValueError as error:
+                                # The planned drivers don't include every requested lever
+                                raise PlanningError(str(error), [{'path': 'levers', 'message': str(error)}]) from error
+
+                    job.advance('simulating')
+                    task = (plan, request['n_simulations'], request['seed'], request['sampler'], request['method'],
+                            request['seeded'])
+                    with span('service.analyze'):
+                        results, ranked = await asyncio.get_running_loop().run_in_executor(self._cpu, _analyze, task)
+
+                    optimization = None
+                    levers = request['levers'] if request['levers'] is not None else plan.get('levers')
+                    if levers:
+                        job.advance('optimizing')
+                        task = (plan, levers, request['n_simulations'], request['seed'],
+                                request['min_probability_profitable'], request['min_cvar'])
+                        with span('service.optimize'):
+                            optimization = await asyncio.get_running_loop().run_in_executor(
+                                self._cpu, _optimize, task)
+
+                    recommendation = None
+                    if request['synthesize']:
+                        job.advance('synthesizing')
+                        recommendation = await synthesize_recommendation_async(plan, results, ranked, self._pool,
+                                                                               model=model, optimization=optimization)
+
+                    job.result = {
+                        'plan': plan,
+                        'seed': request['seed'],
+                        'simulation': results,
+                        'sensitivity': [dict(data, driver=name) for name, data in ranked],
+                        'optimization': optimization,
+                        'recommendation': recommendation,
+                    }
+                    job.advance('done')
+                    count('service.jobs_done')
+            except Exception as error:
+                if isinstance(error, PlanningError):
+                    job.error = error.to_dict()
+                else:
+                    job.error = {'error': f"{type(error).__name__}: {error}"}
+                job.error['kind'] = 'planning' if isinstance(error, PlanningError) else 'internal'
+                job.advance('failed')
+                count('service.jobs_failed')
+
+    def health(self):
+        with self._jobs_lock:
+            states = [job.status for job in self.jobs.values()]
+        return {
+            'status': 'ok',
+            'model': self.model,
+            'model_status': self.model_status,
+            'keep_alive': self.keep_alive,
+            'cpu_workers': self.cpu_workers,
+            'jobs': {state: states.count(state) for state in PENDING_STATES + ('done', 'failed')},
+            'plan_cache': dict(self.plan_cache.stats),
+        }
+
+
+_JOB_PATH = re.compile(r'^/jobs/([0-9a-f]{32})(/result)?$')
+
+
+def _handler_class(service):
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == '/health':
+                return self._send_json(service.health())
+            if self.path == '/jobs':
+                with service._jobs_lock:
+                    jobs = [job.to_dict() for job in service.jobs.values()]
+                return self._send_json({'jobs': jobs})
+
+            match = _JOB_PATH.match(self.path)
+            job = service.get(match.group(1)) if match else None
+            if job is None:
+                return self._send_json({'error': 'not found'}, status=404)
+            if not match.group(2):
+                return self._send_json(job.to_dict())
+            if job.status == 'done':
+                return self._send_json(dict(job.to_dict(), result=job.result))
+            if job.status == 'failed':
+                return self._send_json(job.to_dict(), status=422 if job.error['kind'] == 'planning' else 500)
+            return self._send_json(job.to_dict(), status=202)
+
+        def do_POST(self):
+            if self.path != '/jobs':
+                return self._send_json({'error': 'not found'}, status=404)
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                job = service.submit(json.loads(self.rfile.read(length) or b'{}'))
+            except (ValueError, json.JSONDecodeError) as error:
+                return self._send_json({'error': str(error)}, status=400)
+            self.send_response(202)
+            data = json.dumps(dict(job.to_dict(), status_url=f"/jobs/{job.id}",
+                                   result_url=f"/jobs/{job.id}/result")).encode()
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Location', f"/jobs/{job.id}")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload, default=str).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+# Run standalone: python decision_service.py [--port 8765] [--ollama-host http://...]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decision intelligence HTTP service.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--ollama-host', default=None, help="Ollama URL (default: OLLAMA_HOST or localhost)")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--keep-alive', default=DEFAULT_KEEP_ALIVE,
+                        type=lambda value: float(value) if value.lstrip('-').replace('.', '', 1).isdigit() else value,
+                        help="how long Ollama keeps the model loaded, e.g. 30m or -1 (forever)")
+    parser.add_argument('--workers', type=int, default=None, help="CPU worker processes (default: one per core)")
+    parser.add_argument('--llm-concurrency', type=int, default=4)
+    parser.add_argument('--max-jobs', type=int, default=4, help="jobs running at once; the rest queue")
+    args = parser.parse_args()
+
+    service = DecisionService(args.host, args.port, args.ollama_host, args.model, args.keep_alive,
+                              args.workers, args.llm_concurrency, args.max_jobs)
+    with service:
+        print(f"🛰️  Decision service listening on {service.url} ({service.cpu_workers} CPU worker(s))")
+        print(f"   curl -X POST {service.url}/jobs -d '{{\"question\": \"Should we launch ...?\"}}'")
+        service.serve_forever()
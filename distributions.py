@@ -0,0 +1,314 @@
+import functools
+import math
+import numpy as np
+
+# min/max of normal and lognormal drivers are read as the central 95% interval
+Z_975 = 1.959963984540054
+
+_REGISTRY = {}
+
+
+def register_distribution(cls):
+    """Class decorator adding a Distribution subclass to the registry under cls.name."""
+    _REGISTRY[cls.name] = cls()
+    return cls
+
+
+def get_distribution(driver):
+    """Distribution for a driver (drivers without one are uniform)."""
+    name = driver.get('distribution', 'uniform')
+    try:
+        return _REGISTRY[name]
+    except KeyError:
+        raise ValueError(f"Unknown distribution '{name}' for driver '{driver.get('name')}'") from None
+
+
+def distribution_names():
+    return list(_REGISTRY)
+
+
+class Distribution:
+    """
+    A driver distribution defined by its inverse CDF.
+
+    ppf maps a row of uniforms in [0, 1) to driver values in place, so any
+    uniform source - pseudo-random, Latin hypercube or quasi-random - can
+    feed every distribution with one vectorized call per driver.
+    """
+
+    name = None
+
+    def ppf(self, u, driver):
+        """Overwrite uniforms u with driver values; returns u."""
+        raise NotImplementedError
+
+    def from_normal(self, z, driver):
+        """
+        Overwrite standard normals z with driver values; returns z.
+        Used for copula-correlated drivers, whose latent draws are normal.
+        """
+        u = standard_normal_cdf(z)
+        # Keep the CDF's rounding from reaching exactly 0 or 1 (infinite tails)
+        np.clip(u, np.finfo(float).tiny, 1 - np.finfo(float).epsneg, out=u)
+        np.copyto(z, self.ppf(u, driver))
+        return z
+
+    def median(self, driver):
+        return float(self.ppf(np.array([0.5]), driver)[0])
+
+    def mean(self, driver):
+        raise NotImplementedError
+
+    def validate(self, driver):
+        """Distribution-specific problems with a driver, as error messages."""
+        return []
+
+
+# Acklam's rational approximation to the standard normal quantile
+_A = (-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+      1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00)
+_B = (-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+      6.680131188771972e+01, -1.328068155288572e+01)
+_C = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+      -2.549671324505934e+00, 4.374664141464968e+00, 2.938163982698783e+00)
+_D = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+      3.754408661907416e+00)
+_P_LOW = 0.02425
+
+# Chebyshev fit of erfc (fractional error < 1.2e-7), highest order first
+_ERFC = (0.17087277, -0.82215223, 1.48851587, -1.13520398, 0.27886807,
+         -0.18628806, 0.09678418, 0.37409196, 1.00002368, -1.26551223)
+_SQRT_2PI = math.sqrt(2 * math.pi)
+
+
+def _poly(coefficients, x):
+    result = np.full_like(x, coefficients[0])
+    for c in coefficients[1:]:
+        result *= x
+        result += c
+    return result
+
+
+def standard_normal_cdf(x):
+    """Vectorized standard normal CDF."""
+    x = np.asarray(x, dtype=float)
+    # Phi(-|x|) = erfc(|x| / sqrt(2)) / 2, evaluated with in-place passes
+    z = np.abs(x)
+    z *= 1 / math.sqrt(2)
+    t = z * 0.5
+    t += 1
+    np.reciprocal(t, out=t)
+    result = _poly(_ERFC, t)
+    z *= z
+    result -= z
+    np.exp(result, out=result)
+    result *= t
+    result *= 0.5
+    return np.where(x > 0, 1 - result, result)
+
+
+def standard_normal_ppf(u, out=None):
+    """Vectorized inverse of the standard normal CDF (|abs err| < 1e-6)."""
+    u = np.clip(u, 1e-300, 1 - 1e-16)
+    if out is None:
+        out = np.empty_like(u)
+
+    central = (u >= _P_LOW) & (u <= 1 - _P_LOW)
+    q = u[central] - 0.5
+    r = q * q
+    out[central] = _poly(_A, r) * q / (_poly(_B, r) * r + 1)
+
+    tail = ~central
+    lower = u[tail] < 0.5
+    p = np.where(lower, u[tail], 1 - u[tail])
+    q = np.sqrt(-2 * np.log(p))
+    x = _poly(_C, q) / (_poly(_D, q) * q + 1)
+    # The tail fit is only good to ~1e-5; one Halley step on x = ppf(p) fixes that
+    e = standard_normal_cdf(x) - p
+    step = e * _SQRT_2PI * np.exp(x * x / 2)
+    x -= step / (1 + x * step / 2)
+    out[tail] = np.where(lower, x, -x)
+    return out
+
+
+@register_distribution
+class Uniform(Distribution):
+    name = 'uniform'
+
+    def ppf(self, u, driver):
+        u *= driver['max'] - driver['min']
+        u += driver['min']
+        return u
+
+    def median(self, driver):
+        return (driver['min'] + driver['max']) / 2
+
+    mean = median
+
+
+@register_distribution
+class Normal(Distribution):
+    """mean/std, or by default min/max as the 2.5th/97.5th percentiles."""
+
+    name = 'normal'
+
+    def params(self, driver):
+        mean = driver.get('mean', (driver['min'] + driver['max']) / 2)
+        std = driver.get('std', (driver['max'] - driver['min']) / (2 * Z_975))
+        return mean, std
+
+    def ppf(self, u, driver):
+        return self.from_normal(standard_normal_ppf(u, out=u), driver)
+
+    def from_normal(self, z, driver):
+        mean, std = self.params(driver)
+        z *= std
+        z += mean
+        return z
+
+    def median(self, driver):
+        return self.params(driver)[0]
+
+    mean = median
+
+    def validate(self, driver):
+        if driver.get('std', 1) <= 0:
+            return ['std must be positive']
+        return []
+
+
+@register_distribution
+class LogNormal(Distribution):
+    """mu/sigma of log(value), or by default min/max as the 2.5th/97.5th percentiles."""
+
+    name = 'lognormal'
+
+    def params(self, driver):
+        if 'mu' in driver and 'sigma' in driver:
+            return driver['mu'], driver['sigma']
+        log_min, log_max = math.log(driver['min']), math.log(driver['max'])
+        return (log_min + log_max) / 2, (log_max - log_min) / (2 * Z_975)
+
+    def ppf(self, u, driver):
+        return self.from_normal(standard_normal_ppf(u, out=u), driver)
+
+    def from_normal(self, z, driver):
+        mu, sigma = self.params(driver)
+        z *= sigma
+        z += mu
+        return np.exp(z, out=z)
+
+    def median(self, driver):
+        return math.exp(self.params(driver)[0])
+
+    def mean(self, driver):
+        mu, sigma = self.params(driver)
+        return math.exp(mu + sigma * sigma / 2)
+
+    def validate(self, driver):
+        if 'mu' in driver and 'sigma' in driver:
+            return [] if driver['sigma'] > 0 else ['sigma must be positive']
+        return [] if driver['min'] > 0 else ['lognormal drivers need min > 0']
+
+
+def _mode(driver):
+    return driver.get('mode', (driver['min'] + driver['max']) / 2)
+
+
+def _mode_errors(driver):
+    if not driver['min'] <= _mode(driver) <= driver['max']:
+        return ['mode must lie between min and max']
+    return []
+
+
+@register_distribution
+class Triangular(Distribution):
+    """min, mode (default: midpoint), max."""
+
+    name = 'triangular'
+
+    def ppf(self, u, driver):
+        a, c, b = driver['min'], _mode(driver), driver['max']
+        if b == a:
+            u[...] = a
+            return u
+        split = (c - a) / (b - a)
+        left = a + np.sqrt(u * ((b - a) * (c - a)))
+        right = b - np.sqrt((1 - u) * ((b - a) * (b - c)))
+        np.copyto(u, np.where(u < split, left, right))
+        return u
+
+    def mean(self, driver):
+        return (driver['min'] + _mode(driver) + driver['max']) / 3
+
+    validate = staticmethod(_mode_errors)
+
+
+@functools.lru_cache(maxsize=256)
+def _beta_cdf_table(alpha, beta, points=4097):
+    # Tabulated Beta(alpha, beta) CDF; quantiles are then a binary search away
+    x = np.linspace(0.0, 1.0, points)
+    with np.errstate(divide='ignore'):
+        log_pdf = (alpha - 1) * np.log(x) + (beta - 1) * np.log1p(-x)
+    pdf = np.exp(log_pdf)
+    pdf[~np.isfinite(pdf)] = 0.0
+    cdf = np.concatenate([[0.0], np.cumsum((pdf[1:] + pdf[:-1]) / 2)])
+    cdf /= cdf[-1]
+    return cdf, x
+
+
+@register_distribution
+class Pert(Distribution):
+    """Beta-PERT over min, mode (default: midpoint), max with shape `lambda` (default 4)."""
+
+    name = 'pert'
+
+    def shape(self, driver):
+        a, c, b = driver['min'], _mode(driver), driver['max']
+        lam = driver.get('lambda', 4.0)
+        span = (b - a) or 1.0
+        return 1 + lam * (c - a) / span, 1 + lam * (b - c) / span
+
+    def ppf(self, u, driver):
+        cdf, x = _beta_cdf_table(*self.shape(driver))
+        np.copyto(u, np.interp(u, cdf, x))
+        u *= driver['max'] - driver['min']
+        u += driver['min']
+        return u
+
+    def mean(self, driver):
+        lam = driver.get('lambda', 4.0)
+        return (driver['min'] + lam * _mode(driver) + driver['max']) / (lam + 2)
+
+    validate = staticmethod(_mode_errors)
+
+
+@functools.lru_cache(maxsize=256)
+def _empirical_table(data):
+    values = np.sort(np.asarray(data, dtype=float))
+    # Plotting positions: each observation sits at the centre of its probability mass
+    probabilities = (np.arange(values.size) + 0.5) / values.size
+    return probabilities, values
+
+
+@register_distribution
+class Empirical(Distribution):
+    """Resamples historical observations in `data`, interpolating between them."""
+
+    name = 'empirical'
+
+    def ppf(self, u, driver):
+        probabilities, values = _empirical_table(tuple(driver['data']))
+        # np.interp binary-searches the precomputed CDF table for every draw
+        np.copyto(u, np.interp(u, probabilities, values))
+        return u
+
+    def mean(self, driver):
+        return float(np.mean(driver['data']))
+
+    def validate(self, driver):
+        data = driver.get('data')
+        if not isinstance(data, list) or not data or not all(
+                isinstance(v, (int, float)) and not isinstance(v, bool) for v in data):
+            return ['empirical drivers need a non-empty numeric data list']
+        return []
@@ -0,0 +1,417 @@
+import atexit
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: spans are recorded without peak RSS
+    resource = None
+
+SERVICE_NAME = 'decision-intelligence'
+
+# Set DECISION_TRACE=spans.jsonl (and optionally DECISION_TRACE_FORMAT=otel)
+# to trace a run without touching the code
+TRACE_ENV = 'DECISION_TRACE'
+TRACE_FORMAT_ENV = 'DECISION_TRACE_FORMAT'
+
+
+class _State:
+    def __init__(self):
+        self.enabled = False
+        self.verbose = True
+        self.trace_memory = False
+        self.exporters = []
+        self.counters = {}
+        self.totals = {}
+        self.pid = None
+
+
+_state = _State()
+_lock = threading.Lock()
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+def _rss_peak_mb():
+    """Peak resident set size of this process in MB, or None where it can't be read."""
+    if resource is None:
+        return None
+    # ru_maxrss is KB on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2**20
+
+
+class Span:
+    """
+    One timed stage. Created by span(); use as a context manager.
+    set(key, value) attaches attributes; an exception leaving the block
+    marks the span as an error.
+    """
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start_ns', 'end_ns',
+                 'duration', 'error', '_started', '_token', '_root')
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.error = None
+        self.end_ns = None
+        self.duration = None
+        self._root = parent is None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        if self._root and _state.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self.start_ns = time.time_ns()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self._close(time.perf_counter() - self._started)
+        return False
+
+    def _close(self, duration):
+        self.duration = duration
+        self.end_ns = self.start_ns + int(duration * 1e9)
+        peak_rss = _rss_peak_mb()
+        if peak_rss is not None:
+            self.attributes['memory.peak_rss_mb'] = round(peak_rss, 1)
+        if _state.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.attributes['memory.traced_bytes'] = current
+            if self._root:
+                self.attributes['memory.traced_peak_bytes'] = peak
+        _finish(self)
+
+    def to_dict(self):
+        return {
+            'type': 'span',
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start_ns / 1e9,
+            'duration': self.duration,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Shared stand-in returned while instrumentation is off: every call does nothing."""
+
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, parent=None, **attributes):
+    """
+    Timing span for one stage, nested under the current span (or `parent`,
+    e.g. for work handed to another thread):
+
+        with span('simulator.run', n_simulations=n) as s:
+            ...
+            s.set('chunks', len(tasks))
+
+    While instrumentation is disabled this returns a shared no-op, so
+    spans can stay in hot paths. Spans opened in worker processes are
+    not recorded; the coordinating process accounts for their work.
+    """
+    if not _state.enabled or os.getpid() != _state.pid:
+        return _NOOP
+    return Span(name, parent or _current.get(), attributes)
+
+
+def record_span(name, seconds, parent=None, **attributes):
+    """
+    Record a stage that has just finished and took `seconds`, for work
+    that can't sit inside a with-block (e.g. a generator streaming a reply).
+    """
+    if not _state.enabled or os.getpid() != _state.pid:
+        return
+    finished = Span(name, parent or _current.get(), attributes)
+    finished.start_ns = time.time_ns() - int(seconds * 1e9)
+    finished._close(seconds)
+
+
+def current_span():
+    """The innermost open span, or None (use as span(..., parent=) across threads)."""
+    return _current.get() if _state.enabled else None
+
+
+def count(name, value=1):
+    """Add `value` to a process-wide counter (no-op while disabled)."""
+    if not _state.enabled or os.getpid() != _state.pid:
+        return
+    with _lock:
+        _state.counters[name] = _state.counters.get(name, 0) + value
+
+
+def record_llm_response(response, active=None):
+    """
+    Token and latency counters from an Ollama reply (or the final chunk
+    of a stream): llm.requests, llm.prompt_tokens, llm.completion_tokens
+    and llm.seconds, also set on the active span.
+    """
+    if not _state.enabled:
+        return
+    prompt_tokens = response.get('prompt_eval_count') or 0
+    completion_tokens = response.get('eval_count') or 0
+    seconds = (response.get('total_duration') or 0) / 1e9
+    count('llm.requests')
+    count('llm.prompt_tokens', prompt_tokens)
+    count('llm.completion_tokens', completion_tokens)
+    count('llm.seconds', seconds)
+    active = active or _current.get()
+    if active is not None:
+        active.set('llm.prompt_tokens', prompt_tokens)
+        active.set('llm.completion_tokens', completion_tokens)
+        active.set('llm.seconds', seconds)
+
+
+def log(message=''):
+    """
+    Progress chatter from the agents. Printed while verbose (the default
+    for scripts); recorded as a span attribute while tracing.
+    """
+    if _state.verbose:
+        print(message)
+    if _state.enabled and message:
+        active = _current.get()
+        if active is not None:
+            active.attributes.setdefault('log', []).append(message)
+
+
+def set_verbose(verbose):
+    """Turn the agents' progress output on or off (e.g. for services and benchmarks)."""
+    _state.verbose = verbose
+
+
+def _finish(finished):
+    with _lock:
+        total = _state.totals.setdefault(finished.name, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += finished.duration
+        total[2] = max(total[2], finished.duration)
+        exporters = list(_state.exporters)
+    for exporter in exporters:
+        exporter.export(finished)
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (list, tuple)):
+        return {'arrayValue': {'values': [_attribute_value(v) for v in value]}}
+    return {'stringValue': str(value)}
+
+
+def _resource():
+    return {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                           {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]}
+
+
+def otel_span(finished):
+    """One finished span as an OTLP/JSON span object."""
+    record = {
+        'traceId': finished.trace_id,
+        'spanId': finished.span_id,
+        'name': finished.name,
+        'kind': 1,
+        'startTimeUnixNano': str(finished.start_ns),
+        'endTimeUnixNano': str(finished.end_ns),
+        'attributes': [{'key': k, 'value': _attribute_value(v)} for k, v in finished.attributes.items()],
+        'status': {'code': 2, 'message': finished.error} if finished.error else {'code': 1},
+    }
+    if finished.parent_id:
+        record['parentSpanId'] = finished.parent_id
+    return record
+
+
+def otel_traces(spans):
+    """An OTLP/JSON ExportTraceServiceRequest for `spans`."""
+    return {'resourceSpans': [{
+        'resource': _resource(),
+        'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': [otel_span(s) for s in spans]}],
+    }]}
+
+
+def otel_metrics(counters):
+    """Counters as an OTLP/JSON ExportMetricsServiceRequest of monotonic sums."""
+    now = str(time.time_ns())
+    metrics = []
+    for name, value in sorted(counters.items()):
+        point = {'timeUnixNano': now}
+        point['asInt' if isinstance(value, int) else 'asDouble'] = str(value) if isinstance(value, int) else value
+        metrics.append({'name': name, 'sum': {'dataPoints': [point], 'aggregationTemporality': 2,
+                                              'isMonotonic': True}})
+    return {'resourceMetrics': [{
+        'resource': _resource(),
+        'scopeMetrics': [{'scope': {'name': SERVICE_NAME}, 'metrics': metrics}],
+    }]}
+
+
+class JsonLinesExporter:
+    """
+    Appends one JSON line per finished span to `path` (or an open file).
+    format='jsonl' writes flat span records; format='otel' writes one OTLP/JSON
+    ExportTraceServiceRequest per line, the layout the OpenTelemetry
+    Collector's file exporter and otlpjsonfile receiver use. Counters are
+    written on flush().
+    """
+
+    def __init__(self, path, format='jsonl'):
+        if format not in ('jsonl', 'otel'):
+            raise ValueError(f"Unknown trace format '{format}', expected 'jsonl' or 'otel'")
+        self.format = format
+        self._owns_file = isinstance(path, (str, os.PathLike))
+        self._file = open(path, 'a') if self._owns_file else path
+        self._lock = threading.Lock()
+
+    def _write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def export(self, finished):
+        self._write(otel_traces([finished]) if self.format == 'otel' else finished.to_dict())
+
+    def flush(self, counters):
+        if counters:
+            self._write(otel_metrics(counters) if self.format == 'otel' else {'type': 'counters', 'counters': counters})
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+
+class MemoryExporter:
+    """Keeps finished spans in a list (for summaries, tests and the service)."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, finished):
+        self.spans.append(finished)
+
+    def flush(self, counters):
+        pass
+
+    def close(self):
+        pass
+
+
+def enable(path=None, format='jsonl', exporter=None, trace_memory=False):
+    """
+    Start recording spans and counters. Spans go to `exporter`, or to a
+    JsonLinesExporter on `path`; with neither, only the in-process summary
+    is kept. trace_memory=True also starts tracemalloc, so spans record
+    traced bytes (and root spans their traced peak).
+    """
+    if exporter is None and path is not None:
+        exporter = JsonLinesExporter(path, format)
+    with _lock:
+        if exporter is not None:
+            _state.exporters.append(exporter)
+        _state.pid = os.getpid()
+        _state.enabled = True
+        _state.trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return exporter
+
+
+def flush():
+    """Write the current counters to every exporter."""
+    counters = counters_snapshot()
+    for exporter in list(_state.exporters):
+        exporter.flush(counters)
+
+
+def disable():
+    """Flush counters, close the exporters and stop recording."""
+    if not _state.enabled:
+        return
+    flush()
+    with _lock:
+        exporters = _state.exporters
+        _state.exporters = []
+        _state.enabled = False
+    for exporter in exporters:
+        exporter.close()
+    if _state.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state.trace_memory = False
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def counters_snapshot():
+    with _lock:
+        return dict(_state.counters)
+
+
+def summary():
+    """Per-span-name call counts and timings plus the counters, since enable() (or reset())."""
+    with _lock:
+        spans = {name: {'count': c, 'total_seconds': total, 'max_seconds': longest}
+                 for name, (c, total, longest) in _state.totals.items()}
+        return {'spans': spans, 'counters': dict(_state.counters), 'peak_rss_mb': _rss_peak_mb()}
+
+
+def reset():
+    """Clear the counters and span totals."""
+    with _lock:
+        _state.counters = {}
+        _state.totals = {}
+
+
+def print_summary():
+    """Time per stage, slowest first, then the counters."""
+    report = summary()
+    print("⏱️  TIME PER STAGE:")
+    for name, entry in sorted(report['spans'].items(), key=lambda item: -item[1]['total_seconds']):
+        print(f"  {name:<32} {entry['total_seconds']:>9.3f}s  ({entry['count']} call(s), "
+              f"max {entry['max_seconds']:.3f}s)")
+    for name, value in sorted(report['counters'].items()):
+        print(f"  {name:<32} {value:>12,.6g}" if isinstance(value, float) else f"  {name:<32} {value:>12,}")
+    if report['peak_rss_mb'] is not None:
+        print(f"  Peak RSS: {report['peak_rss_mb']:,.1f} MB")
+
+
+atexit.register(disable)
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV], os.environ.get(TRACE_FORMAT_ENV, 'jsonl'))
@@ -0,0 +1,136 @@
+import asyncio
+import ollama
+from instrumentation import count
+
+RETRYABLE_ERRORS = (asyncio.TimeoutError, ConnectionError, OSError)
+
+
+def _is_retryable(error):
+    if isinstance(error, ollama.ResponseError):
+        # Server-side hiccups and overload are worth retrying; bad requests are not
+        return error.status_code >= 500 or error.status_code == 429
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    # httpx transport errors (connection refused/reset, read timeouts) surface under this name
+    return type(error).__module__.startswith('httpx')
+
+
+class OllamaClientPool:
+    """
+    Bounded pool of ollama.AsyncClient connections.
+
+    At most `size` chat calls are in flight at once; each call gets a
+    per-attempt timeout and is retried with exponential backoff on
+    timeouts, connection errors and 5xx/429 responses.
+    `keep_alive` (e.g. '30m', or -1 for forever) is sent with every call
+    so Ollama keeps the model loaded between requests.
+    Point `host` at a stub server (see stub_ollama) to run offline.
+    """
+
+    def __init__(self, host=None, size=4, timeout=120.0, retries=3, backoff=0.5, keep_alive=None):
+        self.host = host
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.keep_alive = keep_alive
+        self._idle = None
+
+    async def __aenter__(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._idle.put_nowait(ollama.AsyncClient(host=self.host))
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Close every pooled connection."""
+        while self._idle is not None and not self._idle.empty():
+            client = self._idle.get_nowait()
+            close = getattr(client, 'close', None)
+            if close is not None:
+                await close()
+        self._idle = None
+
+    def _with_keep_alive(self, kwargs):
+        if self.keep_alive is not None:
+            kwargs.setdefault('keep_alive', self.keep_alive)
+        return kwargs
+
+    async def warm(self, model):
+        """
+        Load `model` into memory ahead of the first real request (an empty
+        generate call), holding it for keep_alive.
+        """
+        if self._idle is None:
+            raise RuntimeError("OllamaClientPool must be used as 'async with OllamaClientPool(...) as pool'")
+
+        client = await self._idle.get()
+        try:
+            return await asyncio.wait_for(client.generate(**self._with_keep_alive({'model': model})), self.timeout)
+        finally:
+            self._idle.put_nowait(client)
+
+    async def chat(self, **kwargs):
+        """ollama.chat on a pooled client, with timeout and retry."""
+        if self._idle is None:
+            raise RuntimeError("OllamaClientPool must be used as 'async with OllamaClientPool(...) as pool'")
+        kwargs = self._with_keep_alive(kwargs)
+
+        client = await self._idle.get()
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    return await asyncio.wait_for(client.chat(**kwargs), self.timeout)
+                except Exception as error:
+                    if attempt == self.retries or not _is_retryable(error):
+                        raise
+                    count('llm.retries')
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+        finally:
+            self._idle.put_nowait(client)
+
+    async def stream_chat(self, **kwargs):
+        """
+        Streaming ollama.chat on a pooled client, yielding response chunks.
+        The client stays checked out until the stream ends and the timeout
+        applies to each chunk, not the whole reply. Failures before
+        the first chunk are retried like chat(); once text has been yielded
+        a failure is raised, since the partial reply can't be taken back.
+        """
+        if self._idle is None:
+            raise RuntimeError("OllamaClientPool must be used as 'async with OllamaClientPool(...) as pool'")
+        kwargs = self._with_keep_alive(kwargs)
+
+        client = await self._idle.get()
+        try:
+            for attempt in range(self.retries + 1):
+                started = False
+                try:
+                    stream = await client.chat(stream=True, **kwargs)
+                    iterator = stream.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(iterator.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            return
+                        started = True
+                        yield chunk
+                except Exception as error:
+                    if started or attempt == self.retries or not _is_retryable(error):
+                        raise
+                    count('llm.retries')
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+        finally:
+            self._idle.put_nowait(client)
+
+
+async def gather_in_order(fn, items, return_exceptions=True):
+    """
+    Run fn(item) for every item concurrently (the pool bounds real
+    concurrency) and return results in input order. With
+    return_exceptions, one failed item doesn't sink the whole batch.
+    """
+    return await asyncio.gather(*(fn(item) for item in items), return_exceptions=return_exceptions)
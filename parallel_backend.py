@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Scenarios per random stream. Chunk boundaries (not worker count) decide
+# which generator draws which scenario, so results only depend on the seed.
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def seed_sequence(seed=None):
+    """SeedSequence for a run; seed=None draws fresh OS entropy."""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def chunk_sizes(n_total, chunk_size):
+    """Split n_total scenarios into chunk_size blocks (last one may be short)."""
+    return [min(chunk_size, n_total - start) for start in range(0, n_total, chunk_size)]
+
+
+def resolve_workers(n_workers):
+    """n_workers=-1 means one worker per CPU; None or 1 runs in-process."""
+    if n_workers == -1:
+        return os.cpu_count() or 1
+    return n_workers or 1
+
+
+def run_tasks(fn, tasks, n_workers=None):
+    """
+    Apply fn to every task, in-process or on a process pool.
+    Results always come back in task order.
+    """
+    tasks = list(tasks)
+    n_workers = min(resolve_workers(n_workers), len(tasks))
+    if n_workers <= 1:
+        return [fn(task) for task in tasks]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        return list(pool.map(fn, tasks))
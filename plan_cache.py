@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: counters are updated without a lock
+    fcntl = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'decision-intelligence', 'plans')
+STATS_FILE = '_stats.json'
+STATS_LOCK = '_stats.lock'
+
+
+def normalize_question(question):
+    """Case- and whitespace-insensitive form of a business question."""
+    return ' '.join(question.lower().split())
+
+
+def plan_cache_key(question, model, prompt_template):
+    """Content address of a plan: normalized question + model + prompt template."""
+    payload = json.dumps([normalize_question(question), model, prompt_template])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PlanCache:
+    """
+    Persistent on-disk cache of validated planner output.
+
+    One JSON file per plan, named by its content key. Entries older than
+    ttl_seconds are dropped on read; once more than max_entries are stored
+    the least recently used ones (by file mtime, refreshed on every hit)
+    are evicted. Hit/miss counters are kept per instance in `stats` and
+    accumulated across runs in the cache directory (see lifetime_stats).
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_entries=256, ttl_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'seconds_saved': 0.0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _count(self, name, amount=1):
+        self.stats[name] += amount
+        path = os.path.join(self.directory, STATS_FILE)
+        # Read-increment-write under an exclusive lock so concurrent processes don't lose counts
+        with open(os.path.join(self.directory, STATS_LOCK), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            totals = self.lifetime_stats()
+            totals[name] = totals.get(name, 0) + amount
+            self._write_json(path, totals)
+
+    def _write_json(self, path, data):
+        # Write-then-rename so concurrent readers never see half a file
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+    def lifetime_stats(self):
+        """Counters accumulated by every PlanCache that used this directory."""
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def get(self, key):
+        """Cached plan for key, or None on a miss or expired entry."""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            self._count('misses')
+            return None
+
+        if self.ttl_seconds is not None and time.time() - entry['created'] > self.ttl_seconds:
+            self._remove(path)
+            self._count('expired')
+            self._count('misses')
+            return None
+
+        os.utime(path)  # mark as recently used
+        self._count('hits')
+        self._count('seconds_saved', entry.get('llm_seconds', 0.0))
+        return entry['plan']
+
+    def put(self, key, plan, llm_seconds=0.0, **metadata):
+        """Store a validated plan, evicting least recently used entries if over capacity."""
+        entry = {'created': time.time(), 'llm_seconds': llm_seconds, 'plan': plan}
+        entry.update(metadata)
+        self._write_json(self._path(key), entry)
+        self._evict()
+
+    def _entries(self):
+        names = [n for n in os.listdir(self.directory) if n.endswith('.json') and n != STATS_FILE]
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _evict(self):
+        entries = self._entries()
+        excess = len(entries) - self.max_entries
+        if excess <= 0:
+            return
+        entries.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in entries[:excess]:
+            self._remove(path)
+            self._count('evictions')
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Delete every cached plan (counters are kept)."""
+        for path in self._entries():
+            self._remove(path)
+
+
+_default_cache = None
+
+
+def default_plan_cache():
+    """Process-wide PlanCache in DEFAULT_CACHE_DIR, created on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = PlanCache()
+    return _default_cache
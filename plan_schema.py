@@ -0,0 +1,268 @@
+import math
+from distributions import distribution_names, get_distribution
+from profit_model import ProfitExpressionError, compile_profit_model
+
+DISTRIBUTIONS = distribution_names()
+# How a lever applies its value to a driver (see agent_optimizer.optimize_decision)
+LEVER_MODES = ('set', 'cap', 'floor')
+
+DRIVER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string", "pattern": "^[A-Za-z_][A-Za-z0-9_]*$"},
+        "min": {"type": "number"},
+        "max": {"type": "number"},
+        "unit": {"type": "string"},
+        "distribution": {"type": "string", "enum": DISTRIBUTIONS},
+        "mode": {"type": "number"},
+        "data": {"type": "array", "items": {"type": "number"}},
+        "dynamics": {
+            "type": "object",
+            "properties": {
+                "growth": {"type": "number", "exclusiveMinimum": -1},
+                "churn": {"type": "number", "minimum": 0, "maximum": 1},
+                "volatility": {"type": "number", "minimum": 0},
+                "persistence": {"type": "number", "minimum": -1, "maximum": 1}
+            }
+        },
+        "description": {"type": "string"}
+    },
+    "required": ["name", "min", "max", "unit", "distribution"]
+}
+
+CORRELATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "drivers": {"type": "array", "items": {"type": "string"}, "minItems": 2, "maxItems": 2},
+        "rho": {"type": "number", "minimum": -1, "maximum": 1}
+    },
+    "required": ["drivers", "rho"]
+}
+
+LEVER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "low": {"type": "number"},
+        "high": {"type": "number"},
+        "mode": {"type": "string", "enum": list(LEVER_MODES)}
+    },
+    "required": ["low", "high"]
+}
+
+# JSON schema handed to Ollama's `format=` so decoding is constrained to it
+PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "decision": {"type": "string"},
+        "revenue_drivers": {"type": "array", "items": DRIVER_SCHEMA, "minItems": 1},
+        "cost_drivers": {"type": "array", "items": DRIVER_SCHEMA},
+        "profit_expression": {"type": "string"},
+        "correlations": {"type": "array", "items": CORRELATION_SCHEMA},
+        "levers": {"type": "object", "additionalProperties": LEVER_SCHEMA},
+        "assumptions": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["decision", "revenue_drivers", "cost_drivers", "assumptions"]
+}
+
+
+class PlanningError(Exception):
+    """
+    The planner could not produce a valid plan.
+    `errors` lists {'path', 'message'} problems from the last attempt;
+    `raw_response` is the last LLM reply.
+    """
+
+    def __init__(self, message, errors=None, raw_response=None, attempts=0):
+        super().__init__(message)
+        self.errors = errors or []
+        self.raw_response = raw_response
+        self.attempts = attempts
+
+    def to_dict(self):
+        return {
+            'error': str(self),
+            'errors': self.errors,
+            'attempts': self.attempts,
+            'raw_response': self.raw_response,
+        }
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _validate_driver(driver, path, errors):
+    if not isinstance(driver, dict):
+        errors.append({'path': path, 'message': 'driver must be an object'})
+        return
+
+    name = driver.get('name')
+    if not isinstance(name, str) or not name.isidentifier():
+        errors.append({'path': f"{path}.name", 'message': 'name must be an identifier such as monthly_subscribers'})
+
+    bounds_ok = True
+    for key in ('min', 'max'):
+        if not _is_number(driver.get(key)):
+            errors.append({'path': f"{path}.{key}", 'message': f"{key} must be a finite number"})
+            bounds_ok = False
+    if bounds_ok and driver['min'] > driver['max']:
+        errors.append({'path': path, 'message': f"min ({driver['min']}) is greater than max ({driver['max']})"})
+        bounds_ok = False
+
+    if not isinstance(driver.get('unit'), str) or not driver['unit'].strip():
+        errors.append({'path': f"{path}.unit", 'message': 'unit must be a non-empty string'})
+    if 'dynamics' in driver:
+        _validate_dynamics(driver['dynamics'], f"{path}.dynamics", errors)
+
+    if driver.get('distribution') not in DISTRIBUTIONS:
+        errors.append({'path': f"{path}.distribution",
+                       'message': f"distribution must be one of {DISTRIBUTIONS}"})
+    elif bounds_ok:
+        for message in get_distribution(driver).validate(driver):
+            errors.append({'path': f"{path}.distribution", 'message': message})
+
+
+# Allowed range of each dynamics field (see time_series.driver_dynamics)
+# growth must stay above -1: at -100% a month the driver is wiped out after one step.
+# Together, growth - churn must also stay above -1 so the monthly factor 1 + growth - churn is positive.
+DYNAMICS_RANGES = {
+    'growth': (-1, math.inf),
+    'churn': (0, 1),
+    'volatility': (0, math.inf),
+    'persistence': (-1, 1),
+}
+
+
+def _validate_dynamics(dynamics, path, errors):
+    if not isinstance(dynamics, dict):
+        errors.append({'path': path, 'message': 'dynamics must be an object'})
+        return
+    for key, value in dynamics.items():
+        if key not in DYNAMICS_RANGES:
+            errors.append({'path': f"{path}.{key}",
+                           'message': f"unknown dynamics field, expected one of {list(DYNAMICS_RANGES)}"})
+            continue
+        low, high = DYNAMICS_RANGES[key]
+        if key == 'growth':
+            if not _is_number(value) or not low < value <= high:
+                errors.append({'path': f"{path}.{key}", 'message': f"{key} must be a number greater than {low}"})
+        elif not _is_number(value) or not low <= value <= high:
+            errors.append({'path': f"{path}.{key}", 'message': f"{key} must be a number between {low} and {high}"})
+
+    growth, churn = dynamics.get('growth', 0), dynamics.get('churn', 0)
+    if _is_number(growth) and _is_number(churn) and not growth - churn > -1:
+        errors.append({'path': f"{path}.churn",
+                       'message': f"growth - churn must be greater than -1 (got {growth - churn:g}), "
+                                  f"or the driver turns negative or zero after one month"})
+
+
+def _validate_correlations(correlations, names, errors):
+    if not isinstance(correlations, list):
+        errors.append({'path': 'correlations', 'message': 'correlations must be a list'})
+        return
+
+    seen = set()
+    for i, entry in enumerate(correlations):
+        path = f"correlations[{i}]"
+        if not isinstance(entry, dict):
+            errors.append({'path': path, 'message': 'correlation must be an object'})
+            continue
+        pair = entry.get('drivers')
+        if (not isinstance(pair, list) or len(pair) != 2
+                or not all(isinstance(name, str) for name in pair)):
+            errors.append({'path': f"{path}.drivers", 'message': 'drivers must be a list of two driver names'})
+        elif pair[0] == pair[1]:
+            errors.append({'path': f"{path}.drivers", 'message': 'a driver cannot be correlated with itself'})
+        else:
+            for name in pair:
+                if name not in names:
+                    errors.append({'path': f"{path}.drivers", 'message': f"unknown driver '{name}'"})
+            if frozenset(pair) in seen:
+                errors.append({'path': f"{path}.drivers", 'message': f"duplicate correlation for {pair}"})
+            seen.add(frozenset(pair))
+        rho = entry.get('rho')
+        if not _is_number(rho) or not -1 <= rho <= 1:
+            errors.append({'path': f"{path}.rho", 'message': 'rho must be a number between -1 and 1'})
+
+
+def _validate_levers(levers, names, errors):
+    if not isinstance(levers, dict):
+        errors.append({'path': 'levers', 'message': 'levers must be an object keyed by driver name'})
+        return
+    for name, spec in levers.items():
+        path = f"levers.{name}"
+        if name not in names:
+            errors.append({'path': path, 'message': f"unknown driver '{name}'"})
+        if not isinstance(spec, dict):
+            errors.append({'path': path, 'message': 'lever must be an object with low and high'})
+            continue
+        if not _is_number(spec.get('low')) or not _is_number(spec.get('high')):
+            errors.append({'path': path, 'message': 'low and high must be numbers'})
+        elif spec['low'] > spec['high']:
+            errors.append({'path': path, 'message': f"low ({spec['low']}) is greater than high ({spec['high']})"})
+        if spec.get('mode', 'set') not in LEVER_MODES:
+            errors.append({'path': f"{path}.mode", 'message': f"mode must be one of {list(LEVER_MODES)}"})
+
+
+def _names_usable(plan):
+    # The expression can be checked whenever every driver has a string name
+    return all(isinstance(plan.get(key), list)
+               and all(isinstance(d, dict) and isinstance(d.get('name'), str) for d in plan[key])
+               for key in ('revenue_drivers', 'cost_drivers'))
+
+
+def validate_plan(plan):
+    """
+    Check a parsed plan against PLAN_SCHEMA plus the rules a JSON schema
+    can't express (min <= max, unique names, a compilable profit
+    expression, correlations and levers on known drivers). Returns a
+    list of {'path', 'message'} errors; empty means valid.
+    """
+    if not isinstance(plan, dict):
+        return [{'path': '', 'message': 'plan must be a JSON object'}]
+
+    errors = []
+    if not isinstance(plan.get('decision'), str) or not plan['decision'].strip():
+        errors.append({'path': 'decision', 'message': 'decision must be a non-empty string'})
+
+    names = set()
+    for key in ('revenue_drivers', 'cost_drivers'):
+        drivers = plan.get(key)
+        if not isinstance(drivers, list):
+            errors.append({'path': key, 'message': f"{key} must be a list"})
+            continue
+        for i, driver in enumerate(drivers):
+            _validate_driver(driver, f"{key}[{i}]", errors)
+            name = driver.get('name') if isinstance(driver, dict) else None
+            if isinstance(name, str):
+                if name in names:
+                    errors.append({'path': f"{key}[{i}].name", 'message': f"duplicate driver name '{name}'"})
+                names.add(name)
+    if isinstance(plan.get('revenue_drivers'), list) and not plan['revenue_drivers']:
+        errors.append({'path': 'revenue_drivers', 'message': 'at least one revenue driver is required'})
+
+    if 'correlations' in plan:
+        _validate_correlations(plan['correlations'], names, errors)
+
+    if 'levers' in plan:
+        _validate_levers(plan['levers'], names, errors)
+
+    assumptions = plan.get('assumptions')
+    if not isinstance(assumptions, list) or not all(isinstance(a, str) for a in assumptions):
+        errors.append({'path': 'assumptions', 'message': 'assumptions must be a list of strings'})
+
+    expression = plan.get('profit_expression')
+    if expression is not None and not isinstance(expression, str):
+        errors.append({'path': 'profit_expression', 'message': 'profit_expression must be a string'})
+    elif _names_usable(plan):
+        try:
+            compile_profit_model(plan)
+        except ProfitExpressionError as e:
+            errors.append({'path': 'profit_expression', 'message': str(e)})
+
+    return errors
+
+
+def format_errors(errors):
+    """One line per validation error, for repair prompts and logs."""
+    return '\n'.join(f"- {e['path'] or '(plan)'}: {e['message']}" for e in errors)
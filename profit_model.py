@@ -0,0 +1,300 @@
+import ast
+import functools
+import numpy as np
+
+
+class ProfitExpressionError(ValueError):
+    """Raised when a plan's profit expression cannot be parsed or validated."""
+
+
+_BINARY_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+    ast.Pow: np.power,
+}
+
+_FUNCTIONS = {
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+
+def plan_drivers(plan):
+    """All drivers of a plan in sample-matrix row order (revenue first, then costs)."""
+    return list(plan['revenue_drivers']) + list(plan['cost_drivers'])
+
+
+def _name_matches(name, keywords):
+    name = name.lower()
+    return any(keyword in name for keyword in keywords)
+
+
+def _sum_of_names(names):
+    node = ast.Name(id=names[0])
+    for name in names[1:]:
+        node = ast.BinOp(left=node, op=ast.Add(), right=ast.Name(id=name))
+    return node
+
+
+def default_profit_tree(plan):
+    """
+    Build the profit expression for plans that don't carry one.
+    Mirrors the original keyword heuristic: subscribers x price when both
+    kinds of revenue driver exist, otherwise the sum of revenue drivers,
+    minus the sum of all cost drivers.
+    """
+    revenue_names = list(dict.fromkeys(d['name'] for d in plan['revenue_drivers']))
+    cost_names = list(dict.fromkeys(d['name'] for d in plan['cost_drivers']))
+
+    subscriber_keys = [k for k in revenue_names if _name_matches(k, ('subscriber', 'customer'))]
+    price_keys = [k for k in revenue_names if _name_matches(k, ('price', 'value', 'order'))]
+
+    if subscriber_keys and price_keys:
+        revenue = ast.BinOp(left=ast.Name(id=subscriber_keys[0]), op=ast.Mult(),
+                            right=ast.Name(id=price_keys[0]))
+    elif revenue_names:
+        revenue = _sum_of_names(revenue_names)
+    else:
+        revenue = ast.Constant(value=0.0)
+
+    if not cost_names:
+        return revenue
+    return ast.BinOp(left=revenue, op=ast.Sub(), right=_sum_of_names(cost_names))
+
+
+def parse_profit_expression(expression):
+    """Parse a profit expression string into an AST, rejecting anything but arithmetic."""
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ProfitExpressionError(f"Invalid profit expression {expression!r}: {e.msg}") from None
+    return tree.body
+
+
+class _Compiler:
+    """
+    Turns an expression AST into a flat list of in-place ufunc calls.
+
+    Operands are ('col', row) for a sample-matrix row, ('const', value) for a
+    folded constant, or ('buf', slot) for a scratch buffer. Scratch buffers are
+    recycled as soon as their value is consumed, so even long expressions only
+    need a handful of them.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.program = []
+        self.free = []
+        self.n_buffers = 0
+
+    def _acquire(self):
+        if self.free:
+            return self.free.pop()
+        self.n_buffers += 1
+        return self.n_buffers - 1
+
+    def _release(self, operand):
+        if operand[0] == 'buf':
+            self.free.append(operand[1])
+
+    def _target(self, *operands):
+        # Write in place into an operand's buffer whenever one is available
+        for operand in operands:
+            if operand[0] == 'buf':
+                for other in operands:
+                    if other is not operand:
+                        self._release(other)
+                return operand[1]
+        return self._acquire()
+
+    def compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)) \
+                and not isinstance(node.value, bool):
+            return ('const', float(node.value))
+
+        if isinstance(node, ast.Name):
+            if node.id not in self.index:
+                raise ProfitExpressionError(f"Unknown driver '{node.id}' in profit expression")
+            return ('col', self.index[node.id])
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, ast.UAdd):
+                return operand
+            if operand[0] == 'const':
+                return ('const', -operand[1])
+            slot = self._target(operand)
+            self.program.append((np.negative, operand, None, slot))
+            return ('buf', slot)
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+            ufunc = _BINARY_OPS[type(node.op)]
+            return self._emit(ufunc, self.compile(node.left), self.compile(node.right))
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and node.func.id in _FUNCTIONS and len(node.args) >= 2 and not node.keywords:
+            ufunc = _FUNCTIONS[node.func.id]
+            result = self.compile(node.args[0])
+            for arg in node.args[1:]:
+                result = self._emit(ufunc, result, self.compile(arg))
+            return result
+
+        raise ProfitExpressionError(
+            f"Unsupported syntax in profit expression: {ast.dump(node)[:60]}"
+        )
+
+    def _emit(self, ufunc, left, right):
+        if left[0] == 'const' and right[0] == 'const':
+            return ('const', float(ufunc(left[1], right[1])))
+        slot = self._target(left, right)
+        self.program.append((ufunc, left, right, slot))
+        return ('buf', slot)
+
+
+class ProfitModel:
+    """
+    A profit expression compiled against a plan's driver order.
+
+    `evaluate` reads driver rows straight out of a sample matrix (or any
+    sequence of per-driver columns/scalars) and runs the compiled ufunc
+    program in place, so no temporaries are created beyond the preallocated
+    scratch buffers.
+    """
+
+    def __init__(self, expression, driver_names, program, result, n_buffers):
+        self.expression = expression
+        self.driver_names = driver_names
+        self.program = program
+        self.result = result
+        self.n_buffers = n_buffers
+        self.used_rows = sorted({op[1] for step in program for op in step[1:3]
+                                 if op is not None and op[0] == 'col'}
+                                | ({result[1]} if result[0] == 'col' else set()))
+
+    def evaluate(self, samples, out=None):
+        """
+        Compute profit for every scenario.
+        samples: (n_drivers, n) matrix, or a sequence with one array or scalar per driver
+        out: optional preallocated output array
+        """
+        if out is None:
+            shape = np.broadcast_shapes(*(np.shape(samples[row]) for row in self.used_rows))
+            out = np.empty(shape)
+
+        if self.result[0] != 'buf':
+            value = self.result[1] if self.result[0] == 'const' else samples[self.result[1]]
+            out[...] = value
+            return out
+
+        buffers = [out] + [np.empty_like(out) for _ in range(self.n_buffers - 1)]
+
+        def resolve(operand):
+            kind, value = operand
+            if kind == 'col':
+                return samples[value]
+            if kind == 'buf':
+                return buffers[value]
+            return value
+
+        for ufunc, left, right, slot in self.program:
+            if right is None:
+                ufunc(resolve(left), out=buffers[slot])
+            else:
+                ufunc(resolve(left), resolve(right), out=buffers[slot])
+        return out
+
+
+def _build(tree, expression, driver_names):
+    index = {}
+    for i, name in enumerate(driver_names):
+        index.setdefault(name, i)
+
+    compiler = _Compiler(index)
+    result = compiler.compile(tree)
+    program = compiler.program
+
+    if result[0] == 'buf' and result[1] != 0:
+        # The root value must land in slot 0, which is the caller's `out` array
+        swap = {0: result[1], result[1]: 0}
+
+        def rename(operand):
+            if operand is not None and operand[0] == 'buf':
+                return ('buf', swap.get(operand[1], operand[1]))
+            return operand
+
+        program = [(ufunc, rename(left), rename(right), swap.get(slot, slot))
+                   for ufunc, left, right, slot in program]
+        result = ('buf', 0)
+    return ProfitModel(expression, driver_names, program, result, max(compiler.n_buffers, 1))
+
+
+@functools.lru_cache(maxsize=128)
+def _compile(expression, driver_names):
+    return _build(parse_profit_expression(expression), expression, driver_names)
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_default(revenue_names, cost_names):
+    plan = {
+        'revenue_drivers': [{'name': name} for name in revenue_names],
+        'cost_drivers': [{'name': name} for name in cost_names],
+    }
+    tree = default_profit_tree(plan)
+    return _build(tree, ast.unparse(tree), revenue_names + cost_names)
+
+
+def compile_profit_model(plan):
+    """
+    Parse, validate and compile the plan's profit expression (once per
+    distinct expression/driver set - compiled models are cached).
+
+    Plans may carry an explicit "profit_expression" such as
+    "monthly_subscribers * subscription_price - monthly_operations";
+    otherwise the revenue/cost heuristic in `default_profit_tree` is used.
+    """
+    revenue_names = tuple(d['name'] for d in plan['revenue_drivers'])
+    cost_names = tuple(d['name'] for d in plan['cost_drivers'])
+
+    expression = plan.get('profit_expression')
+    if expression:
+        return _compile(expression, revenue_names + cost_names)
+    return _compile_default(revenue_names, cost_names)
+
+
+def additive_terms(tree):
+    """
+    Split an expression AST into its top-level sum, as (sign, subtree) pairs
+    with profit = sum(sign * term). Additions, subtractions and unary minus
+    are flattened through parentheses; anything else is a single term.
+    """
+    terms = []
+
+    def walk(node, sign):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+            walk(node.left, sign)
+            walk(node.right, sign if isinstance(node.op, ast.Add) else -sign)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            walk(node.operand, -sign if isinstance(node.op, ast.USub) else sign)
+        else:
+            terms.append((sign, node))
+
+    walk(tree, 1)
+    return terms
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_terms(expression, driver_names):
+    return tuple((sign, _build(term, ast.unparse(term), driver_names))
+                 for sign, term in additive_terms(parse_profit_expression(expression)))
+
+
+def compile_profit_terms(plan):
+    """
+    The plan's profit expression compiled term by term: a tuple of
+    (sign, ProfitModel) whose signed sum is the full profit. Lets callers
+    recompute only the terms that read a changed driver.
+    """
+    model = compile_profit_model(plan)
+    return _compile_terms(model.expression, model.driver_names)
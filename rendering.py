@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+from streaming_stats import histogram_counts
+from instrumentation import current_span, span
+
+DEFAULT_OUTPUT_DIR = 'plots'
+
+# Summary keys a results plot needs; everything else (raw simulations) stays behind
+RESULT_KEYS = ('mean_profit', 'percentile_5', 'percentile_95', 'histogram')
+
+
+def new_run_id():
+    """Sortable, collision-free id for one run's output directory."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+class Renderer:
+    """
+    Headless plot writer: Agg canvases on a background thread pool.
+
+    Every run writes under its own directory (output_dir/run_id), so
+    concurrent runs never overwrite each other's PNGs. render_* calls
+    snapshot the small summary they need and return a Future for the
+    written path straight away (also available up front as future.path);
+    the analysis never waits on matplotlib. Rendering the same name twice
+    in one run adds a counter (simulation_results-2.png, ...).
+    Use as a context manager (or call close()) to wait for pending files.
+
+        with Renderer() as renderer:
+            renderer.render_results(results, plan)
+    """
+
+    def __init__(self, output_dir=DEFAULT_OUTPUT_DIR, run_id=None, max_workers=2, dpi=150):
+        self.run_id = run_id or new_run_id()
+        self.directory = os.path.join(output_dir, self.run_id)
+        self.dpi = dpi
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render')
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def path(self, name):
+        """Reserve an output path for `name` in this run's directory."""
+        with self._lock:
+            count = self._names[name] = self._names.get(name, 0) + 1
+        if count > 1:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem}-{count}{extension}"
+        return os.path.join(self.directory, name)
+
+    def submit(self, draw, name, *args, figsize=(12, 6)):
+        """Render draw(fig, *args) to `name` in the background; returns a Future for the path."""
+        path = self.path(name)
+        future = self._pool.submit(self._render, draw, path, figsize, args, current_span())
+        future.path = path
+        return future
+
+    def _render(self, draw, path, figsize, args, parent):
+        # A bare Figure on its own Agg canvas: no pyplot global state, safe off the main thread
+        with span('render.figure', parent=parent, file=os.path.basename(path)):
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            draw(fig, *args)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fig.savefig(path, dpi=self.dpi)
+        return path
+
+    def render_results(self, results, plan, name='simulation_results.png'):
+        summary = {key: results[key] for key in RESULT_KEYS if key in results}
+        if 'histogram' not in summary:
+            summary['histogram'] = histogram_counts(results['all_simulations'])
+        return self.submit(draw_results, name, summary, plan['decision'])
+
+    def render_sensitivity(self, ranked, name='sensitivity_analysis.png'):
+        return self.submit(draw_sensitivity, name, [(n, dict(d)) for n, d in ranked], figsize=(10, 6))
+
+    def render_time_series(self, results, plan, name='time_series_results.png'):
+        bands = {key: results[key] for key in ('months', 'monthly_profit_bands', 'cumulative_cash_bands')}
+        return self.submit(draw_time_series, name, bands, plan['decision'], figsize=(14, 6))
+
+    def close(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_renderer():
+    """Process-wide Renderer used by the visualize_* helpers (one run directory per process)."""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Renderer()
+        return _default
+
+
+def draw_results(fig, summary, decision):
+    """Profit histogram with the mean and the 5th/95th percentiles marked."""
+    ax = fig.add_subplot()
+
+    histogram = summary['histogram']
+    ax.stairs(histogram['counts'], histogram['edges'], fill=True,
+              edgecolor='black', alpha=0.7, color='steelblue')
+
+    # Add vertical lines for key statistics
+    ax.axvline(summary['mean_profit'], color='red', linestyle='--', linewidth=2,
+               label=f"Mean: ${summary['mean_profit']:,.0f}")
+    ax.axvline(summary['percentile_5'], color='orange', linestyle='--', linewidth=2,
+               label=f"5th percentile: ${summary['percentile_5']:,.0f}")
+    ax.axvline(summary['percentile_95'], color='green', linestyle='--', linewidth=2,
+               label=f"95th percentile: ${summary['percentile_95']:,.0f}")
+    ax.axvline(0, color='black', linestyle='-', linewidth=1, alpha=0.5)
+
+    ax.set_xlabel('Monthly Profit ($)', fontsize=12)
+    ax.set_ylabel('Frequency', fontsize=12)
+    ax.set_title(f'Monte Carlo Simulation: {decision[:50]}...', fontsize=14, fontweight='bold')
+    ax.legend()
+    ax.grid(axis='y', alpha=0.3)
+    fig.tight_layout()
+
+
+def draw_sensitivity(fig, ranked):
+    """Horizontal bars per driver: variance, or Sobol indices when present."""
+    ax = fig.add_subplot()
+
+    names = [item[0] for item in ranked]
+    variances = [item[1]['variance'] for item in ranked]
+    colors = ['#2ecc71' if item[1]['type'] == 'revenue' else '#e74c3c' for item in ranked]
+
+    if 'total_order' in ranked[0][1]:
+        # Sobol run: total-order bars with the first-order share outlined inside
+        totals = [item[1]['total_order'] for item in ranked]
+        firsts = [item[1]['first_order'] for item in ranked]
+        ax.barh(names, totals, color=colors, alpha=0.7, edgecolor='black')
+        ax.barh(names, firsts, fill=False, hatch='//', edgecolor='black', height=0.5)
+        ax.set_xlabel('Sobol Index (total-order bar, first-order hatched)', fontsize=12)
+    else:
+        ax.barh(names, variances, color=colors, alpha=0.7, edgecolor='black')
+        ax.set_xlabel('Variance (Impact on Outcome)', fontsize=12)
+
+    ax.set_ylabel('Variable', fontsize=12)
+    ax.set_title('Sensitivity Analysis: Which Variables Matter Most?', fontsize=14, fontweight='bold')
+    ax.grid(axis='x', alpha=0.3)
+
+    legend_elements = [
+        Patch(facecolor='#2ecc71', alpha=0.7, label='Revenue Driver'),
+        Patch(facecolor='#e74c3c', alpha=0.7, label='Cost Driver')
+    ]
+    ax.legend(handles=legend_elements)
+    fig.tight_layout()
+
+
+def draw_time_series(fig, bands, decision):
+    """Fan charts of monthly profit and cumulative cash."""
+    months = np.arange(1, bands['months'] + 1)
+    axes = fig.subplots(1, 2)
+
+    for ax, key, title in ((axes[0], 'monthly_profit_bands', 'Monthly Profit'),
+                           (axes[1], 'cumulative_cash_bands', 'Cumulative Cash')):
+        p5, p25, p50, p75, p95 = bands[key]
+        ax.fill_between(months, p5, p95, color='steelblue', alpha=0.2, label='5th-95th percentile')
+        ax.fill_between(months, p25, p75, color='steelblue', alpha=0.4, label='25th-75th percentile')
+        ax.plot(months, p50, color='navy', linewidth=2, label='Median')
+        ax.axhline(0, color='black', linewidth=1, alpha=0.5)
+        ax.set_xlabel('Month', fontsize=12)
+        ax.set_ylabel('USD', fontsize=12)
+        ax.set_title(title, fontsize=14, fontweight='bold')
+        ax.grid(alpha=0.3)
+        ax.legend()
+
+    fig.suptitle(f'{bands["months"]}-Month Projection: {decision[:50]}...', fontsize=14)
+    fig.tight_layout()
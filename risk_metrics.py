@@ -0,0 +1,127 @@
+import math
+import numpy as np
+from streaming_stats import ESTIMATE_QUANTILES, iid_standard_errors, standard_error_ranks
+
+# Tail probabilities for VaR and expected shortfall (0.05 = the worst 5% of scenarios)
+DEFAULT_LEVELS = (0.05, 0.01)
+# Points on the loss-probability curve, from break-even to the largest loss
+LOSS_CURVE_POINTS = 21
+
+
+def partial_select(values, qs=(), levels=()):
+    """
+    Quantiles and tail means from a single np.partition pass.
+
+    Every order statistic needed - the two neighbours of each quantile,
+    the last index of each tail, the min and the max - is passed to one
+    np.partition call, which places them all without a full sort.
+    Returns (quantiles, tail_means, min, max): quantiles for each q in qs,
+    interpolated linearly as np.quantile does, and for each level the mean
+    of the smallest ceil(level * n) values.
+    """
+    values = np.asarray(values).ravel()
+    n = values.size
+    positions = np.asarray(qs, dtype=float) * (n - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, n - 1)
+    tails = [max(1, math.ceil(level * n)) for level in levels]
+
+    kth = np.unique(np.r_[lower, upper, np.array(tails, dtype=int) - 1, 0, n - 1])
+    selected = np.partition(values, kth)
+
+    below, above = selected[lower], selected[upper]
+    quantiles = below + (positions - lower) * (above - below)
+    # With t - 1 in kth, the first t entries are exactly the t smallest values
+    tail_means = np.array([selected[:t].mean() for t in tails])
+    return quantiles, tail_means, float(selected[0]), float(selected[n - 1])
+
+
+def _loss_curve(largest_loss, probability_below, points):
+    """P(loss > x) for x from break-even to the largest loss, in percent."""
+    losses = np.linspace(0.0, max(largest_loss, 0.0), points)
+    return {'losses': losses, 'probability': probability_below(-losses) * 100}
+
+
+def _risk(levels, quantiles, tail_means, downside_deviation, loss_curve):
+    # VaR and expected shortfall are reported as losses: positive means money lost
+    return {
+        'levels': list(levels),
+        'value_at_risk': [float(-q) for q in quantiles],
+        'expected_shortfall': [float(-m) for m in tail_means],
+        'downside_deviation': float(downside_deviation),
+        'loss_curve': loss_curve,
+    }
+
+
+def risk_metrics(profit, levels=DEFAULT_LEVELS, curve_points=LOSS_CURVE_POINTS):
+    """
+    Tail risk of a profit vector, from one partial selection:
+    value_at_risk      loss exceeded with probability `level`, -Q(level)
+    expected_shortfall average loss over the worst `level` share (CVaR)
+    downside_deviation root mean square shortfall below break-even
+    loss_curve         'losses' from 0 to the largest loss and the
+                       'probability' (percent) of losing more than each
+    value_at_risk and expected_shortfall are lists aligned with 'levels'.
+    """
+    return summarize_profits(profit, levels, curve_points)['risk']
+
+
+def summarize_profits(profit, levels=DEFAULT_LEVELS, curve_points=LOSS_CURVE_POINTS, standard_errors=False):
+    """
+    Statistics of one vector of simulated profits. Every percentile, the
+    min/max and the tail means come from a single partial selection (see
+    partial_select) rather than a sort per percentile; 'risk' holds the
+    tail metrics described in risk_metrics. With standard_errors=True the
+    profits are taken as independent draws and 'standard_errors' holds
+    iid_standard_errors, whose rank quantiles join the same selection.
+    """
+    profit = np.asarray(profit).ravel()
+    band = np.concatenate(standard_error_ranks(profit.size)) if standard_errors else np.empty(0)
+    qs = list(ESTIMATE_QUANTILES.values()) + list(levels) + band.tolist()
+    quantiles, tail_means, low, high = partial_select(profit, qs, levels)
+    summary = dict(zip(ESTIMATE_QUANTILES, quantiles.tolist()))
+
+    shortfall = np.minimum(profit, 0.0)
+    downside = np.sqrt(np.dot(shortfall, shortfall) / profit.size)
+
+    def probability_below(thresholds):
+        # One pass: how many thresholds each profit reaches, then counts per threshold
+        order = np.argsort(thresholds)
+        reached = np.bincount(np.searchsorted(thresholds[order], profit, side='right'),
+                              minlength=thresholds.size + 1)
+        below = np.empty(thresholds.size)
+        below[order] = np.cumsum(reached)[:thresholds.size]
+        return below / profit.size
+
+    results = {
+        'mean_profit': float(np.mean(profit)),
+        'median_profit': summary['median_profit'],
+        'std_dev': float(np.std(profit)),
+        'min_profit': low,
+        'max_profit': high,
+        'percentile_5': summary['percentile_5'],
+        'percentile_25': summary['percentile_25'],
+        'percentile_75': summary['percentile_75'],
+        'percentile_95': summary['percentile_95'],
+        'probability_profitable': float(np.count_nonzero(profit > 0) / profit.size * 100),
+        'risk': _risk(levels, quantiles[len(ESTIMATE_QUANTILES):len(qs) - band.size], tail_means, downside,
+                      _loss_curve(-low, probability_below, curve_points)),
+    }
+    if standard_errors:
+        selected = dict(zip(band.tolist(), quantiles[len(qs) - band.size:].tolist()))
+        results['standard_errors'] = iid_standard_errors(dict(results, n_simulations=profit.size),
+                                                         lambda probabilities: [selected[p] for p in probabilities])
+    return results
+
+
+def streaming_risk_metrics(stats, levels=DEFAULT_LEVELS, curve_points=LOSS_CURVE_POINTS):
+    """
+    risk_metrics for a StreamingStats, so runs of 10^8 scenarios get them
+    without keeping the profits: quantiles, tail means and the loss curve
+    come from the t-digest (accurate in the tails, where its centroids are
+    smallest) and the downside deviation from an exact running sum.
+    """
+    digest = stats.digest
+    return _risk(levels, digest.quantile(list(levels)), [digest.tail_mean(level) for level in levels],
+                 np.sqrt(stats.loss_squares / stats.count),
+                 _loss_curve(-stats.min, digest.cdf, curve_points))
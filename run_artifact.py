@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+import numpy as np
+from profit_model import plan_drivers
+from sample_store import SampleStore, check_store
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes
+from instrumentation import log, span
+
+ARTIFACT_FORMAT = 'decision-run'
+ARTIFACT_VERSION = 1
+MANIFEST = 'manifest.json'
+COMPRESSED_COLUMNS = 'columns.npz'
+COLUMN_DTYPE = np.float32
+
+
+def to_jsonable(value):
+    """Results with numpy arrays/scalars turned into plain JSON types."""
+    if isinstance(value, dict):
+        return {key: to_jsonable(v) for key, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _write_npy(path, array):
+    """Copy an array (possibly a memmap bigger than RAM) into a float32 .npy file, chunk by chunk."""
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=COLUMN_DTYPE, shape=array.shape)
+    start = 0
+    for size in chunk_sizes(array.shape[-1], DEFAULT_CHUNK_SIZE):
+        out[..., start:start + size] = array[..., start:start + size]
+        start += size
+    out.flush()
+    del out
+
+
+def save_run(path, plan, results, ranked=None, samples=None, compress=False, overwrite=False):
+    """
+    Persist a run as a directory that later agents and audits can reopen
+    with load_run, without recomputing anything.
+
+    manifest.json holds the plan, seed, sampler, summary statistics,
+    standard errors, histogram and the sensitivity ranking (`ranked` from
+    sensitivity_analysis). The profit vector ('all_simulations', absent
+    from streaming runs) and the sample matrix (`samples`, a SampleStore
+    or (drivers x n) matrix) go to float32 .npy files that load_run
+    memory-maps, half the size of the float64 originals. compress=True
+    puts both in one compressed columns.npz instead: smaller on disk, but
+    it has to be decompressed into memory on load.
+
+    The run is written to a temporary sibling directory and renamed into
+    place, so a crash never leaves a half-written run behind. Returns the
+    run directory.
+    """
+    path = os.path.abspath(path)
+    if os.path.exists(path) and not overwrite:
+        raise FileExistsError(f"Run directory '{path}' already exists (pass overwrite=True to replace it)")
+
+    drivers = [d['name'] for d in plan_drivers(plan)]
+    columns = {}
+    if results.get('all_simulations') is not None:
+        columns['profit'] = (np.asarray(results['all_simulations']), None)
+    if samples is not None:
+        if isinstance(samples, SampleStore):
+            check_store(samples, plan)
+            samples = samples.matrix
+        if samples.shape[0] != len(drivers):
+            raise ValueError(f"Sample matrix has {samples.shape[0]} rows for {len(drivers)} plan drivers")
+        columns['samples'] = (samples, drivers)
+
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'plan': plan,
+        'seed': to_jsonable(results.get('seed')),
+        'sampler': results.get('sampler', 'random'),
+        'n_simulations': int(results['n_simulations']),
+        'results': to_jsonable({key: value for key, value in results.items() if key != 'all_simulations'}),
+        'ranking': [name for name, _ in ranked] if ranked is not None else None,
+        'sensitivities': to_jsonable(dict(ranked)) if ranked is not None else None,
+        'compressed': compress,
+        'columns': {},
+    }
+
+    temporary = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(temporary)
+    try:
+        with span('run_artifact.save', compressed=compress, columns=len(columns)):
+            if compress:
+                np.savez_compressed(os.path.join(temporary, COMPRESSED_COLUMNS),
+                                    **{name: array.astype(COLUMN_DTYPE) for name, (array, _) in columns.items()})
+            for name, (array, names) in columns.items():
+                entry = {'file': COMPRESSED_COLUMNS if compress else f"{name}.npy",
+                         'dtype': np.dtype(COLUMN_DTYPE).name, 'shape': list(array.shape)}
+                if names is not None:
+                    entry['drivers'] = names
+                if not compress:
+                    _write_npy(os.path.join(temporary, entry['file']), array)
+                manifest['columns'][name] = entry
+            with open(os.path.join(temporary, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(temporary, path)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+    return path
+
+
+class RunArtifact:
+    """
+    A saved run reopened by load_run.
+
+    `results` has the shape run_monte_carlo_simulation returned (with
+    'all_simulations' as a read-only float32 view when the profit vector
+    was saved), `ranked`/`sensitivities` that of sensitivity_analysis, and
+    `samples` is a SampleStore over the saved sample matrix (or None), so
+    the critic, the synthesizer and the charts can take them as they are.
+    """
+
+    def __init__(self, path, manifest, columns):
+        self.path = path
+        self.manifest = manifest
+        self.plan = manifest['plan']
+        self.seed = manifest['seed']
+        self.n_simulations = manifest['n_simulations']
+
+        self.results = dict(manifest['results'])
+        histogram = self.results.get('histogram')
+        if histogram is not None:
+            self.results['histogram'] = {key: np.asarray(value) for key, value in histogram.items()}
+        if 'profit' in columns:
+            self.results['all_simulations'] = columns['profit']
+
+        self.sensitivities = manifest['sensitivities']
+        self.ranked = ([(name, self.sensitivities[name]) for name in manifest['ranking']]
+                       if manifest['ranking'] is not None else None)
+
+        self.samples = None
+        if 'samples' in columns:
+            matrix = columns['samples']
+            entry = manifest['columns']['samples']
+            backing = 'npy' if isinstance(matrix, np.memmap) else 'memory'
+            self.samples = SampleStore(matrix, entry['drivers'], self.seed, backing,
+                                       path=os.path.join(path, entry['file']), owner=False,
+                                       sampler=manifest['sampler'])
+
+    def close(self):
+        """Drop the column maps so the files can be moved or deleted."""
+        self.results.pop('all_simulations', None)
+        self.samples = None
+
+
+def load_run(path, mmap=True):
+    """
+    Reopen a run saved by save_run. Columns stored as .npy are
+    memory-mapped read-only (mmap=False reads them into memory instead),
+    so opening a multi-GB run costs only the manifest; pages are read
+    from disk as they are touched. Compressed runs are decompressed into
+    memory.
+    """
+    path = os.path.abspath(path)
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != ARTIFACT_FORMAT or manifest.get('version') != ARTIFACT_VERSION:
+        raise ValueError(f"'{path}' is not a version {ARTIFACT_VERSION} {ARTIFACT_FORMAT} artifact")
+
+    columns = {}
+    if manifest['compressed'] and manifest['columns']:
+        with np.load(os.path.join(path, COMPRESSED_COLUMNS)) as archive:
+            columns = {name: archive[name] for name in manifest['columns']}
+    else:
+        for name, entry in manifest['columns'].items():
+            columns[name] = np.load(os.path.join(path, entry['file']), mmap_mode='r' if mmap else None)
+    return RunArtifact(path, manifest, columns)
+
+
+if __name__ == "__main__":
+    # Audit a saved run: python run_artifact.py runs/<run_id>/run
+    artifact = load_run(sys.argv[1])
+    results = artifact.results
+    log(f"📦 Run saved {artifact.manifest['created']}: {artifact.n_simulations:,} scenarios, "
+        f"seed {artifact.seed}, sampler {artifact.manifest['sampler']}")
+    log(f"  Mean profit: ${results['mean_profit']:,.0f}")
+    log(f"  5th-95th percentile: ${results['percentile_5']:,.0f} to ${results['percentile_95']:,.0f}")
+    log(f"  Probability profitable: {results['probability_profitable']:.1f}%")
+    if artifact.ranked:
+        log(f"  Top driver: {artifact.ranked[0][0]}")
+    for name, entry in artifact.manifest['columns'].items():
+        size = os.path.getsize(os.path.join(artifact.path, entry['file'])) / 2**20
+        log(f"  {name}: {' x '.join(map(str, entry['shape']))} {entry['dtype']} ({entry['file']}, {size:,.1f} MB)")
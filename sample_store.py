@@ -0,0 +1,206 @@
+import os
+import tempfile
+import uuid
+from multiprocessing import shared_memory
+import numpy as np
+from profit_model import plan_drivers
+from sampling import check_sampler, draw_samples, replicate_chunk_size
+from copula import plan_copula
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes, resolve_workers, run_tasks, seed_sequence
+from instrumentation import count, span
+
+BACKINGS = ('memory', 'shared', 'memmap')
+
+
+class SampleStore:
+    """
+    One contiguous (n_drivers, n_samples) float64 matrix of driver draws.
+
+    Built once per plan and read zero-copy by both the simulator and the
+    critic. With backing='shared' or 'memmap' the matrix lives in shared
+    memory or a file, and worker processes attach to it by handle instead
+    of receiving a pickled copy. backing='npy' is a saved run's read-only
+    float32 samples file (see run_artifact.load_run). `sampler` records how the draws were made
+    (see sampling.draw_uniforms).
+    """
+
+    def __init__(self, matrix, driver_names, seed, backing='memory', shm=None, path=None, owner=True,
+                 sampler='random'):
+        self.matrix = matrix
+        self.driver_names = tuple(driver_names)
+        self.seed = seed
+        self.backing = backing
+        self.sampler = sampler
+        self._shm = shm
+        self._path = path
+        self._owner = owner
+
+    @property
+    def n_drivers(self):
+        return self.matrix.shape[0]
+
+    @property
+    def n_samples(self):
+        return self.matrix.shape[1]
+
+    def row(self, name):
+        """View of one driver's column of draws."""
+        return self.matrix[self.driver_names.index(name)]
+
+    def handle(self):
+        """Picklable descriptor that attach_sample_store can reopen in another process."""
+        if self.backing == 'shared':
+            location = self._shm.name
+        elif self.backing in ('memmap', 'npy'):
+            location = self._path
+        else:
+            location = self.matrix
+        return (self.backing, location, self.matrix.shape, self.driver_names, self.seed)
+
+    def close(self):
+        """Release the backing memory (and delete it if this store created it)."""
+        self.matrix = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # Views handed out by row() are still alive; the mapping goes when they do
+                pass
+            if self._owner:
+                self._shm.unlink()
+            self._shm = None
+        if self._path is not None and self._owner and os.path.exists(self._path):
+            os.remove(self._path)
+        self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def chunk_sources(self, chunk_size, parallel=False):
+        """
+        One (handle, start, size) source per column chunk, for worker tasks.
+        In-process runs and in-memory stores get plain views of just that
+        chunk; shared/memmap stores are reopened by name inside workers.
+        """
+        sources = []
+        start = 0
+        for size in chunk_sizes(self.n_samples, chunk_size):
+            if parallel and self.backing != 'memory':
+                sources.append((self.handle(), start, size))
+            else:
+                view = self.matrix[:, start:start + size]
+                sources.append((('memory', view, view.shape, self.driver_names, self.seed), 0, size))
+            start += size
+        return sources
+
+
+# Stores attached inside this process, kept open for the life of the worker
+_attached = {}
+
+
+def _attach_shared(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track flag. Pool workers share the owner's
+        # resource tracker, so registering the same name again is harmless.
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_sample_store(handle):
+    """Reopen a store from SampleStore.handle() without copying the samples."""
+    backing, location, shape, driver_names, seed = handle
+    if backing == 'memory':
+        return SampleStore(location, driver_names, seed, backing, owner=False)
+
+    key = (backing, location)
+    if backing == 'npy':
+        # save_run(overwrite=True) replaces the file: key on its identity so a stale map is never reused
+        status = os.stat(location)
+        key += (status.st_ino, status.st_mtime_ns)
+        for stale in [k for k in _attached if k[:2] == key[:2] and k != key]:
+            _attached.pop(stale).close()
+    if key not in _attached:
+        if backing == 'shared':
+            shm = _attach_shared(location)
+            matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+            _attached[key] = SampleStore(matrix, driver_names, seed, backing, shm=shm, owner=False)
+        elif backing == 'npy':
+            # A saved run's samples file (see run_artifact), opened read-only
+            matrix = np.load(location, mmap_mode='r')
+            _attached[key] = SampleStore(matrix, driver_names, seed, backing, path=location, owner=False)
+        else:
+            matrix = np.memmap(location, dtype=np.float64, mode='r+', shape=shape)
+            _attached[key] = SampleStore(matrix, driver_names, seed, backing, path=location, owner=False)
+    return _attached[key]
+
+
+def read_columns(source):
+    """Zero-copy view of one chunk source from SampleStore.chunk_sources."""
+    handle, start, size = source
+    return attach_sample_store(handle).matrix[:, start:start + size]
+
+
+def _fill_chunk(task):
+    """Draw one chunk of every driver straight into the store's columns."""
+    source, plan, seed, sampler = task
+    columns = read_columns(source)
+    columns[...] = draw_samples(plan_drivers(plan), source[2], np.random.default_rng(seed),
+                                copula=plan_copula(plan), sampler=sampler)
+    if isinstance(columns, np.memmap):
+        columns.flush()
+
+
+def build_sample_store(plan, n_simulations=10000, seed=None, backing='memory', path=None, n_workers=None,
+                       sampler='random'):
+    """
+    Draw every driver of the plan once into a single SampleStore.
+
+    Chunks use the same SeedSequence streams as run_monte_carlo_simulation,
+    so simulating from the store reproduces a store-free run with the same seed
+    (and sampler).
+    """
+    if backing not in BACKINGS:
+        raise ValueError(f"Unknown sample store backing '{backing}', expected one of {BACKINGS}")
+    check_sampler(sampler)
+
+    drivers = plan_drivers(plan)
+    shape = (len(drivers), n_simulations)
+    nbytes = max(int(np.prod(shape)) * 8, 1)
+    root = seed_sequence(seed)
+
+    shm = None
+    if backing == 'shared':
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        matrix = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    elif backing == 'memmap':
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(), f"samples-{uuid.uuid4().hex}.f64")
+        matrix = np.memmap(path, dtype=np.float64, mode='w+', shape=shape)
+    else:
+        matrix = np.empty(shape)
+
+    store = SampleStore(matrix, [d['name'] for d in drivers], root.entropy, backing, shm=shm, path=path,
+                        sampler=sampler)
+
+    # In-memory stores can't be written by other processes; fill them here
+    workers = n_workers if backing != 'memory' else None
+    chunk = replicate_chunk_size(sampler, n_simulations, DEFAULT_CHUNK_SIZE)
+    sources = store.chunk_sources(chunk, parallel=resolve_workers(workers) > 1)
+    tasks = [(source, plan, child, sampler) for source, child in zip(sources, root.spawn(len(sources)))]
+    with span('sample_store.build', backing=backing, n_simulations=n_simulations, bytes=nbytes):
+        run_tasks(_fill_chunk, tasks, workers)
+        if backing == 'memmap':
+            matrix.flush()
+    count('samples.bytes', nbytes)
+    return store
+
+
+def check_store(store, plan):
+    """Make sure a store's rows line up with the plan's drivers."""
+    names = tuple(d['name'] for d in plan_drivers(plan))
+    if store.driver_names != names:
+        raise ValueError(f"Sample store drivers {store.driver_names} don't match plan drivers {names}")
@@ -0,0 +1,124 @@
+import math
+import warnings
+import numpy as np
+from distributions import get_distribution
+
+SAMPLERS = ('random', 'lhs', 'antithetic', 'sobol')
+
+# Variance-reduced samplers are run as this many independently randomized
+# replicates (at least), whose spread gives the standard errors
+MIN_REPLICATES = 10
+
+
+def check_sampler(sampler):
+    if sampler not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{sampler}', expected one of {SAMPLERS}")
+
+
+def replicate_chunk_size(sampler, n_samples, chunk_size):
+    """
+    Chunk size to use for a sampler. Plain random draws keep chunk_size;
+    the others shrink it so the run splits into at least MIN_REPLICATES
+    chunks, each an independent replicate.
+    """
+    if sampler == 'random':
+        return chunk_size
+    return max(1, min(chunk_size, math.ceil(n_samples / MIN_REPLICATES)))
+
+
+def draw_uniforms(n_drivers, n_samples, rng, sampler='random', out=None):
+    """
+    (n_drivers, n_samples) uniforms in [0, 1) from one of SAMPLERS:
+    'random'      independent pseudo-random draws
+    'lhs'         Latin hypercube: one draw in each of n equal strata per row
+    'antithetic'  the second half mirrors the first (u, 1 - u)
+    'sobol'       scrambled Sobol points (needs scipy); best with n a power of two
+    """
+    check_sampler(sampler)
+    if out is None:
+        out = np.empty((n_drivers, n_samples))
+
+    if sampler == 'random':
+        rng.random(out=out)
+    elif sampler == 'lhs':
+        for row in out:
+            row[...] = rng.permutation(n_samples)
+            row += rng.random(n_samples)
+            row /= n_samples
+    elif sampler == 'antithetic':
+        half = (n_samples + 1) // 2
+        out[:, :half] = rng.random((n_drivers, half))
+        np.subtract(1.0, out[:, :n_samples - half], out=out[:, half:])
+    else:
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("sampler='sobol' needs scipy (pip install scipy)") from None
+        with warnings.catch_warnings():
+            # Unbalanced (non power of two) point counts are still valid, just less even
+            warnings.simplefilter('ignore', UserWarning)
+            points = qmc.Sobol(n_drivers, scramble=True, seed=rng).random(n_samples)
+        out[...] = points.T
+    return out
+
+
+def draw_samples(drivers, n_samples, rng=None, out=None, copula=None, sampler='random'):
+    """
+    Draw every driver in one vectorized pass.
+    Returns a contiguous (n_drivers, n_samples) matrix, one row per driver,
+    written into `out` when a preallocated matrix is given. With a Copula
+    (see copula.plan_copula) the uniforms are correlated before each
+    driver's inverse CDF is applied: correlated drivers are drawn as
+    latent normals and mapped straight to their distribution.
+    `sampler` picks the uniform source (see draw_uniforms).
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    if out is None:
+        out = np.empty((len(drivers), n_samples))
+
+    if sampler != 'random':
+        draw_uniforms(len(drivers), n_samples, rng, sampler, out)
+        if copula is not None:
+            copula.correlate(out)
+        return uniforms_to_samples(drivers, out)
+
+    rng.random(out=out)
+    if copula is None:
+        return uniforms_to_samples(drivers, out)
+
+    # Correlated rows are overwritten from the copula's latent normals
+    latent = copula.latent_normals(rng, n_samples)
+    correlated = dict(zip(copula.indices, latent))
+    for i, (row, driver) in enumerate(zip(out, drivers)):
+        if i in correlated:
+            np.copyto(row, get_distribution(driver).from_normal(correlated[i], driver))
+        else:
+            get_distribution(driver).ppf(row, driver)
+    return out
+
+
+def uniforms_to_samples(drivers, u):
+    """
+    Map a (n_drivers, n) matrix of uniforms to driver values in place,
+    row by row through each driver's inverse CDF. Works for any uniform
+    source (pseudo-random, stratified or quasi-random).
+    """
+    for row, driver in zip(u, drivers):
+        get_distribution(driver).ppf(row, driver)
+    return u
+
+
+def draw_driver(driver, n_samples, rng=None, sampler='random'):
+    """Draw a single driver's column."""
+    return draw_samples([driver], n_samples, rng, sampler=sampler)[0]
+
+
+def driver_means(drivers):
+    """Exact mean of each driver's distribution, the known expectations for control variates."""
+    return np.array([get_distribution(d).mean(d) for d in drivers], dtype=float)
+
+
+def midpoints(drivers):
+    """Central value (median) of each driver, used when holding it fixed."""
+    return np.array([get_distribution(d).median(d) for d in drivers], dtype=float)
@@ -0,0 +1,203 @@
+import copy
+import itertools
+import numpy as np
+from profit_model import compile_profit_model, plan_drivers
+from sampling import check_sampler, draw_uniforms, uniforms_to_samples
+from copula import plan_copula
+from streaming_stats import StreamingStats
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes, run_tasks, seed_sequence
+from instrumentation import log, span
+
+
+def parameter_grid(plan, grid):
+    """
+    Variants of one plan over the cartesian product of `grid`, which maps
+    a driver name to a list of settings. A number pins the driver to that
+    value; a dict overrides driver fields (e.g. {"min": 20, "max": 30}).
+    Returns (label, plan) pairs.
+
+        parameter_grid(plan, {'subscription_price': [25, 30, 35]})
+    """
+    names = {d['name'] for d in plan_drivers(plan)}
+    unknown = set(grid) - names
+    if unknown:
+        raise ValueError(f"Unknown drivers in grid: {sorted(unknown)}")
+
+    variants = []
+    for settings in itertools.product(*grid.values()):
+        variant = copy.deepcopy(plan)
+        for driver in plan_drivers(variant):
+            if driver['name'] not in grid:
+                continue
+            setting = settings[list(grid).index(driver['name'])]
+            if isinstance(setting, dict):
+                driver.update(setting)
+            else:
+                driver.update({'min': setting, 'max': setting, 'distribution': 'uniform'})
+        label = ', '.join(f"{name}={setting}" for name, setting in zip(grid, settings))
+        variants.append((label, variant))
+    return variants
+
+
+def compare_scenarios(plans, labels=None, n_simulations=10000, seed=None, n_workers=None,
+                      baseline=0, sampler='random'):
+    """
+    Evaluate several plans on common random numbers and compare them.
+
+    Every chunk draws one uniform matrix with a row per distinct driver
+    name, and every plan reads its drivers' rows from it, so a driver
+    shared by two variants takes the same value in each scenario. The
+    comparison then only sees the plans' real differences, and paired
+    differences have far less variance than independent runs.
+
+    Returns each plan's profit summary, the matrices of P(row beats
+    column) and mean paired differences (with standard errors), the
+    distribution of each plan's difference to `baseline`, the probability
+    that each plan is the best in a scenario, and a table ranked by mean
+    profit.
+    """
+    check_sampler(sampler)
+    plans = list(plans)
+    labels = list(labels) if labels is not None else [p.get('decision', f"plan {i + 1}") for i, p in enumerate(plans)]
+    if len(labels) != len(plans):
+        raise ValueError("labels and plans must have the same length")
+    for plan in plans:
+        compile_profit_model(plan)
+
+    log(f"⚖️  Comparing {len(plans)} scenarios on {n_simulations:,} common random draws...")
+    log()
+
+    # One uniform row per driver name, shared by every plan that uses the name
+    names = list(dict.fromkeys(d['name'] for plan in plans for d in plan_drivers(plan)))
+    chunk = max(1, DEFAULT_CHUNK_SIZE // max(len(plans), len(names)))
+    root = seed_sequence(seed)
+    sizes = chunk_sizes(n_simulations, chunk)
+    tasks = [(plans, names, child, size, baseline, sampler) for child, size in zip(root.spawn(len(sizes)), sizes)]
+    with span('scenario_comparison.run', n_simulations=n_simulations, plans=len(plans), chunks=len(tasks)):
+        parts = run_tasks(_compare_chunk, tasks, n_workers)
+
+    stats, differences, count, means, comoments, wins, best = parts[0]
+    for part in parts[1:]:
+        for s, other in zip(stats, part[0]):
+            s.merge(other)
+        for d, other in zip(differences, part[1]):
+            d.merge(other)
+        # Chan et al. pairwise merge of means and co-moment matrices
+        other_count, other_means, other_comoments = part[2:5]
+        delta = other_means - means
+        total = count + other_count
+        comoments = comoments + other_comoments + np.outer(delta, delta) * count * other_count / total
+        means = means + delta * other_count / total
+        count = total
+        wins += part[5]
+        best += part[6]
+
+    # Paired differences: Var(a - b) = Var(a) + Var(b) - 2 Cov(a, b)
+    covariance = comoments / max(n_simulations - 1, 1)
+    variances = np.diag(covariance)
+    difference_variance = np.maximum(variances[:, None] + variances[None, :] - 2 * covariance, 0)
+
+    summaries = [s.summary() for s in stats]
+    results = {
+        'labels': labels,
+        'n_simulations': n_simulations,
+        'seed': root.entropy,
+        'baseline': labels[baseline],
+        'summaries': summaries,
+        'probability_beats': wins / n_simulations * 100,
+        'mean_difference': means[:, None] - means[None, :],
+        'difference_std_error': np.sqrt(difference_variance / n_simulations),
+        'probability_best': best / n_simulations * 100,
+        'differences': [],
+    }
+    for i, d in enumerate(differences):
+        summary = d.summary()
+        results['differences'].append({
+            'label': labels[i],
+            'mean': summary['mean_profit'],
+            'std_error': float(results['difference_std_error'][i, baseline]),
+            'percentile_5': summary['percentile_5'],
+            'median': summary['median_profit'],
+            'percentile_95': summary['percentile_95'],
+            'probability_better': float(results['probability_beats'][i, baseline]),
+        })
+
+    order = sorted(range(len(plans)), key=lambda i: summaries[i]['mean_profit'], reverse=True)
+    results['ranked'] = [{
+        'label': labels[i],
+        'mean_profit': summaries[i]['mean_profit'],
+        'std_error': float(np.sqrt(variances[i] / n_simulations)),
+        'percentile_5': summaries[i]['percentile_5'],
+        'percentile_95': summaries[i]['percentile_95'],
+        'probability_profitable': summaries[i]['probability_profitable'],
+        'mean_vs_baseline': results['differences'][i]['mean'],
+        'probability_beats_baseline': results['differences'][i]['probability_better'],
+        'probability_best': float(results['probability_best'][i]),
+    } for i in order]
+    return results
+
+
+def compare_grid(plan, grid, **kwargs):
+    """compare_scenarios over parameter_grid(plan, grid)."""
+    variants = parameter_grid(plan, grid)
+    return compare_scenarios([p for _, p in variants], labels=[label for label, _ in variants], **kwargs)
+
+
+def _compare_chunk(task):
+    """Evaluate every plan on one chunk of shared uniforms; returns mergeable partial results."""
+    plans, names, seed, size, baseline, sampler = task
+
+    uniforms = draw_uniforms(len(names), size, np.random.default_rng(seed), sampler)
+    profits = np.empty((len(plans), size))
+    for plan, out in zip(plans, profits):
+        drivers = plan_drivers(plan)
+        samples = uniforms[[names.index(d['name']) for d in drivers]]
+        copula = plan_copula(plan)
+        if copula is not None:
+            copula.correlate(samples)
+        compile_profit_model(plan).evaluate(uniforms_to_samples(drivers, samples), out=out)
+
+    stats = []
+    differences = []
+    for row in profits:
+        s = StreamingStats()
+        s.update(row)
+        stats.append(s)
+        d = StreamingStats()
+        d.update(row - profits[baseline])
+        differences.append(d)
+
+    # Row i beats column j in this many scenarios (one pass per row keeps memory at n_plans x size)
+    wins = np.array([(row > profits).sum(axis=1) for row in profits])
+    best = np.bincount(profits.argmax(axis=0), minlength=len(plans))
+    means = profits.mean(axis=1)
+    centred = profits - means[:, None]
+    return stats, differences, size, means, centred @ centred.T, wins, best
+
+
+def print_comparison(results):
+    """Ranked comparison table."""
+    print("="*60)
+    print(f"🏆 SCENARIOS RANKED BY MEAN PROFIT (baseline: {results['baseline']})")
+    print("="*60)
+    for i, row in enumerate(results['ranked'], 1):
+        print(f"{i}. {row['label']}")
+        print(f"   Mean profit: ${row['mean_profit']:,.0f} (± ${row['std_error']:,.0f})")
+        print(f"   5th-95th percentile: ${row['percentile_5']:,.0f} to ${row['percentile_95']:,.0f}")
+        print(f"   Probability profitable: {row['probability_profitable']:.1f}%")
+        print(f"   vs baseline: ${row['mean_vs_baseline']:+,.0f}, "
+              f"better in {row['probability_beats_baseline']:.1f}% of scenarios")
+        print(f"   Best option in {row['probability_best']:.1f}% of scenarios")
+        print()
+
+
+if __name__ == "__main__":
+    from agent_planner import plan_decision
+
+    question = "Should we launch a premium coffee subscription service?"
+    plan = plan_decision(question)
+
+    price = next((d for d in plan_drivers(plan) if 'price' in d['name']), plan['revenue_drivers'][-1])
+    points = np.linspace(price['min'], price['max'], 5).round(2).tolist()
+    results = compare_grid(plan, {price['name']: points}, n_simulations=100000)
+    print_comparison(results)
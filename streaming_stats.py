@@ -0,0 +1,352 @@
+import numpy as np
+
+
+def _compress(means, weights, total, compression):
+    """
+    Collapse sorted centroids into buckets of the k1 scale function, which
+    keeps buckets tiny near the tails and larger around the median.
+    """
+    cumulative = np.cumsum(weights)
+    q = (cumulative - weights / 2) / total
+    k = compression * (np.arcsin(2 * q - 1) / np.pi + 0.5)
+    bucket = np.floor(k)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    merged_weights = np.add.reduceat(weights, starts)
+    merged_means = np.add.reduceat(means * weights, starts) / merged_weights
+    return merged_means, merged_weights
+
+
+def _unit_buckets(n, compression):
+    """Bucket starts and sizes for n sorted unit-weight values under the k1 scale."""
+    q = (np.arange(n) + 0.5) / n
+    bucket = np.floor(compression * (np.arcsin(2 * q - 1) / np.pi + 0.5))
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    counts = np.diff(np.r_[starts, n]).astype(float)
+    return starts, counts
+
+
+class TDigest:
+    """
+    Mergeable streaming quantile sketch (merging t-digest).
+    Memory is O(compression) no matter how many values are added.
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """Add a chunk of raw values."""
+        values = np.sort(np.asarray(values, dtype=float).ravel())
+        if values.size == 0:
+            return
+        n = values.size
+        # Unit weights: bucket means come straight from reduceat over the sorted chunk
+        starts, counts = _unit_buckets(n, self.compression)
+        chunk = TDigest(self.compression)
+        chunk.means = np.add.reduceat(values, starts) / counts
+        chunk.weights = counts
+        chunk.count = n
+        chunk.min = values[0]
+        chunk.max = values[-1]
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Fold another digest into this one."""
+        if other.count == 0:
+            return
+        means = np.concatenate([self.means, other.means])
+        weights = np.concatenate([self.weights, other.weights])
+        order = np.argsort(means, kind='stable')
+        self.count += other.count
+        self.means, self.weights = _compress(means[order], weights[order],
+                                             self.count, self.compression)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _knots(self):
+        centers = np.cumsum(self.weights) - self.weights / 2
+        ranks = np.concatenate([[0.0], centers, [float(self.count)]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+        return ranks, values
+
+    def quantile(self, q):
+        """Approximate quantile(s) for q in [0, 1]."""
+        ranks, values = self._knots()
+        return np.interp(np.asarray(q) * self.count, ranks, values)
+
+    def cdf(self, x):
+        """Approximate fraction of values <= x."""
+        ranks, values = self._knots()
+        return np.interp(x, values, ranks) / self.count
+
+    def tail_mean(self, q):
+        """
+        Approximate mean of the smallest q share of values: the integral of
+        the piecewise-linear quantile function from 0 to q, over q.
+        """
+        ranks, values = self._knots()
+        cut = q * self.count
+        inside = ranks < cut
+        tail_ranks = np.r_[ranks[inside], cut]
+        tail_values = np.r_[values[inside], np.interp(cut, ranks, values)]
+        return float(np.sum((tail_values[1:] + tail_values[:-1]) / 2 * np.diff(tail_ranks)) / cut)
+
+
+def column_digests(values, compression=200):
+    """
+    One TDigest per column of an (n, m) matrix, e.g. one per month of
+    simulated paths. Every column has the same length, so a single sort
+    along axis 0 and one reduceat build all m digests at once.
+    """
+    values = np.sort(np.asarray(values, dtype=float), axis=0)
+    n = values.shape[0]
+    if n == 0:
+        return [TDigest(compression) for _ in range(values.shape[1])]
+    starts, counts = _unit_buckets(n, compression)
+    means = np.add.reduceat(values, starts, axis=0) / counts[:, None]
+    digests = []
+    for j in range(values.shape[1]):
+        digest = TDigest(compression)
+        digest.means = means[:, j]
+        digest.weights = counts
+        digest.count = n
+        digest.min = values[0, j]
+        digest.max = values[-1, j]
+        digests.append(digest)
+    return digests
+
+
+class Moments:
+    """
+    Count, mean and sum of squared deviations, updated chunk by chunk.
+    Merging uses the Chan et al. parallel formula, so partial results from
+    disjoint chunks combine exactly; merge them in a fixed order for
+    bit-identical output.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    @property
+    def variance(self):
+        return self.m2 / self.count if self.count else float('nan')
+
+    def _set_from(self, values):
+        self.count = values.size
+        if self.count:
+            self.mean = float(np.mean(values))
+            self.m2 = float(np.var(values)) * self.count
+
+    def update(self, values):
+        """Add a chunk of values."""
+        chunk = Moments()
+        chunk._set_from(values)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Fold another accumulator into this one."""
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+
+
+class StreamingStats(Moments):
+    """
+    Running summary of a profit stream: Welford/Chan mean and variance,
+    min/max, profitable count, the sum of squared losses (for the downside
+    deviation) and a t-digest for percentiles.
+    Two instances built from disjoint chunks merge exactly (up to the sketch).
+    """
+
+    def __init__(self, compression=200):
+        super().__init__()
+        self.n_profitable = 0
+        self.loss_squares = 0.0
+        self.digest = TDigest(compression)
+
+    @property
+    def min(self):
+        return self.digest.min
+
+    @property
+    def max(self):
+        return self.digest.max
+
+    def update(self, values):
+        """Add a chunk of profits."""
+        if values.size == 0:
+            return
+        chunk = StreamingStats(self.digest.compression)
+        chunk._set_from(values)
+        chunk.n_profitable = int(np.count_nonzero(values > 0))
+        losses = np.minimum(values, 0.0).ravel()
+        chunk.loss_squares = float(np.dot(losses, losses))
+        chunk.digest.update(values)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Fold another StreamingStats into this one."""
+        if other.count == 0:
+            return
+        super().merge(other)
+        self.n_profitable += other.n_profitable
+        self.loss_squares += other.loss_squares
+        self.digest.merge(other.digest)
+
+    def histogram(self, bins=50):
+        """Fixed-bin histogram reconstructed from the sketch (approximate counts)."""
+        edges = np.linspace(self.min, self.max, bins + 1)
+        counts = np.diff(self.digest.cdf(edges)) * self.count
+        return {'counts': counts, 'edges': edges}
+
+    def summary(self):
+        """Statistics in the same shape as run_monte_carlo_simulation's results."""
+        p5, p25, p50, p75, p95 = self.digest.quantile([0.05, 0.25, 0.5, 0.75, 0.95])
+        return {
+            'mean_profit': float(self.mean),
+            'median_profit': float(p50),
+            'std_dev': float(np.sqrt(self.variance)),
+            'min_profit': float(self.min),
+            'max_profit': float(self.max),
+            'percentile_5': float(p5),
+            'percentile_25': float(p25),
+            'percentile_75': float(p75),
+            'percentile_95': float(p95),
+            'probability_profitable': float(self.n_profitable / self.count * 100),
+        }
+
+
+def histogram_counts(values, bins=50):
+    """Fixed-bin histogram of raw values, in the same shape as StreamingStats.histogram."""
+    counts, edges = np.histogram(values, bins=bins)
+    return {'counts': counts, 'edges': edges}
+
+
+# Result keys that get a standard error, and the quantile each percentile estimates
+ESTIMATE_QUANTILES = {
+    'percentile_5': 0.05,
+    'percentile_25': 0.25,
+    'median_profit': 0.5,
+    'percentile_75': 0.75,
+    'percentile_95': 0.95,
+}
+ESTIMATE_KEYS = ('mean_profit', *ESTIMATE_QUANTILES, 'probability_profitable')
+
+
+def standard_error_ranks(n):
+    """
+    The probabilities iid_standard_errors reads for n draws: q + d and
+    q - d (clipped to [0, 1]) for each ESTIMATE_QUANTILES level, d = sqrt(q (1 - q) / n).
+    """
+    qs = np.array(list(ESTIMATE_QUANTILES.values()))
+    d = np.sqrt(qs * (1 - qs) / n)
+    return np.minimum(qs + d, 1), np.maximum(qs - d, 0)
+
+
+def iid_standard_errors(results, quantile):
+    """
+    Standard errors of a summary built from independent draws: s / sqrt(n)
+    for the mean, binomial for probability_profitable (in percent), and
+    for each percentile the quantile-function slope over one binomial SD
+    of rank, (Q(q + d) - Q(q - d)) / 2 with d = sqrt(q (1 - q) / n).
+    `results` needs 'std_dev' and 'n_simulations'; quantile(qs) returns
+    the pooled quantiles for an array of probabilities.
+    """
+    n = results['n_simulations']
+    p = results['probability_profitable'] / 100
+    errors = {
+        'mean_profit': results['std_dev'] / np.sqrt(n),
+        'probability_profitable': np.sqrt(p * (1 - p) / n) * 100,
+    }
+    upper, lower = standard_error_ranks(n)
+    spread = (np.asarray(quantile(upper)) - np.asarray(quantile(lower))) / 2
+    errors.update(zip(ESTIMATE_QUANTILES, spread))
+    return {key: float(errors[key]) for key in ESTIMATE_KEYS}
+
+
+def replicate_standard_errors(replicates):
+    """
+    Standard errors from independently randomized replicates (one summary
+    dict per replicate): the spread of each estimate across replicates
+    over sqrt(R). Stratified and quasi-random draws are not independent
+    within a replicate, so this is the honest way to measure them.
+    """
+    errors = {}
+    for key in ESTIMATE_KEYS:
+        estimates = np.array([r[key] for r in replicates])
+        errors[key] = float(np.std(estimates, ddof=1) / np.sqrt(len(estimates))) if len(estimates) > 1 else float('nan')
+    return errors
+
+
+class ControlVariateSums:
+    """
+    Mergeable sums for a linear control-variate estimate of the mean profit.
+
+    Controls are driver draws centred on their exact means, so they
+    average zero; regressing profit on them and subtracting the fitted
+    part of their sample mean removes the variance the drivers explain:
+    mean_cv = mean(y) - beta . mean(x).
+    """
+
+    def __init__(self, n_controls):
+        self.count = 0
+        self.sum_x = np.zeros(n_controls)
+        self.sum_y = 0.0
+        self.sum_xx = np.zeros((n_controls, n_controls))
+        self.sum_xy = np.zeros(n_controls)
+        self.sum_yy = 0.0
+
+    def update(self, x, y):
+        """Add a chunk: centred controls x (n_controls x n) and profits y (n)."""
+        self.count += y.size
+        self.sum_x += x.sum(axis=1)
+        self.sum_y += float(y.sum())
+        self.sum_xx += x @ x.T
+        self.sum_xy += x @ y
+        self.sum_yy += float(y @ y)
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum_x += other.sum_x
+        self.sum_y += other.sum_y
+        self.sum_xx += other.sum_xx
+        self.sum_xy += other.sum_xy
+        self.sum_yy += other.sum_yy
+
+    def _centred(self):
+        mean_x = self.sum_x / self.count
+        mean_y = self.sum_y / self.count
+        cxx = self.sum_xx - self.count * np.outer(mean_x, mean_x)
+        cxy = self.sum_xy - self.count * mean_x * mean_y
+        cyy = self.sum_yy - self.count * mean_y * mean_y
+        return mean_x, mean_y, cxx, cxy, cyy
+
+    def coefficients(self):
+        """Least-squares beta of profit on the controls."""
+        _, _, cxx, cxy, _ = self._centred()
+        return np.linalg.lstsq(cxx, cxy, rcond=None)[0]
+
+    def estimate(self, beta=None):
+        """Control-variate mean, with beta fitted here unless given (e.g. pooled over replicates)."""
+        if beta is None:
+            beta = self.coefficients()
+        return float(self.sum_y / self.count - beta @ (self.sum_x / self.count))
+
+    def standard_error(self):
+        """Standard error of estimate() for independent draws, from the regression residuals."""
+        _, _, cxx, cxy, cyy = self._centred()
+        beta = np.linalg.lstsq(cxx, cxy, rcond=None)[0]
+        dof = max(self.count - len(beta) - 1, 1)
+        residual = max(cyy - beta @ cxy, 0.0) / dof
+        return float(np.sqrt(residual / self.count))
@@ -0,0 +1,183 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PLAN = {
+    "decision": "Launch a premium coffee subscription service",
+    "revenue_drivers": [
+        {"name": "monthly_subscribers", "min": 100, "max": 500, "unit": "subscribers",
+         "distribution": "uniform", "description": "number of paying subscribers"},
+        {"name": "subscription_price", "min": 20, "max": 40, "unit": "USD per month",
+         "distribution": "uniform", "description": "monthly price per subscriber"}
+    ],
+    "cost_drivers": [
+        {"name": "monthly_operations", "min": 3000, "max": 8000, "unit": "USD per month",
+         "distribution": "uniform", "description": "operational costs per month"},
+        {"name": "coffee_supply", "min": 1000, "max": 3000, "unit": "USD per month",
+         "distribution": "uniform", "description": "beans and packaging per month"}
+    ],
+    "profit_expression": "monthly_subscribers * subscription_price - monthly_operations - coffee_supply",
+    "assumptions": ["Stable demand", "No new competitors"]
+}
+
+DEFAULT_RECOMMENDATION = (
+    "GO. The simulation shows a majority of profitable scenarios with a manageable downside. "
+    "Top priority: lock in supplier pricing before launch."
+)
+
+
+class StubOllamaServer:
+    """
+    Minimal stand-in for the Ollama HTTP API (/api/chat, /api/generate, /api/tags).
+
+    Planner prompts get `plan` back as JSON and the planner's repair turns
+    get `repaired_plan` (default: `plan` again), anything else gets
+    `recommendation`. Pass an invalid `plan` with a valid `repaired_plan`
+    to exercise a successful repair. Supports stream=True (NDJSON chunks), a fixed
+    per-request latency, and failing the first `fail_first` requests with
+    503 so retry paths can be exercised. Tracks how many requests were
+    served and the peak number handled at once.
+
+        with StubOllamaServer(latency=0.1) as stub:
+            plans = plan_decisions(questions, host=stub.host)
+    """
+
+    def __init__(self, plan=None, recommendation=DEFAULT_RECOMMENDATION, latency=0.0,
+                 fail_first=0, port=0, model='llama3.2', repaired_plan=None):
+        self.plan = plan or DEFAULT_PLAN
+        self.repaired_plan = repaired_plan or self.plan
+        self.recommendation = recommendation
+        self.latency = latency
+        self.fail_first = fail_first
+        self.model = model
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reply_for(self, prompt):
+        """Canned reply text for a prompt."""
+        if 'Structure this decision' in prompt:
+            return json.dumps(self.plan)
+        # agent_planner.REPAIR_PROMPT
+        if prompt.startswith('That plan is not valid'):
+            return json.dumps(self.repaired_plan)
+        return self.recommendation
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._send_json({'models': [{'name': stub.model, 'model': stub.model}]})
+                else:
+                    self._send_json({'error': 'not found'}, status=404)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+
+                with stub._lock:
+                    stub.requests += 1
+                    failing = stub.requests <= stub.fail_first
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                try:
+                    if stub.latency:
+                        time.sleep(stub.latency)
+                    if failing:
+                        self._send_json({'error': 'stub overloaded'}, status=503)
+                    elif self.path == '/api/chat':
+                        self._chat(request)
+                    elif self.path == '/api/generate':
+                        self._generate(request)
+                    else:
+                        self._send_json({'error': 'not found'}, status=404)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (e.g. timed out) before the reply was written
+                finally:
+                    with stub._lock:
+                        stub.in_flight -= 1
+
+            def _chat(self, request):
+                messages = request.get('messages') or [{}]
+                text = stub.reply_for(messages[-1].get('content', ''))
+                self._respond(request, text, lambda piece: {'message': {'role': 'assistant', 'content': piece}})
+
+            def _generate(self, request):
+                text = stub.reply_for(request.get('prompt', '')) if request.get('prompt') else ''
+                self._respond(request, text, lambda piece: {'response': piece})
+
+            def _respond(self, request, text, body):
+                base = {'model': request.get('model', stub.model),
+                        'created_at': datetime.now(timezone.utc).isoformat()}
+                pieces = text.split(' ')
+                pieces = [p + ' ' for p in pieces[:-1]] + pieces[-1:]
+                duration = max(int(stub.latency * 1e9), 1)
+                final = dict(base, done=True, done_reason='stop', eval_count=len(pieces),
+                             eval_duration=duration, total_duration=duration)
+
+                if not request.get('stream', True):
+                    self._send_json(dict(final, **body(text)))
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                for piece in pieces:
+                    self.wfile.write((json.dumps(dict(base, done=False, **body(piece))) + '\n').encode())
+                    self.wfile.flush()
+                self.wfile.write((json.dumps(dict(final, **body(''))) + '\n').encode())
+
+            def _send_json(self, payload, status=200):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+# Run standalone: python stub_ollama.py [port]
+if __name__ == "__main__":
+    import sys
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 11435
+    stub = StubOllamaServer(port=port).start()
+    print(f"🧪 Stub Ollama listening on {stub.host}")
+    print(f"   export OLLAMA_HOST={stub.host}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
@@ -0,0 +1,231 @@
+import functools
+import numpy as np
+from profit_model import compile_profit_model, plan_drivers
+from sampling import check_sampler, draw_samples
+from copula import plan_copula
+from streaming_stats import StreamingStats, column_digests
+from parallel_backend import DEFAULT_CHUNK_SIZE, chunk_sizes, run_tasks, seed_sequence
+from instrumentation import log, span
+from rendering import default_renderer
+
+FAN_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def driver_dynamics(driver):
+    """
+    A driver's month-to-month dynamics, from its optional "dynamics" object:
+    growth      monthly growth rate (0.02 = +2% a month)
+    churn       monthly fraction lost (0.01 = -1% a month)
+    volatility  standard deviation of the monthly log shock
+    persistence AR(1) coefficient of the shocks (1 = random walk, 0 = independent months)
+    Returns None for drivers that stay at their drawn value every month.
+    """
+    dynamics = driver.get('dynamics')
+    if not dynamics:
+        return None
+    return (float(dynamics.get('growth', 0.0)), float(dynamics.get('churn', 0.0)),
+            float(dynamics.get('volatility', 0.0)), float(dynamics.get('persistence', 1.0)))
+
+
+@functools.lru_cache(maxsize=64)
+def _trend(rate, months):
+    # Month 0 is the drawn value; month t has grown by rate**t
+    return np.cumprod(np.r_[1.0, np.full(months - 1, rate)]).astype(np.float32)
+
+
+@functools.lru_cache(maxsize=64)
+def _ar1_kernel(persistence, volatility, months):
+    """
+    Lower-triangular Toeplitz K with e = eps @ K.T, so e[t] = sum_s K[t, s] eps[s]
+    follows e[t] = persistence * e[t-1] + volatility * eps[t], e[0] = 0.
+    Also returns Var(e[t]), used to keep the multiplicative shocks mean-one.
+    """
+    lags = np.arange(months)[:, None] - np.arange(months)[None, :]
+    kernel = np.where(lags >= 0, volatility * persistence ** np.maximum(lags, 0), 0.0)
+    kernel[:, 0] = 0.0
+    variance = (kernel ** 2).sum(axis=1)
+    return kernel.T.astype(np.float32), (variance / 2).astype(np.float32)
+
+
+def driver_paths(start, dynamics, months, rng):
+    """
+    (n, months) float32 paths starting from the drawn values `start`:
+    start * trend * exp(shock - Var/2), with the AR(1) shocks for all months
+    from one matmul (a cumulative sum for a random walk).
+    """
+    growth, churn, volatility, persistence = dynamics
+    paths = start.astype(np.float32)[:, None] * _trend(1 + growth - churn, months)
+    if volatility == 0:
+        return paths
+
+    shocks = rng.standard_normal((start.size, months), dtype=np.float32)
+    if persistence == 1:
+        shocks[:, 0] = 0
+        np.cumsum(shocks, axis=1, out=shocks)
+        shocks *= volatility
+        half_variance = (volatility ** 2 * np.arange(months) / 2).astype(np.float32)
+    else:
+        kernel, half_variance = _ar1_kernel(persistence, volatility, months)
+        shocks = shocks @ kernel
+    shocks -= half_variance
+    np.exp(shocks, out=shocks)
+    paths *= shocks
+    return paths
+
+
+def run_time_series_simulation(plan, months=12, n_simulations=10000, annual_discount_rate=0.10,
+                               initial_investment=0.0, seed=None, n_workers=None, sampler='random',
+                               chunk_size=None):
+    """
+    Multi-period Monte Carlo: (scenarios x months) profit paths.
+
+    Each driver is drawn once per scenario (its distribution, correlations
+    and sampler as in run_monte_carlo_simulation) and then evolves by its
+    "dynamics" (see driver_dynamics); drivers without dynamics stay flat.
+    Monthly profit is the plan's profit expression applied month by month.
+
+    Paths are float32 and built in chunks of about DEFAULT_CHUNK_SIZE
+    cells, so 1M scenarios x 60 months never holds more than a few
+    chunk-sized matrices. Only per-month t-digests and running statistics
+    are kept. Returns fan bands (FAN_PERCENTILES of monthly profit and of
+    cumulative cash), the mean path, the final cumulative cash and NPV
+    distributions, and time-to-breakeven.
+    """
+    check_sampler(sampler)
+    compile_profit_model(plan)
+
+    log(f"📅 Projecting {n_simulations:,} scenarios over {months} months...")
+    log()
+
+    chunk = chunk_size or max(1, DEFAULT_CHUNK_SIZE // months)
+    root = seed_sequence(seed)
+    sizes = chunk_sizes(n_simulations, chunk)
+    monthly_rate = (1 + annual_discount_rate) ** (1 / 12) - 1
+    tasks = [(plan, child, size, months, monthly_rate, initial_investment, sampler)
+             for child, size in zip(root.spawn(len(sizes)), sizes)]
+    with span('time_series.run', n_simulations=n_simulations, months=months, chunks=len(tasks)):
+        parts = run_tasks(_project_chunk, tasks, n_workers)
+
+    profit_digests, cash_digests, profit_sums, final_cash, npv, breakeven = parts[0]
+    for part in parts[1:]:
+        for digest, other in zip(profit_digests, part[0]):
+            digest.merge(other)
+        for digest, other in zip(cash_digests, part[1]):
+            digest.merge(other)
+        profit_sums += part[2]
+        final_cash.merge(part[3])
+        npv.merge(part[4])
+        breakeven += part[5]
+
+    q = np.array(FAN_PERCENTILES) / 100
+    return {
+        'months': months,
+        'n_simulations': n_simulations,
+        'seed': root.entropy,
+        'fan_percentiles': FAN_PERCENTILES,
+        'monthly_profit_bands': np.array([d.quantile(q) for d in profit_digests]).T,
+        'cumulative_cash_bands': np.array([d.quantile(q) for d in cash_digests]).T,
+        'mean_monthly_profit': profit_sums / n_simulations,
+        'cumulative_cash': _distribution(final_cash),
+        'npv': _distribution(npv),
+        'breakeven': _breakeven_summary(breakeven, n_simulations),
+    }
+
+
+def _distribution(stats):
+    """Summary of a scalar outcome (final cash, NPV) across scenarios."""
+    summary = stats.summary()
+    return {
+        'mean': summary['mean_profit'],
+        'std_dev': summary['std_dev'],
+        'percentile_5': summary['percentile_5'],
+        'median': summary['median_profit'],
+        'percentile_95': summary['percentile_95'],
+        'probability_positive': summary['probability_profitable'],
+    }
+
+
+def _breakeven_summary(counts, n_simulations):
+    """counts[m] scenarios first reach non-negative cumulative cash in month m + 1; the last slot is 'never'."""
+    months = np.arange(1, counts.size)
+    reached = counts[:-1].sum()
+    cumulative = np.cumsum(counts[:-1]) / n_simulations
+    median = int(months[np.searchsorted(cumulative, 0.5)]) if cumulative.size and cumulative[-1] >= 0.5 else None
+    return {
+        'probability_within_horizon': float(reached / n_simulations * 100),
+        'median_month': median,
+        'mean_month_if_reached': float(counts[:-1] @ months / reached) if reached else None,
+        'counts': counts,
+    }
+
+
+def _project_chunk(task):
+    """Paths, monthly profit and path statistics for one chunk of scenarios."""
+    plan, seed, size, months, monthly_rate, initial_investment, sampler = task
+
+    model = compile_profit_model(plan)
+    drivers = plan_drivers(plan)
+    rng = np.random.default_rng(seed)
+    start = draw_samples(drivers, size, rng, copula=plan_copula(plan), sampler=sampler)
+
+    columns = []
+    for row, driver in zip(start, drivers):
+        dynamics = driver_dynamics(driver)
+        if dynamics is None:
+            # Flat drivers broadcast across months without being materialized
+            columns.append(row.astype(np.float32)[:, None])
+        else:
+            columns.append(driver_paths(row, dynamics, months, rng))
+
+    profit = model.evaluate(columns, out=np.empty((size, months), dtype=np.float32))
+    discount = (1 + monthly_rate) ** -np.arange(1, months + 1)
+    npv = profit @ discount.astype(np.float32)
+    npv -= initial_investment
+
+    profit_digests = column_digests(profit)
+    profit_sums = profit.sum(axis=0, dtype=np.float64)
+
+    # Cumulative cash after each month, accumulated in float64 so long horizons don't drift
+    cash = np.cumsum(profit, axis=1, dtype=np.float64, out=np.empty((size, months)))
+    cash -= initial_investment
+    cash_digests = column_digests(cash)
+
+    positive = cash >= 0
+    first = np.where(positive.any(axis=1), positive.argmax(axis=1), months)
+    breakeven = np.bincount(first, minlength=months + 1)
+
+    final_cash = StreamingStats()
+    final_cash.update(cash[:, -1])
+    npv_stats = StreamingStats()
+    npv_stats.update(npv.astype(np.float64))
+    return profit_digests, cash_digests, profit_sums, final_cash, npv_stats, breakeven
+
+
+def visualize_time_series(results, plan, renderer=None):
+    """Render the profit and cumulative-cash fan charts in the background; returns a Future for the path."""
+    renderer = renderer or default_renderer()
+    future = renderer.render_time_series(results, plan)
+    log(f"📊 Graph rendering to '{future.path}'")
+    return future
+
+
+if __name__ == "__main__":
+    from agent_planner import plan_decision
+
+    question = "Should we launch a premium coffee subscription service?"
+    plan = plan_decision(question)
+
+    results = run_time_series_simulation(plan, months=24, initial_investment=20000)
+
+    print("📊 PROJECTION RESULTS:")
+    npv = results['npv']
+    print(f"  NPV: mean ${npv['mean']:,.0f}, 5th-95th percentile ${npv['percentile_5']:,.0f} "
+          f"to ${npv['percentile_95']:,.0f}")
+    print(f"  Probability NPV > 0: {npv['probability_positive']:.1f}%")
+    breakeven = results['breakeven']
+    print(f"  Breakeven within {results['months']} months: {breakeven['probability_within_horizon']:.1f}%")
+    if breakeven['median_month'] is not None:
+        print(f"  Median breakeven month: {breakeven['median_month']}")
+    print()
+
+    visualize_time_series(results, plan)